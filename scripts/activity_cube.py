@@ -0,0 +1,108 @@
+"""
+Query the activity cube written by ``preprocess.py --store DIR --cube DIR``.
+
+The cube holds trips and summed duration (seconds) for every
+station x month x dow x hour x user_type cell as memory-mapped .npy files,
+so a new slice is a NumPy reduction over the cells it touches rather than
+a re-run over the raw trips. Filters take a label or a list of labels per
+dimension (see ``ActivityCube.labels``); ``by`` names the dimensions kept
+in the result, in that order.
+
+Usage:
+    from activity_cube import ActivityCube
+    cube = ActivityCube('./activity_cube')
+    cube.total(by=('hour',), user_type='Customer', dow=['Sat', 'Sun'])
+    cube.mean_duration(by=('month',), station='Market St at 10th St')
+
+    python scripts/activity_cube.py ./activity_cube --by dow hour --filter user_type=Subscriber
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+class ActivityCube:
+    def __init__(self, cube_dir):
+        with open(os.path.join(cube_dir, 'cube.json')) as f:
+            meta = json.load(f)
+        self.dims = tuple(meta['dims'])
+        self.shape = tuple(meta['shape'])
+        self.labels = meta['labels']
+        self.arrays = {name: np.load(os.path.join(cube_dir, path), mmap_mode='r')
+                       for name, path in meta['arrays'].items()}
+        self._index = {dim: {label: i for i, label in enumerate(self.labels[dim])} for dim in self.dims}
+
+    def _positions(self, dim, value):
+        values = value if isinstance(value, (list, tuple)) else [value]
+        try:
+            return [self._index[dim][v] for v in values]
+        except KeyError as e:
+            raise KeyError(f'{e.args[0]!r} is not a {dim} label') from None
+
+    def select(self, array='trips', **filters):
+        """Sub-cube of ``array`` restricted to ``filters``; every dimension is kept."""
+        unknown = set(filters) - set(self.dims)
+        if unknown:
+            raise ValueError(f"Unknown dimension(s): {', '.join(sorted(unknown))}")
+        a = self.arrays[array]
+        for axis, dim in enumerate(self.dims):
+            if filters.get(dim) is not None:
+                a = a[(slice(None),) * axis + (self._positions(dim, filters[dim]),)]
+        return a
+
+    def total(self, array='trips', by=(), **filters):
+        """Sum of ``array`` over every dimension not in ``by``, axes in ``by`` order."""
+        by = tuple(by)
+        a = self.select(array, **filters)
+        kept = [dim for dim in self.dims if dim in by]
+        summed = tuple(axis for axis, dim in enumerate(self.dims) if dim not in by)
+        out = a.sum(axis=summed, dtype=np.float64 if a.dtype.kind == 'f' else np.int64)
+        return np.transpose(out, [kept.index(dim) for dim in by])
+
+    def mean_duration(self, by=(), **filters):
+        """Average trip duration in seconds (NaN where there were no trips)."""
+        trips = self.total('trips', by, **filters)
+        dur = self.total('dur_sum', by, **filters)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(trips > 0, dur / trips, np.nan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a slice of the activity cube')
+    parser.add_argument('cube_dir', help='Directory written by preprocess.py --cube')
+    parser.add_argument('--by', nargs='*', default=[], help='Dimensions to keep (at most two)')
+    parser.add_argument('--filter', nargs='*', default=[], metavar='DIM=LABEL',
+                        help='Restrict a dimension to one label (repeat the dimension for several)')
+    args = parser.parse_args()
+
+    cube = ActivityCube(args.cube_dir)
+    filters = {}
+    for item in args.filter:
+        dim, _, label = item.partition('=')
+        if dim == 'hour':
+            label = int(label)
+        filters.setdefault(dim, []).append(label)
+    if len(args.by) > 2:
+        parser.error('--by takes at most two dimensions')
+
+    trips = cube.total('trips', args.by, **filters)
+    if not args.by:
+        print(f'{int(trips):,} trips')
+        return
+    row_dim = args.by[0]
+    rows = cube.labels[row_dim] if row_dim not in filters else filters[row_dim]
+    if len(args.by) == 1:
+        for label, n in zip(rows, trips):
+            print(f'{label!s:<40} {int(n):>10,}')
+        return
+    col_dim = args.by[1]
+    cols = cube.labels[col_dim] if col_dim not in filters else filters[col_dim]
+    print(f"{'':<40}" + ''.join(f'{c!s:>9}' for c in cols))
+    for label, row in zip(rows, trips):
+        print(f'{label!s:<40}' + ''.join(f'{int(n):>9,}' for n in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+End-to-end benchmark of preprocess.py and build_dashboard.py.
+
+Generates synthetic trip ZIPs with generate_trips.py (or uses --data-dir),
+then runs each stage below as its own process and records wall time, CPU
+time, trips per second and peak RSS. RSS comes from wait4, so it covers
+--workers processes too. A child's peak starts from the RSS of the process
+that forked it, so this script imports nothing heavy and generates the
+data in a subprocess as well.
+
+    preprocess_cold    preprocess.py with an empty per-ZIP cache
+    preprocess_cached  the same run again, every ZIP merged from the cache
+    store_sync         preprocess.py --store into an empty trip store
+    store_aggregate    preprocess.py --store again, aggregating the store only
+    build_dashboard    build_dashboard.py on the resulting JSON
+
+Each run is written to --results-dir as one JSON file (machine, commit,
+data set, stages); --compare prints every stage against an earlier file.
+
+Usage:
+    python scripts/bench_pipeline.py
+    python scripts/bench_pipeline.py --stations 1000 --months 24 --rows 500000 --workers 0
+    python scripts/bench_pipeline.py --data-dir ./data --label real-data
+    python scripts/bench_pipeline.py --compare bench_results/20261018-110512.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+NEW_SCHEMA_FROM = '2020-04'  # generate_trips.NEW_SCHEMA_FROM
+
+
+def pipeline_stages(data_dir, work_dir, workers):
+    """(name, argv) for every benchmarked stage, in run order."""
+    preprocess = [sys.executable, os.path.join(SCRIPTS, 'preprocess.py'), '--data-dir', data_dir,
+                  '--workers', str(workers)]
+    csv_run = preprocess + ['--output', os.path.join(work_dir, 'csv', 'dashboard_data.json'),
+                            '--cache-dir', os.path.join(work_dir, 'csv', 'cache')]
+    store_run = preprocess + ['--output', os.path.join(work_dir, 'store', 'dashboard_data.json'),
+                              '--store', os.path.join(work_dir, 'store', 'trip_store')]
+    build = [sys.executable, os.path.join(SCRIPTS, 'build_dashboard.py'),
+             '--input', os.path.join(work_dir, 'csv', 'dashboard_data.json'),
+             '--output', os.path.join(work_dir, 'site', 'index.html')]
+    return [
+        ('preprocess_cold', csv_run),
+        ('preprocess_cached', csv_run),
+        ('store_sync', store_run),
+        ('store_aggregate', store_run),
+        ('build_dashboard', build),
+    ]
+
+
+def run_stage(argv, log_path):
+    """Run one stage to completion; wall / CPU seconds and peak RSS (MB) of it and its children."""
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(argv, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        with open(log_path) as f:
+            tail = f.read()[-2000:]
+        raise RuntimeError(f'{os.path.basename(argv[1])} exited with {proc.returncode}:\n{tail}')
+    rss_unit = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB elsewhere
+    return {
+        'seconds': round(seconds, 3),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        'peak_rss_mb': round(usage.ru_maxrss / rss_unit, 1),
+    }
+
+
+def library_versions():
+    out = subprocess.run([sys.executable, '-c', 'import numpy, pandas; print(numpy.__version__, pandas.__version__)'],
+                         capture_output=True, text=True, check=True).stdout.split()
+    return dict(zip(('numpy', 'pandas'), out))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stages(stages):
+    print(f"\n{'stage':<18} {'wall s':>8} {'cpu s':>8} {'trips/s':>11} {'peak RSS MB':>12}")
+    for name, s in stages.items():
+        print(f"{name:<18} {s['seconds']:>8.2f} {s['cpu_seconds']:>8.2f} {s['trips_per_sec']:>11,.0f} "
+              f"{s['peak_rss_mb']:>12.1f}")
+
+
+def print_comparison(result, baseline):
+    print(f"\nvs {baseline.get('label') or baseline['timestamp']} ({(baseline.get('commit') or '?')[:10]}):")
+    print(f"{'stage':<18} {'wall s':>8} {'before':>8} {'change':>8} {'RSS MB':>8} {'before':>8}")
+    for name, s in result['stages'].items():
+        b = baseline['stages'].get(name)
+        if b is None:
+            print(f"{name:<18} {s['seconds']:>8.2f} {'-':>8}")
+            continue
+        change = (s['seconds'] / b['seconds'] - 1) * 100 if b['seconds'] else 0
+        print(f"{name:<18} {s['seconds']:>8.2f} {b['seconds']:>8.2f} {change:>+7.1f}% "
+              f"{s['peak_rss_mb']:>8.1f} {b['peak_rss_mb']:>8.1f}")
+    if baseline.get('data') != result['data']:
+        print('(the two runs used different data sets)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the preprocessing pipeline and dashboard build')
+    parser.add_argument('--data-dir', default=None, help='Benchmark these ZIPs instead of generating data')
+    parser.add_argument('--stations', type=int, default=500, help='Synthetic data: number of stations')
+    parser.add_argument('--months', type=int, default=12, help='Synthetic data: number of months')
+    parser.add_argument('--rows', type=int, default=200_000, help='Synthetic data: trips per month')
+    parser.add_argument('--start-month', default='2019-10',
+                        help='Synthetic data: first month (the schema switches at '
+                             f'{NEW_SCHEMA_FROM})')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic data: random seed')
+    parser.add_argument('--workers', type=int, default=1, help='preprocess.py --workers')
+    parser.add_argument('--work-dir', default=None, help='Scratch directory (default: a new temporary one)')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+    parser.add_argument('--results-dir', default='./bench_results', help='Where to write the JSON result')
+    parser.add_argument('--label', default='', help='Name for this run in the results')
+    parser.add_argument('--compare', default=None, help='Earlier result JSON to compare against')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    for sub in ('csv', 'store', 'site'):
+        os.makedirs(os.path.join(work_dir, sub), exist_ok=True)
+    try:
+        if args.data_dir:
+            data_dir = args.data_dir
+            data = {'source': os.path.abspath(data_dir)}
+        else:
+            data_dir = os.path.join(work_dir, 'data')
+            data = {'source': 'synthetic', 'stations': args.stations, 'months': args.months,
+                    'rows_per_month': args.rows, 'start_month': args.start_month, 'seed': args.seed}
+            print(f'Generating {args.months} months x {args.rows:,} trips, {args.stations} stations...')
+            generate = run_stage([sys.executable, os.path.join(SCRIPTS, 'generate_trips.py'), data_dir,
+                                  '--stations', str(args.stations), '--months', str(args.months),
+                                  '--rows', str(args.rows), '--start-month', args.start_month,
+                                  '--seed', str(args.seed)], os.path.join(work_dir, 'generate.log'))
+            print(f"  {generate['seconds']:.1f}s")
+        zips = sorted(glob.glob(os.path.join(data_dir, '*.zip')))
+        data['zips'] = len(zips)
+        data['zip_bytes'] = sum(os.path.getsize(z) for z in zips)
+
+        stages = {}
+        for name, argv in pipeline_stages(data_dir, work_dir, args.workers):
+            print(f'Running {name}...')
+            stages[name] = run_stage(argv, os.path.join(work_dir, f'{name}.log'))
+        with open(os.path.join(work_dir, 'csv', 'dashboard_data.json')) as f:
+            data['trips'] = json.load(f)['summary']['total_trips']
+        for s in stages.values():
+            s['trips_per_sec'] = round(data['trips'] / s['seconds']) if s['seconds'] else 0
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'machine': {'platform': platform.platform(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+                    **library_versions()},
+        'workers': args.workers,
+        'data': data,
+        'stages': stages,
+    }
+    os.makedirs(args.results_dir, exist_ok=True)
+    suffix = f'-{args.label}' if args.label else ''
+    out_path = os.path.join(args.results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}{suffix}.json")
+    with open(out_path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n{data['trips']:,} trips in {data['zips']} ZIPs ({data['zip_bytes'] / 1024 / 1024:.1f} MB)")
+    print_stages(stages)
+    print(f'\nResults: {out_path}' + (f' (scratch kept in {work_dir})' if args.keep or args.work_dir else ''))
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
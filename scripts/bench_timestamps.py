@@ -0,0 +1,76 @@
+"""
+Micro-benchmark: timestamp parsing and calendar features for one month of trips.
+
+Compares the old per-row path (format inference, .dt accessors and a
+'YYYY-MM' string per row via to_period) with preprocess.py's fixed-format
+parse plus integer month / hour-of-week codes, for both trip schemas.
+
+Usage:
+    python scripts/bench_timestamps.py
+    python scripts/bench_timestamps.py --rows 2000000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import preprocess  # noqa: E402
+
+
+def synthetic_month(rows, fmt, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2023-05-01') + pd.to_timedelta(rng.integers(0, 31 * 86400 * 1000, rows), 'ms')
+    values = start.strftime(fmt)
+    if fmt.endswith('%f'):
+        values = values.str[:-2]  # legacy files carry 4 fractional digits
+    return pd.Series(values, dtype='str')
+
+
+def old_path(values):
+    start = pd.to_datetime(values, errors='coerce')
+    return (start.dt.to_period('M').astype(str), start.dt.hour, start.dt.dayofweek, start.dt.year)
+
+
+def new_path(values):
+    fmt = preprocess.detect_timestamp_format(values)
+    start = preprocess.parse_timestamps(values, fmt)
+    return preprocess.calendar_codes(start)
+
+
+def best_of(fn, values, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(values)
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark timestamp parsing and calendar features')
+    parser.add_argument('--rows', type=int, default=2_000_000, help='Rows in the synthetic month')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the best is reported')
+    args = parser.parse_args()
+
+    print(f"{'schema':<8} {'old (s)':>9} {'new (s)':>9} {'speedup':>8}")
+    for schema, fmt in (('legacy', '%Y-%m-%d %H:%M:%S.%f'), ('new', '%Y-%m-%d %H:%M:%S')):
+        values = synthetic_month(args.rows, fmt)
+
+        # Both paths must agree before their timings mean anything
+        ym, hour, dow, _ = old_path(values)
+        month, how = new_path(values)
+        labels = {m: preprocess.month_label(m) for m in np.unique(month).tolist()}
+        assert (ym.to_numpy() == pd.Series(month).map(labels).to_numpy()).all()
+        assert np.array_equal(how, dow.to_numpy() * 24 + hour.to_numpy())
+
+        old = best_of(old_path, values, args.repeat)
+        new = best_of(new_path, values, args.repeat)
+        print(f"{schema:<8} {old:>9.3f} {new:>9.3f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,219 +1,628 @@
 """
 Build the complete Bay Wheels dashboard HTML with embedded data.
 
+The data is embedded as a columnar payload rather than the JSON row objects:
+every table becomes one column per field, numbers as base64 little-endian
+typed arrays (decimals stored as scaled integers) and strings
+dictionary-encoded, with station names shared across tables. A small
+decoder in the page turns it back into TypedArrays (``COLS``) and, on first
+use, the row objects the charts read (``DATA``).
+
+Only the overview shard is inlined. Stations, routes, time patterns and the
+per-station monthly detail are written as separate payload files under
+--shard-dir and fetched the first time a tab needs them, so the page has to
+be served over HTTP (e.g. ``python -m http.server``) rather than opened
+from disk. The monthly detail ships as a dense station x month matrix whose
+rows follow the station table, and the routes shard carries offset tables
+from each station to its routes, so neither view scans a whole table.
+
+The stylesheet and application script go to --asset-dir. Shards, CSS and JS
+are named by content hash (``name.<hash>.ext``), so they can be cached
+forever and a monthly rebuild only changes the files whose content changed.
+Each gets ``.gz`` and, when the ``brotli`` package is installed, ``.br``
+siblings for hosts that serve precompressed files. Hashed files left over
+from earlier builds are removed, except in the directory of --input or
+--output.
+
 Usage:
     python scripts/build_dashboard.py
     python scripts/build_dashboard.py --input ./dashboard_data.json --output ./index.html
 """
 import json
 import argparse
+import base64
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
 
-parser = argparse.ArgumentParser(description='Build Bay Wheels dashboard HTML')
-parser.add_argument('--input', default='./dashboard_data.json', help='Input JSON data path')
-parser.add_argument('--output', default='./index.html', help='Output HTML path')
-args = parser.parse_args()
+import numpy as np
 
-with open(args.input) as f:
-    data = json.load(f)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-data_json = json.dumps(data, separators=(',', ':'))
+# Data shards fetched on demand (name -> dashboard_data.json keys); every
+# other key goes to the inlined overview shard.
+SHARDS = {
+    'stations': ('stations',),
+    'routes': ('top_routes', 'route_sketch'),
+    'time': ('hourly', 'dow', 'heatmap'),
+    'station_detail': ('station_monthly', 'station_flow'),
+}
+# station_flow fields: average weekday net flow (arrivals - departures) by
+# 9am / by 6pm, and 24-hour profiles of an average weekday and weekend day
+PRESSURE_KEYS = ('net_by_9am', 'net_by_6pm')
+HOURLY_FLOW_KEYS = ('weekday_departures', 'weekday_arrivals', 'weekend_departures', 'weekend_arrivals')
+# Destinations and origins kept per station from the OD matrix
+TOP_OD = 10
 
-html = f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>Bay Wheels Explorer</title>
-<link rel="preconnect" href="https://fonts.googleapis.com">
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-<script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-<style>
-*{{margin:0;padding:0;box-sizing:border-box}}
-:root{{--bg:#0a0e1a;--card:#111827;--card2:#1a2236;--border:#1e293b;--text:#e2e8f0;--text2:#94a3b8;--accent:#0077C8;--accent2:#00BFA5;--red:#ef4444;--green:#22c55e;--yellow:#eab308}}
-body{{font-family:'Inter',sans-serif;background:var(--bg);color:var(--text);min-height:100vh;overflow-x:hidden}}
-.hero{{background:linear-gradient(135deg,#0a0e1a 0%,#0f172a 50%,#1e1b4b 100%);padding:40px 24px 24px;text-align:center;border-bottom:1px solid var(--border)}}
-.hero h1{{font-size:2.4rem;font-weight:800;background:linear-gradient(135deg,#60a5fa,#00BFA5);-webkit-background-clip:text;-webkit-text-fill-color:transparent;margin-bottom:6px;display:flex;align-items:center;justify-content:center;gap:12px}}
-.hero h1 .icon{{font-size:2rem;-webkit-text-fill-color:#60a5fa}}
-.hero .sub{{color:var(--text2);font-size:.95rem;margin-bottom:20px;font-weight:300}}
-.stats-row{{display:flex;justify-content:center;gap:16px;flex-wrap:wrap}}
-.stat-badge{{background:rgba(255,255,255,.05);border:1px solid var(--border);border-radius:12px;padding:12px 20px;text-align:center;min-width:130px}}
-.stat-badge .val{{font-size:1.3rem;font-weight:700;color:#60a5fa}}
-.stat-badge .lbl{{font-size:.7rem;color:var(--text2);text-transform:uppercase;letter-spacing:.5px;margin-top:2px}}
-.tabs{{display:flex;justify-content:center;gap:4px;padding:12px 24px;background:var(--card);border-bottom:1px solid var(--border);position:sticky;top:0;z-index:1000}}
-.tab{{padding:10px 20px;border-radius:8px;cursor:pointer;font-size:.85rem;font-weight:500;color:var(--text2);transition:all .2s;border:none;background:none}}
-.tab:hover{{color:var(--text);background:rgba(255,255,255,.05)}}
-.tab.active{{background:var(--accent);color:#fff}}
-.content{{max-width:1400px;margin:0 auto;padding:24px}}
-.panel{{display:none}}.panel.active{{display:block}}
-.grid{{display:grid;gap:20px}}.grid-2{{grid-template-columns:1fr 1fr}}.grid-3{{grid-template-columns:1fr 1fr 1fr}}
-@media(max-width:900px){{.grid-2,.grid-3{{grid-template-columns:1fr}}.stats-row{{gap:8px}}.stat-badge{{min-width:100px;padding:8px 12px}}.hero h1{{font-size:1.6rem}}.tabs{{overflow-x:auto;justify-content:flex-start}}}}
-.card{{background:var(--card);border:1px solid var(--border);border-radius:16px;padding:20px;position:relative;overflow:hidden}}
-.card::before{{content:'';position:absolute;top:0;left:0;right:0;height:1px;background:linear-gradient(90deg,transparent,rgba(96,165,250,.3),transparent)}}
-.card h3{{font-size:.85rem;color:var(--text2);text-transform:uppercase;letter-spacing:.5px;margin-bottom:16px;font-weight:600}}
-.chart-container{{position:relative;width:100%;height:300px}}
-.chart-container.tall{{height:400px}}
-.toggle-row{{display:flex;gap:6px;margin-bottom:12px}}
-.toggle-btn{{padding:4px 12px;border-radius:6px;font-size:.75rem;cursor:pointer;border:1px solid var(--border);background:transparent;color:var(--text2);transition:all .15s}}
-.toggle-btn.active{{background:var(--accent);border-color:var(--accent);color:#fff}}
-.insight-card{{background:linear-gradient(135deg,rgba(96,165,250,.08),rgba(0,191,165,.05));border:1px solid rgba(96,165,250,.15);border-radius:12px;padding:16px;margin-bottom:12px}}
-.insight-card .num{{font-size:1.4rem;font-weight:700;color:#60a5fa}}.insight-card .desc{{font-size:.85rem;color:var(--text2);margin-top:4px}}
-#map{{width:100%;height:600px;border-radius:12px;border:1px solid var(--border)}}
-.map-controls{{display:flex;gap:12px;margin-bottom:12px;flex-wrap:wrap;align-items:center}}
-.map-controls input,.map-controls select{{background:var(--card2);color:var(--text);border:1px solid var(--border);border-radius:8px;padding:8px 12px;font-size:.85rem;font-family:inherit}}
-.map-controls input{{flex:1;min-width:200px}}.map-controls select{{min-width:160px}}
-.map-legend{{display:flex;gap:16px;margin-top:12px;justify-content:center;font-size:.75rem;color:var(--text2)}}
-.map-legend span{{display:flex;align-items:center;gap:4px}}
-.map-legend .dot{{width:10px;height:10px;border-radius:50%;display:inline-block}}
-table{{width:100%;border-collapse:collapse;font-size:.82rem}}
-th{{text-align:left;padding:10px 12px;border-bottom:2px solid var(--border);color:var(--text2);font-weight:600;cursor:pointer;white-space:nowrap;text-transform:uppercase;font-size:.7rem;letter-spacing:.5px;user-select:none}}
-th:hover{{color:var(--text)}}
-td{{padding:8px 12px;border-bottom:1px solid rgba(255,255,255,.04)}}
-tr:hover td{{background:rgba(255,255,255,.02)}}
-.search-box{{width:100%;background:var(--card2);color:var(--text);border:1px solid var(--border);border-radius:8px;padding:10px 14px;font-size:.85rem;margin-bottom:16px;font-family:inherit}}
-.page-controls{{display:flex;justify-content:center;gap:8px;margin-top:16px;align-items:center}}
-.page-btn{{padding:6px 14px;border-radius:6px;border:1px solid var(--border);background:var(--card2);color:var(--text);cursor:pointer;font-size:.8rem;font-family:inherit}}
-.page-btn.active{{background:var(--accent);border-color:var(--accent)}}
-.page-btn:disabled{{opacity:.3;cursor:not-allowed}}
-.mini-bar{{height:6px;border-radius:3px;background:var(--card2);overflow:hidden;min-width:80px}}
-.mini-bar-fill{{height:100%;border-radius:3px}}
-.flow-indicator{{display:inline-block;padding:2px 8px;border-radius:4px;font-size:.75rem;font-weight:600}}
-.flow-pos{{background:rgba(34,197,94,.15);color:#22c55e}}
-.flow-neg{{background:rgba(239,68,68,.15);color:#ef4444}}
-.flow-neutral{{background:rgba(255,255,255,.05);color:var(--text2)}}
-.station-detail{{background:var(--card2);border:1px solid var(--border);border-radius:12px;padding:20px;margin-top:16px}}
-.station-detail h4{{color:#60a5fa;font-size:1rem;margin-bottom:12px}}
-.route-arrow{{color:var(--accent2);font-weight:700;padding:0 8px}}
-.sort-icon{{opacity:.3;font-size:.7rem;margin-left:4px}}
-th.sorted .sort-icon{{opacity:1;color:var(--accent)}}
-.loading{{display:flex;justify-content:center;align-items:center;height:200px;color:var(--text2)}}
-</style>
-</head>
-<body>
-<div class="hero">
-<h1><span class="icon">\U0001F6B2</span> Bay Wheels Explorer</h1>
-<p class="sub" id="heroSub"></p>
-<div class="stats-row" id="heroStats"></div>
-</div>
-<nav class="tabs" id="tabs">
-<button class="tab active" data-tab="overview">Overview</button>
-<button class="tab" data-tab="map">Station Map</button>
-<button class="tab" data-tab="rankings">Station Rankings</button>
-<button class="tab" data-tab="routes">Top Routes</button>
-<button class="tab" data-tab="time">Time Patterns</button>
-</nav>
-<div class="content">
+# Station Rankings columns with a prebuilt sort order ('rank' is row order)
+SORT_COLUMNS = ('station_name', 'total_activity', 'total_departures', 'total_arrivals', 'net_flow',
+                'avg_duration_depart', 'subscriber_pct')
+INT_TYPES = (('u8', np.uint8), ('i8', np.int8), ('u16', np.uint16), ('i16', np.int16),
+             ('u32', np.uint32), ('i32', np.int32))
+MAX_DECIMALS = 6
 
-<!-- OVERVIEW -->
-<div class="panel active" id="panel-overview">
-<div class="grid grid-2" style="margin-bottom:20px">
-<div class="card"><h3>Yearly Growth</h3><div class="chart-container"><canvas id="yearlyChart"></canvas></div></div>
-<div class="card"><h3>Bike Type Breakdown</h3><div class="chart-container"><canvas id="bikeChart"></canvas></div></div>
-</div>
-<div class="card" style="margin-bottom:20px">
-<h3>Monthly Trip Volume</h3>
-<div class="toggle-row" id="monthlyToggles">
-<button class="toggle-btn active" data-mode="total">Total</button>
-<button class="toggle-btn" data-mode="members">Members</button>
-<button class="toggle-btn" data-mode="casual">Casual</button>
-<button class="toggle-btn" data-mode="split">Members vs Casual</button>
-</div>
-<div class="chart-container tall"><canvas id="monthlyChart"></canvas></div>
-</div>
-<div class="grid grid-3" id="insights"></div>
-</div>
 
-<!-- MAP -->
-<div class="panel" id="panel-map">
-<div class="card">
-<h3>Station Network Map</h3>
-<div class="map-controls">
-<input type="text" id="mapSearch" placeholder="Search stations...">
-<select id="mapColor">
-<option value="flow">Color by Net Flow</option>
-<option value="activity">Color by Total Activity</option>
-<option value="member">Color by Member %</option>
-</select>
-</div>
-<div id="map"></div>
-<div class="map-legend" id="mapLegend"></div>
-</div>
-</div>
+# Station map clusters: stations are binned on a CLUSTER_CELL_PX grid in Web
+# Mercator pixels at each of CLUSTER_ZOOMS. The map draws these cells up to
+# the last clustered zoom and individual stations above it.
+CLUSTER_ZOOMS = range(9, 13)
+CLUSTER_CELL_PX = 64
 
-<!-- RANKINGS -->
-<div class="panel" id="panel-rankings">
-<div class="card">
-<h3>All Stations \u2014 Performance Rankings</h3>
-<input type="text" class="search-box" id="stationSearch" placeholder="Search stations by name...">
-<div style="overflow-x:auto"><table id="stationTable"><thead><tr>
-<th data-col="rank"># <span class="sort-icon">\u25B2</span></th>
-<th data-col="station_name">Station <span class="sort-icon">\u25B2</span></th>
-<th data-col="total_activity">Activity <span class="sort-icon">\u25B2</span></th>
-<th data-col="total_departures">Depart <span class="sort-icon">\u25B2</span></th>
-<th data-col="total_arrivals">Arrive <span class="sort-icon">\u25B2</span></th>
-<th data-col="net_flow">Net Flow <span class="sort-icon">\u25B2</span></th>
-<th data-col="avg_duration_depart">Avg Duration <span class="sort-icon">\u25B2</span></th>
-<th data-col="subscriber_pct">Member % <span class="sort-icon">\u25B2</span></th>
-</tr></thead><tbody id="stationBody"></tbody></table></div>
-<div class="page-controls" id="stationPages"></div>
-</div>
-<div id="stationDetail"></div>
-</div>
+# Files this build owns in --shard-dir / --asset-dir: only content-hashed names are ever pruned
+HASHED_NAME = re.compile(r'^[\w-]+\.[0-9a-f]{10}\.(css|js|json)(\.gz|\.br)?$')
 
-<!-- ROUTES -->
-<div class="panel" id="panel-routes">
-<div class="card">
-<h3>Top 100 Most Popular Routes</h3>
-<input type="text" class="search-box" id="routeSearch" placeholder="Search routes by station name...">
-<div style="overflow-x:auto"><table id="routeTable"><thead><tr>
-<th data-col="rank"># <span class="sort-icon">\u25B2</span></th>
-<th data-col="start">From <span class="sort-icon">\u25B2</span></th>
-<th data-col="end">To <span class="sort-icon">\u25B2</span></th>
-<th data-col="count">Trips <span class="sort-icon">\u25B2</span></th>
-<th data-col="dur">Avg Duration <span class="sort-icon">\u25B2</span></th>
-</tr></thead><tbody id="routeBody"></tbody></table></div>
-</div>
-</div>
 
-<!-- TIME PATTERNS -->
-<div class="panel" id="panel-time">
-<div class="grid grid-2">
-<div class="card">
-<h3>Hourly Distribution</h3>
-<div class="toggle-row" id="hourlyToggles">
-<button class="toggle-btn active" data-mode="count">Trip Count</button>
-<button class="toggle-btn" data-mode="duration">Avg Duration</button>
-</div>
-<div class="chart-container tall"><canvas id="hourlyChart"></canvas></div>
-</div>
-<div class="card">
-<h3>Day of Week</h3>
-<div class="toggle-row" id="dowToggles">
-<button class="toggle-btn active" data-mode="count">Trip Count</button>
-<button class="toggle-btn" data-mode="duration">Avg Duration</button>
-</div>
-<div class="chart-container tall"><canvas id="dowChart"></canvas></div>
-</div>
-</div>
-</div>
+def write_compressed(path, data):
+    """``.gz`` (and ``.br`` with brotli installed) siblings of ``path``."""
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
 
-</div>
 
-<div style="text-align:center;padding:40px;color:var(--text2);font-size:.75rem;border-top:1px solid var(--border);margin-top:40px">
-Data source: Lyft Bay Wheels open data \u2022 {data['summary']['total_trips']:,} trips analyzed \u2022 {data['summary']['date_range_start']} to {data['summary']['date_range_end']}
-</div>
+def write_hashed(directory, name, ext, text):
+    """Write ``text`` to ``directory/name.<hash>.ext`` plus compressed siblings. Returns the file name."""
+    data = text.encode()
+    fname = f'{name}.{hashlib.sha256(data).hexdigest()[:10]}.{ext}'
+    path = os.path.join(directory, fname)
+    with open(path, 'wb') as f:
+        f.write(data)
+    write_compressed(path, data)
+    return fname
+
+
+def prune_hashed(directory, keep):
+    """Remove hashed files (and siblings) in ``directory`` that this build did not write."""
+    removed = 0
+    for fname in os.listdir(directory):
+        base = fname[:-3] if fname.endswith(('.gz', '.br')) else fname
+        if HASHED_NAME.match(fname) and base not in keep:
+            os.remove(os.path.join(directory, fname))
+            removed += 1
+    return removed
+
+
+def _b64(a):
+    return base64.b64encode(np.ascontiguousarray(a).astype(a.dtype.newbyteorder('<')).tobytes()).decode('ascii')
+
+
+def encode_numbers(values):
+    """Smallest typed column that round-trips ``values`` exactly."""
+    a = np.asarray(values, dtype=np.float64)
+    if not len(a):
+        return {'t': 'u8', 'b': ''}
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10 ** decimals
+        q = np.round(a * scale)
+        if np.array_equal(q / scale, a):
+            for name, dtype in INT_TYPES:
+                info = np.iinfo(dtype)
+                if info.min <= q.min() and q.max() <= info.max:
+                    col = {'t': name, 'b': _b64(q.astype(dtype))}
+                    if decimals:
+                        col['s'] = scale
+                    return col
+            break
+    return {'t': 'f64', 'b': _b64(a)}
+
+
+def encode_strings(values, dictionary=None):
+    """Dictionary-encoded string column; ``dictionary`` (the shared station list) is extended in place."""
+    shared = dictionary is not None
+    if not shared:
+        dictionary = []
+    index = {v: i for i, v in enumerate(dictionary)}
+    codes = []
+    for v in values:
+        if v not in index:
+            index[v] = len(dictionary)
+            dictionary.append(v)
+        codes.append(index[v])
+    col = encode_numbers(codes)
+    col['d'] = 'stations' if shared else dictionary
+    return col
+
+
+def _is_table(rows):
+    if not isinstance(rows, list) or not rows or not all(isinstance(r, dict) for r in rows):
+        return False
+    keys = list(rows[0])
+    return all(list(r) == keys for r in rows) and all(
+        isinstance(v, (int, float, str)) and not isinstance(v, bool) for r in rows for v in r.values())
+
+
+def encode_payload(data):
+    """Columnar form of ``dashboard_data.json``; anything that is not a flat table stays JSON."""
+    stations = [s['station_name'] for s in data.get('stations', [])]
+    payload = {'stations': stations, 'tables': {}, 'json': {}}
+    for name, value in data.items():
+        if not _is_table(value):
+            payload['json'][name] = value
+            continue
+        cols = {}
+        for key in value[0]:
+            values = [r[key] for r in value]
+            if all(isinstance(v, str) for v in values):
+                cols[key] = encode_strings(values, stations if key.endswith('station_name') else None)
+            elif not any(isinstance(v, str) for v in values):
+                cols[key] = encode_numbers(values)
+            else:
+                break
+        else:
+            payload['tables'][name] = {'n': len(value), 'cols': cols}
+            continue
+        payload['json'][name] = value
+    return payload
+
+
+def split_shards(data):
+    """{shard name: subset of ``data``}, overview first."""
+    lazy = {key for keys in SHARDS.values() for key in keys}
+    shards = {'overview': {k: v for k, v in data.items() if k not in lazy}}
+    for name, keys in SHARDS.items():
+        shards[name] = {k: data[k] for k in keys if k in data}
+    return shards
+
+
+def cluster_stations(stations, pressure=None):
+    """Grid clusters of ``stations`` for every zoom in ``CLUSTER_ZOOMS``, as table rows.
+
+    Each cell has its activity-weighted centre, station count, summed
+    activity and net flow, and the member share of its departures; with
+    ``pressure`` (``station_flow_tables`` rows) also the summed morning and
+    evening net flows.
+    """
+    if not stations:
+        return []
+    col = lambda key: np.array([s[key] for s in stations], dtype=np.float64)  # noqa: E731
+    lat, lng = col('lat'), col('lng')
+    activity, net_flow = col('total_activity'), col('net_flow')
+    departures, members = col('total_departures'), col('subscriber_departures')
+    weight = np.maximum(activity, 1)
+    # Web Mercator, in world-size units
+    sin_lat = np.sin(np.radians(lat))
+    x = (lng + 180) / 360
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+
+    rows = []
+    for zoom in CLUSTER_ZOOMS:
+        cells_per_world = 256 * 2 ** zoom / CLUSTER_CELL_PX
+        cell = np.floor(x * cells_per_world).astype(np.int64) << 32 | np.floor(y * cells_per_world).astype(np.int64)
+        _, codes = np.unique(cell, return_inverse=True)
+        total = lambda v: np.bincount(codes, weights=v)  # noqa: E731
+        w = total(weight)
+        dep, mem = total(departures), total(members)
+        by_key = {key: total(np.array([p[key] for p in pressure])).tolist() for key in PRESSURE_KEYS} \
+            if pressure else {}
+        for k, (c_lat, c_lng, n, act, net, d, m) in enumerate(zip(
+                total(lat * weight) / w, total(lng * weight) / w, np.bincount(codes), total(activity),
+                total(net_flow), dep, mem)):
+            rows.append({
+                'zoom': zoom, 'lat': round(float(c_lat), 6), 'lng': round(float(c_lng), 6),
+                'stations': int(n), 'total_activity': int(act), 'net_flow': int(net),
+                'subscriber_pct': round(float(m / d * 100), 1) if d else 0,
+                **{key: round(v[k], 1) + 0.0 for key, v in by_key.items()},
+            })
+    return rows
 
-<script>
-const DATA = {data_json};
+
+def station_flow_tables(stations, station_flow):
+    """Rebalancing tables from preprocess.py's ``station_flow``, aligned with ``stations``.
+
+    ``station_pressure`` has one row per station (average weekday net flow
+    by 9am and by 6pm); ``station_hourly_flow`` has 24 per station, row
+    ``i * 24 + hour`` for ``stations[i]``, with its average weekday and
+    weekend-day departures and arrivals in that hour. Stations without flow
+    data get zeros.
+    """
+    by_name = {r['station_name']: r for r in station_flow}
+    tables = {'station_pressure': [], 'station_hourly_flow': []}
+    for s in stations:
+        r = by_name.get(s['station_name'])
+        tables['station_pressure'].append({key: r[key] if r else 0 for key in PRESSURE_KEYS})
+        for h in range(24):
+            tables['station_hourly_flow'].append({key: r[key][h] if r else 0 for key in HOURLY_FLOW_KEYS})
+    return tables
+
+
+def station_month_matrix(stations, station_monthly):
+    """Dense station x month trip counts as table rows: row i is ``stations[i]``, one column per month."""
+    months = sorted({r['year_month'] for r in station_monthly})
+    if not stations or not months:
+        return []
+    row = {s['station_name']: i for i, s in enumerate(stations)}
+    col = {m: j for j, m in enumerate(months)}
+    trips = np.zeros((len(stations), len(months)), dtype=np.int64)
+    for r in station_monthly:
+        if r['station_name'] in row:
+            trips[row[r['station_name']], col[r['year_month']]] += r['trips']
+    return [dict(zip(months, counts)) for counts in trips.tolist()]
+
+
+def route_index(routes):
+    """Offset tables from each station to the routes that start or end there.
+
+    ``route_stations`` rows give a station's ``offset`` and ``count`` into
+    ``route_station_routes``, whose ``route`` column indexes ``routes``.
+    """
+    by_station = {}
+    for i, r in enumerate(routes):
+        for name in dict.fromkeys((r['start_station_name'], r['end_station_name'])):
+            by_station.setdefault(name, []).append(i)
+    index = {'route_stations': [], 'route_station_routes': []}
+    for name, ids in by_station.items():
+        index['route_stations'].append({'station_name': name, 'offset': len(index['route_station_routes']),
+                                        'count': len(ids)})
+        index['route_station_routes'].extend({'route': i} for i in ids)
+    return index
+
+
+def station_od_tables(stations, od, n=TOP_OD):
+    """Each station's top ``n`` destinations and origins from preprocess.py's OD matrix.
+
+    ``station_od`` rows follow ``stations`` and give the ``offset`` and
+    ``count`` of the station's entries in ``station_destinations`` and
+    ``station_origins`` (most trips first).
+    """
+    names = od['stations'].tolist()
+    ids = {name: i for i, name in enumerate(names)}
+    indptr, end = od['indptr'], od['indices']
+    trips, dur_sum = od['trips'].astype(np.int64), od['dur_sum']
+    start = np.repeat(np.arange(len(names)), np.diff(indptr))
+    # The same pairs grouped by end station, for the origins
+    by_end = np.argsort(end, kind='stable')
+    end_ptr = np.concatenate([[0], np.cumsum(np.bincount(end, minlength=len(names)))])
+
+    tables = {'station_od': [], 'station_destinations': [], 'station_origins': []}
+    for s in stations:
+        i = ids.get(s['station_name'])
+        row = {}
+        for key, table, pairs, other in (
+                ('dest', 'station_destinations', np.arange(indptr[i], indptr[i + 1]) if i is not None else [], end),
+                ('orig', 'station_origins', by_end[end_ptr[i]:end_ptr[i + 1]] if i is not None else [], start)):
+            pairs = np.asarray(pairs, dtype=np.int64)
+            top = pairs[np.argsort(-trips[pairs], kind='stable')[:n]]
+            row[f'{key}_offset'] = len(tables[table])
+            row[f'{key}_count'] = len(top)
+            tables[table].extend({'station_name': names[other[k]], 'trips': int(trips[k]),
+                                  'avg_duration': round(float(dur_sum[k] / trips[k]), 1)} for k in top.tolist())
+        tables['station_od'].append(row)
+    return tables
+
+
+def station_slot_table(stations, heatmaps):
+    """Per-station departures and arrivals by slot of the week from preprocess.py's heatmaps, as one table.
+
+    Row ``i * week_slots + dow * day_slots + slot`` belongs to ``stations[i]``
+    (Monday first); stations missing from the file get zeros.
+    """
+    names = heatmaps['stations'].tolist()
+    index = {name: i for i, name in enumerate(names)}
+    cols = {}
+    for key in ('departures', 'arrivals'):
+        grid = heatmaps[key].reshape(len(names), -1)
+        out = np.zeros((len(stations), grid.shape[1]), dtype=np.int64)
+        for i, s in enumerate(stations):
+            if s['station_name'] in index:
+                out[i] = grid[index[s['station_name']]]
+        cols[key] = out.ravel().tolist()
+    return [{'departures': d, 'arrivals': a} for d, a in zip(cols['departures'], cols['arrivals'])]
+
+
+def search_key(name):
+    """Station name as the page's search compares it: lower case alphanumeric words."""
+    return ' '.join(re.findall(r'[a-z0-9]+', name.lower()))
+
+
+def station_search_index(stations):
+    """Sort permutations and a name trigram index for the Station Rankings table.
+
+    ``station_order`` has one column per ``SORT_COLUMNS`` entry holding the
+    station rows in ascending order of that column. ``station_trigrams``
+    rows give each trigram of the padded search keys an ``offset`` and
+    ``count`` into ``station_trigram_rows``, the stations containing it.
+    """
+    if not stations:
+        return {}
+    rows = range(len(stations))
+    order = {}
+    for col in SORT_COLUMNS:
+        if col == 'station_name':
+            order[col] = sorted(rows, key=lambda i: stations[i][col].lower())
+        else:
+            order[col] = sorted(rows, key=lambda i: stations[i][col])
+    postings = {}
+    for i, s in enumerate(stations):
+        key = f" {search_key(s['station_name'])} "
+        for gram in dict.fromkeys(key[j:j + 3] for j in range(len(key) - 2)):
+            postings.setdefault(gram, []).append(i)
+    index = {'station_order': [dict(zip(order, perm)) for perm in zip(*order.values())],
+             'station_trigrams': [], 'station_trigram_rows': []}
+    for gram, ids in postings.items():
+        index['station_trigrams'].append({'trigram': gram, 'offset': len(index['station_trigram_rows']),
+                                          'count': len(ids)})
+        index['station_trigram_rows'].extend({'station': i} for i in ids)
+    return index
+
+
+def decode_payload(payload):
+    """Python mirror of the page's decoder, used to check the payload round-trips."""
+    data = dict(payload['json'])
+    for name, table in payload['tables'].items():
+        cols = {}
+        for key, c in table['cols'].items():
+            dtype = dict(INT_TYPES).get(c['t'], np.float64)
+            a = np.frombuffer(base64.b64decode(c['b']), dtype=np.dtype(dtype).newbyteorder('<'))
+            if 'd' in c:
+                d = payload['stations'] if c['d'] == 'stations' else c['d']
+                cols[key] = [d[i] for i in a.tolist()]
+            else:
+                cols[key] = (a / c['s'] if 's' in c else a).tolist()
+        data[name] = [dict(zip(cols, row)) for row in zip(*cols.values())]
+    return {k: data[k] for k in list(payload['json']) + list(payload['tables'])}
+
+
+# Page-side decoder: a payload -> COLS (TypedArrays / string arrays per
+# column) and DATA (scalars, plus row objects built on first access to each
+# table). Shards are added to the same two objects as they arrive.
+DECODER_JS = r"""
+const TYPED = {u8: Uint8Array, i8: Int8Array, u16: Uint16Array, i16: Int16Array,
+               u32: Uint32Array, i32: Int32Array, f64: Float64Array};
+function b64Buffer(s) {
+  const bin = atob(s), n = bin.length, u8 = new Uint8Array(n);
+  for (let i = 0; i < n; i++) u8[i] = bin.charCodeAt(i);
+  return u8.buffer;
+}
+function decodeColumn(c, stations) {
+  const a = new TYPED[c.t](b64Buffer(c.b));
+  if (c.d) { const d = c.d === 'stations' ? stations : c.d; return Array.from(a, i => d[i]); }
+  if (c.s) { const f = new Float64Array(a.length); for (let i = 0; i < a.length; i++) f[i] = a[i] / c.s; return f; }
+  return a;
+}
+function decodeTables(p) {
+  const cols = {};
+  for (const name in p.tables) {
+    const t = p.tables[name], out = {length: t.n};
+    for (const key in t.cols) out[key] = decodeColumn(t.cols[key], p.stations);
+    cols[name] = out;
+  }
+  return cols;
+}
+function tableRows(t) {
+  const keys = Object.keys(t).filter(k => k !== 'length'), rows = new Array(t.length);
+  for (let i = 0; i < t.length; i++) {
+    const r = {};
+    for (const k of keys) r[k] = t[k][i];
+    rows[i] = r;
+  }
+  return rows;
+}
+function addPayload(data, cols, p) {
+  Object.assign(data, p.json);
+  const decoded = decodeTables(p);
+  for (const name in decoded) {
+    cols[name] = decoded[name];
+    Object.defineProperty(data, name, {configurable: true, enumerable: true, get() {
+      const rows = tableRows(decoded[name]);
+      Object.defineProperty(data, name, {value: rows, enumerable: true});
+      return rows;
+    }});
+  }
+}
+"""
+
+
+def payload_sizes(texts):
+    """Total KB and gzipped KB of JSON texts, each compressed on its own as it is served."""
+    return sum(len(t) for t in texts) / 1024, sum(len(gzip.compress(t.encode())) for t in texts) / 1024
+
+
+def time_decoder(payload_json, repeat=20):
+    """Best-of-``repeat`` decode time of one payload by the page decoder under node, in ms.
+
+    Includes building every table's row objects; None when node is not installed.
+    """
+    node = shutil.which('node')
+    if node is None:
+        return None
+    script = DECODER_JS + f"""
+const PAYLOAD = {payload_json};
+let best = Infinity;
+for (let i = 0; i < {repeat}; i++) {{
+  const t = performance.now();
+  const data = {{}};
+  addPayload(data, {{}}, PAYLOAD);
+  for (const name in PAYLOAD.tables) data[name];
+  best = Math.min(best, performance.now() - t);
+}}
+console.log(best);
+"""
+    with tempfile.NamedTemporaryFile('w', suffix='.js', delete=False) as f:
+        f.write(script)
+    try:
+        out = subprocess.run([node, f.name], capture_output=True, text=True, check=True)
+        return float(out.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+    finally:
+        os.unlink(f.name)
+
+
+parser = argparse.ArgumentParser(description='Build Bay Wheels dashboard HTML')
+parser.add_argument('--input', default='./dashboard_data.json', help='Input JSON data path')
+parser.add_argument('--output', default='./index.html', help='Output HTML path')
+parser.add_argument('--od', default=None,
+                    help='OD matrix from preprocess.py (default: od_matrix.npz next to --input)')
+parser.add_argument('--heatmaps', default=None,
+                    help='Per-station heatmaps from preprocess.py (default: station_heatmaps.npz next to --input)')
+parser.add_argument('--shard-dir', default='shards',
+                    help='Directory for the lazily loaded data shards, relative to the output HTML')
+parser.add_argument('--asset-dir', default='assets',
+                    help='Directory for the hashed CSS and JS files, relative to the output HTML')
+args = parser.parse_args()
+
+with open(args.input) as f:
+    data = json.load(f)
+
+t = time.perf_counter()
+shards = split_shards(data)
+flow_tables = station_flow_tables(data.get('stations', []), data['station_flow']) if 'station_flow' in data else {}
+shards['stations']['map_clusters'] = cluster_stations(data.get('stations', []), flow_tables.get('station_pressure'))
+shards['station_detail'] = {'station_month_trips': station_month_matrix(data.get('stations', []),
+                                                                        data.get('station_monthly', []))}
+if flow_tables:
+    shards['stations']['station_pressure'] = flow_tables['station_pressure']
+    shards['station_detail']['station_hourly_flow'] = flow_tables['station_hourly_flow']
+shards['routes'].update(route_index(data.get('top_routes', [])))
+shards['rankings'] = station_search_index(data.get('stations', []))
+od_path = args.od or os.path.join(os.path.dirname(args.input) or '.', 'od_matrix.npz')
+if os.path.exists(od_path):
+    with np.load(od_path) as od:
+        od_tables = station_od_tables(data.get('stations', []), od)
+    shards['station_detail'].update(od_tables)
+    print(f"OD matrix: {os.path.getsize(od_path) / 1024:.1f} KB -> top {TOP_OD} origins/destinations per station "
+          f"{len(json.dumps(encode_payload(od_tables), separators=(',', ':'))) / 1024:.1f} KB "
+          f"(as JSON rows {len(json.dumps(od_tables, separators=(',', ':'))) / 1024:.1f} KB)")
+else:
+    print(f'No OD matrix at {od_path}; station detail will not list top origins and destinations')
+heatmap_path = args.heatmaps or os.path.join(os.path.dirname(args.input) or '.', 'station_heatmaps.npz')
+if os.path.exists(heatmap_path):
+    with np.load(heatmap_path) as heatmaps:
+        shards['station_heatmaps'] = {'station_slots': station_slot_table(data.get('stations', []), heatmaps),
+                                      'station_slot_minutes': int(heatmaps['slot_minutes'])}
+else:
+    print(f'No station heatmaps at {heatmap_path}; station detail will not show a weekly heatmap')
+payload_json = {}
+for name, part in shards.items():
+    payload_json[name] = json.dumps(encode_payload(part), separators=(',', ':'))
+    assert decode_payload(json.loads(payload_json[name])) == part, f'{name} payload does not round-trip'
+encode_ms = (time.perf_counter() - t) * 1000
+
+app_css = '''
+*{margin:0;padding:0;box-sizing:border-box}
+:root{--bg:#0a0e1a;--card:#111827;--card2:#1a2236;--border:#1e293b;--text:#e2e8f0;--text2:#94a3b8;--accent:#0077C8;--accent2:#00BFA5;--red:#ef4444;--green:#22c55e;--yellow:#eab308}
+body{font-family:'Inter',sans-serif;background:var(--bg);color:var(--text);min-height:100vh;overflow-x:hidden}
+.hero{background:linear-gradient(135deg,#0a0e1a 0%,#0f172a 50%,#1e1b4b 100%);padding:40px 24px 24px;text-align:center;border-bottom:1px solid var(--border)}
+.hero h1{font-size:2.4rem;font-weight:800;background:linear-gradient(135deg,#60a5fa,#00BFA5);-webkit-background-clip:text;-webkit-text-fill-color:transparent;margin-bottom:6px;display:flex;align-items:center;justify-content:center;gap:12px}
+.hero h1 .icon{font-size:2rem;-webkit-text-fill-color:#60a5fa}
+.hero .sub{color:var(--text2);font-size:.95rem;margin-bottom:20px;font-weight:300}
+.stats-row{display:flex;justify-content:center;gap:16px;flex-wrap:wrap}
+.stat-badge{background:rgba(255,255,255,.05);border:1px solid var(--border);border-radius:12px;padding:12px 20px;text-align:center;min-width:130px}
+.stat-badge .val{font-size:1.3rem;font-weight:700;color:#60a5fa}
+.stat-badge .lbl{font-size:.7rem;color:var(--text2);text-transform:uppercase;letter-spacing:.5px;margin-top:2px}
+.sample-banner{background:rgba(234,179,8,.1);border-bottom:1px solid rgba(234,179,8,.3);color:var(--yellow);text-align:center;padding:8px 24px;font-size:.85rem}
+.tabs{display:flex;justify-content:center;gap:4px;padding:12px 24px;background:var(--card);border-bottom:1px solid var(--border);position:sticky;top:0;z-index:1000}
+.tab{padding:10px 20px;border-radius:8px;cursor:pointer;font-size:.85rem;font-weight:500;color:var(--text2);transition:all .2s;border:none;background:none}
+.tab:hover{color:var(--text);background:rgba(255,255,255,.05)}
+.tab.active{background:var(--accent);color:#fff}
+.content{max-width:1400px;margin:0 auto;padding:24px}
+.panel{display:none}.panel.active{display:block}
+.panel.loading{opacity:.4;pointer-events:none}
+.load-error{color:var(--red);font-size:.85rem;margin-bottom:12px}
+.grid{display:grid;gap:20px}.grid-2{grid-template-columns:1fr 1fr}.grid-3{grid-template-columns:1fr 1fr 1fr}
+@media(max-width:900px){.grid-2,.grid-3{grid-template-columns:1fr}.stats-row{gap:8px}.stat-badge{min-width:100px;padding:8px 12px}.hero h1{font-size:1.6rem}.tabs{overflow-x:auto;justify-content:flex-start}}
+.card{background:var(--card);border:1px solid var(--border);border-radius:16px;padding:20px;position:relative;overflow:hidden}
+.card::before{content:'';position:absolute;top:0;left:0;right:0;height:1px;background:linear-gradient(90deg,transparent,rgba(96,165,250,.3),transparent)}
+.card h3{font-size:.85rem;color:var(--text2);text-transform:uppercase;letter-spacing:.5px;margin-bottom:16px;font-weight:600}
+.chart-container{position:relative;width:100%;height:300px}
+.chart-container.tall{height:400px}
+.toggle-row{display:flex;gap:6px;margin-bottom:12px}
+.toggle-btn{padding:4px 12px;border-radius:6px;font-size:.75rem;cursor:pointer;border:1px solid var(--border);background:transparent;color:var(--text2);transition:all .15s}
+.toggle-btn.active{background:var(--accent);border-color:var(--accent);color:#fff}
+.insight-card{background:linear-gradient(135deg,rgba(96,165,250,.08),rgba(0,191,165,.05));border:1px solid rgba(96,165,250,.15);border-radius:12px;padding:16px;margin-bottom:12px}
+.insight-card .num{font-size:1.4rem;font-weight:700;color:#60a5fa}.insight-card .desc{font-size:.85rem;color:var(--text2);margin-top:4px}
+#map{width:100%;height:600px;border-radius:12px;border:1px solid var(--border)}
+.map-controls{display:flex;gap:12px;margin-bottom:12px;flex-wrap:wrap;align-items:center}
+.map-controls input,.map-controls select{background:var(--card2);color:var(--text);border:1px solid var(--border);border-radius:8px;padding:8px 12px;font-size:.85rem;font-family:inherit}
+.map-controls input{flex:1;min-width:200px}.map-controls select{min-width:160px}
+.map-legend{display:flex;gap:16px;margin-top:12px;justify-content:center;font-size:.75rem;color:var(--text2)}
+.map-legend span{display:flex;align-items:center;gap:4px}
+.map-legend .dot{width:10px;height:10px;border-radius:50%;display:inline-block}
+table{width:100%;border-collapse:collapse;font-size:.82rem}
+th{text-align:left;padding:10px 12px;border-bottom:2px solid var(--border);color:var(--text2);font-weight:600;cursor:pointer;white-space:nowrap;text-transform:uppercase;font-size:.7rem;letter-spacing:.5px;user-select:none}
+th:hover{color:var(--text)}
+td{padding:8px 12px;border-bottom:1px solid rgba(255,255,255,.04)}
+tr:hover td{background:rgba(255,255,255,.02)}
+.search-box{width:100%;background:var(--card2);color:var(--text);border:1px solid var(--border);border-radius:8px;padding:10px 14px;font-size:.85rem;margin-bottom:16px;font-family:inherit}
+.page-controls{display:flex;justify-content:center;gap:8px;margin-top:16px;align-items:center}
+.page-btn{padding:6px 14px;border-radius:6px;border:1px solid var(--border);background:var(--card2);color:var(--text);cursor:pointer;font-size:.8rem;font-family:inherit}
+.page-btn.active{background:var(--accent);border-color:var(--accent)}
+.page-btn:disabled{opacity:.3;cursor:not-allowed}
+.mini-bar{height:6px;border-radius:3px;background:var(--card2);overflow:hidden;min-width:80px}
+.mini-bar-fill{height:100%;border-radius:3px}
+.flow-indicator{display:inline-block;padding:2px 8px;border-radius:4px;font-size:.75rem;font-weight:600}
+.flow-pos{background:rgba(34,197,94,.15);color:#22c55e}
+.flow-neg{background:rgba(239,68,68,.15);color:#ef4444}
+.flow-neutral{background:rgba(255,255,255,.05);color:var(--text2)}
+.station-detail{background:var(--card2);border:1px solid var(--border);border-radius:12px;padding:20px;margin-top:16px}
+.station-detail h4{color:#60a5fa;font-size:1rem;margin-bottom:12px}
+.od-grid{display:grid;grid-template-columns:1fr 1fr;gap:16px;margin-top:16px}
+.od-grid h5{color:var(--text2);font-size:.75rem;text-transform:uppercase;letter-spacing:.5px;margin-bottom:6px}
+@media(max-width:768px){.od-grid{grid-template-columns:1fr}}
+.station-heatmap{margin-top:16px}
+.station-heatmap h5{color:var(--text2);font-size:.75rem;text-transform:uppercase;letter-spacing:.5px;margin-bottom:6px}
+canvas.heatmap{display:block;width:100%;height:190px}
+.route-arrow{color:var(--accent2);font-weight:700;padding:0 8px}
+.sort-icon{opacity:.3;font-size:.7rem;margin-left:4px}
+th.sorted .sort-icon{opacity:1;color:var(--accent)}
+.loading{display:flex;justify-content:center;align-items:center;height:200px;color:var(--text2)}
+'''
+
+app_js = DECODER_JS + '''
+const _decodeStart = performance.now();
+const DATA = {}, COLS = {};
+addPayload(DATA, COLS, PAYLOAD);
+console.info('Overview payload decoded in ' + (performance.now() - _decodeStart).toFixed(1) + ' ms');
+
+// Shards load once, on first use; later calls share the same promise.
+// Views check shardLoaded rather than for a key: an empty table stays plain JSON.
+const shardLoads = {}, loadedShards = new Set();
+function loadShard(name) {
+  if (!shardLoads[name]) {
+    shardLoads[name] = fetch(SHARD_URLS[name])
+      .then(r => { if (!r.ok) throw new Error(r.status + ' ' + r.url); return r.json(); })
+      .then(p => { addPayload(DATA, COLS, p); loadedShards.add(name); });
+  }
+  return shardLoads[name];
+}
+const shardLoaded = name => loadedShards.has(name);
 
 // ===================== UTILITIES =====================
 const fmt = n => n == null ? '\u2014' : n.toLocaleString();
-const fmtDur = s => {{ const m = Math.floor(s/60); const sec = Math.round(s%60); return m + 'm ' + sec + 's'; }};
+const fmtDur = s => { const m = Math.floor(s/60); const sec = Math.round(s%60); return m + 'm ' + sec + 's'; };
 const fmtPct = p => p.toFixed(1) + '%';
 
 // ===================== HERO STATS =====================
-(function(){{
+(function(){
 const s = DATA.summary;
 const tripM = (s.total_trips / 1e6).toFixed(1);
 document.getElementById('heroSub').textContent = 'Interactive analysis of ' + tripM + 'M+ rides across the San Francisco Bay Area \u2022 ' + s.date_range_start.slice(0,7).replace('-',' ') + ' \u2013 ' + s.date_range_end.slice(0,7).replace('-',' ');
@@ -224,20 +633,38 @@ const items = [
   ['Active Stations', fmt(s.total_stations)],
   ['Member Rides', fmtPct(s.subscriber_pct)],
 ];
-el.innerHTML = items.map(([l,v]) => `<div class="stat-badge"><div class="val">${{v}}</div><div class="lbl">${{l}}</div></div>`).join('');
-}})();
+el.innerHTML = items.map(([l,v]) => `<div class="stat-badge"><div class="val">${v}</div><div class="lbl">${l}</div></div>`).join('');
+})();
 
 // ===================== TAB SWITCHING =====================
-let map = null, mapInitialized = false;
-document.querySelectorAll('.tab').forEach(t => {{
-  t.addEventListener('click', () => {{
+// Tabs other than the overview fetch their shards and build their views
+// the first time they are opened.
+let map = null;
+const TAB_SHARDS = { map: ['stations'], rankings: ['stations', 'rankings'], routes: ['routes'], time: ['time'] };
+const TAB_INIT = { map: () => initMap(), rankings: () => initStationTable(), routes: () => initRouteTable(), time: () => initTimeCharts() };
+const tabReady = {};
+function openTab(tab) {
+  if (tabReady[tab] || !TAB_INIT[tab]) return;
+  const panel = document.getElementById('panel-' + tab);
+  panel.classList.add('loading');
+  tabReady[tab] = Promise.all(TAB_SHARDS[tab].map(loadShard))
+    .then(TAB_INIT[tab])
+    .catch(err => {
+      console.error(err);
+      delete tabReady[tab];
+      panel.insertAdjacentHTML('afterbegin', '<p class="load-error">Could not load the data for this tab. Try again.</p>');
+    })
+    .finally(() => panel.classList.remove('loading'));
+}
+document.querySelectorAll('.tab').forEach(t => {
+  t.addEventListener('click', () => {
     document.querySelectorAll('.tab').forEach(x => x.classList.remove('active'));
     document.querySelectorAll('.panel').forEach(x => x.classList.remove('active'));
     t.classList.add('active');
     document.getElementById('panel-' + t.dataset.tab).classList.add('active');
-    if (t.dataset.tab === 'map' && !mapInitialized) {{ initMap(); mapInitialized = true; }}
-  }});
-}});
+    openTab(t.dataset.tab);
+  });
+});
 
 // ===================== CHART DEFAULTS =====================
 Chart.defaults.color = '#94a3b8';
@@ -250,67 +677,67 @@ Chart.defaults.plugins.tooltip.cornerRadius = 8;
 Chart.defaults.plugins.tooltip.padding = 12;
 
 // ===================== YEARLY CHART =====================
-(function(){{
+(function(){
 const y = DATA.yearly.filter(d => d.year >= 2017 && d.year <= 2025);
-new Chart(document.getElementById('yearlyChart'), {{
+new Chart(document.getElementById('yearlyChart'), {
   type: 'bar',
-  data: {{
+  data: {
     labels: y.map(d => d.year),
-    datasets: [{{
+    datasets: [{
       label: 'Total Trips',
       data: y.map(d => d.total_trips),
-      backgroundColor: y.map((_,i) => {{
+      backgroundColor: y.map((_,i) => {
         const t = i / (y.length - 1);
-        return `rgba(${{Math.round(96 - t*40)}}, ${{Math.round(165 + t*30)}}, ${{Math.round(250 - t*80)}}, 0.8)`;
-      }}),
+        return `rgba(${Math.round(96 - t*40)}, ${Math.round(165 + t*30)}, ${Math.round(250 - t*80)}, 0.8)`;
+      }),
       borderRadius: 6,
       borderSkipped: false,
-    }}]
-  }},
-  options: {{
+    }]
+  },
+  options: {
     responsive: true, maintainAspectRatio: false,
-    plugins: {{ legend: {{ display: false }},
-      tooltip: {{ callbacks: {{ label: c => fmt(c.raw) + ' trips' }} }}
-    }},
-    scales: {{
-      y: {{ ticks: {{ callback: v => (v/1e6).toFixed(1) + 'M' }}, grid: {{ color: 'rgba(255,255,255,0.04)' }} }},
-      x: {{ grid: {{ display: false }} }}
-    }}
-  }}
-}});
-}})();
+    plugins: { legend: { display: false },
+      tooltip: { callbacks: { label: c => fmt(c.raw) + ' trips' } }
+    },
+    scales: {
+      y: { ticks: { callback: v => (v/1e6).toFixed(1) + 'M' }, grid: { color: 'rgba(255,255,255,0.04)' } },
+      x: { grid: { display: false } }
+    }
+  }
+});
+})();
 
 // ===================== BIKE TYPE CHART =====================
-(function(){{
+(function(){
 const bt = DATA.bike_type.filter(d => d.total_trips > 100);
 const colors = ['#60a5fa','#00BFA5','#f59e0b','#ef4444'];
-new Chart(document.getElementById('bikeChart'), {{
+new Chart(document.getElementById('bikeChart'), {
   type: 'doughnut',
-  data: {{
+  data: {
     labels: bt.map(d => d.rideable_type.replace('_',' ').replace(/\\b\\w/g,l=>l.toUpperCase())),
-    datasets: [{{ data: bt.map(d => d.total_trips), backgroundColor: colors.slice(0, bt.length), borderWidth: 0, borderRadius: 4 }}]
-  }},
-  options: {{
+    datasets: [{ data: bt.map(d => d.total_trips), backgroundColor: colors.slice(0, bt.length), borderWidth: 0, borderRadius: 4 }]
+  },
+  options: {
     responsive: true, maintainAspectRatio: false,
     cutout: '65%',
-    plugins: {{
-      legend: {{ position: 'bottom', labels: {{ padding: 16, usePointStyle: true, pointStyle: 'circle' }} }},
-      tooltip: {{ callbacks: {{ label: c => c.label + ': ' + fmt(c.raw) + ' (' + ((c.raw / bt.reduce((a,b)=>a+b.total_trips,0))*100).toFixed(1) + '%)' }} }}
-    }}
-  }}
-}});
-}})();
+    plugins: {
+      legend: { position: 'bottom', labels: { padding: 16, usePointStyle: true, pointStyle: 'circle' } },
+      tooltip: { callbacks: { label: c => c.label + ': ' + fmt(c.raw) + ' (' + ((c.raw / bt.reduce((a,b)=>a+b.total_trips,0))*100).toFixed(1) + '%)' } }
+    }
+  }
+});
+})();
 
 // ===================== MONTHLY CHART =====================
 let monthlyChart;
-(function(){{
+(function(){
 const m = DATA.monthly;
 const labels = m.map(d => d.year_month);
-monthlyChart = new Chart(document.getElementById('monthlyChart'), {{
+monthlyChart = new Chart(document.getElementById('monthlyChart'), {
   type: 'line',
-  data: {{
+  data: {
     labels,
-    datasets: [{{
+    datasets: [{
       label: 'Total Trips',
       data: m.map(d => d.total_trips),
       borderColor: '#60a5fa',
@@ -320,64 +747,64 @@ monthlyChart = new Chart(document.getElementById('monthlyChart'), {{
       pointRadius: 0,
       pointHoverRadius: 4,
       borderWidth: 2,
-    }}]
-  }},
-  options: {{
+    }]
+  },
+  options: {
     responsive: true, maintainAspectRatio: false,
-    interaction: {{ intersect: false, mode: 'index' }},
-    plugins: {{ legend: {{ display: false }},
-      tooltip: {{ callbacks: {{ label: c => c.dataset.label + ': ' + fmt(c.raw) }} }}
-    }},
-    scales: {{
-      y: {{ ticks: {{ callback: v => (v/1000).toFixed(0) + 'K' }}, grid: {{ color: 'rgba(255,255,255,0.04)' }} }},
-      x: {{ ticks: {{ maxTicksLimit: 12, maxRotation: 45 }}, grid: {{ display: false }} }}
-    }}
-  }}
-}});
-
-document.querySelectorAll('#monthlyToggles .toggle-btn').forEach(btn => {{
-  btn.addEventListener('click', () => {{
+    interaction: { intersect: false, mode: 'index' },
+    plugins: { legend: { display: false },
+      tooltip: { callbacks: { label: c => c.dataset.label + ': ' + fmt(c.raw) } }
+    },
+    scales: {
+      y: { ticks: { callback: v => (v/1000).toFixed(0) + 'K' }, grid: { color: 'rgba(255,255,255,0.04)' } },
+      x: { ticks: { maxTicksLimit: 12, maxRotation: 45 }, grid: { display: false } }
+    }
+  }
+});
+
+document.querySelectorAll('#monthlyToggles .toggle-btn').forEach(btn => {
+  btn.addEventListener('click', () => {
     document.querySelectorAll('#monthlyToggles .toggle-btn').forEach(b => b.classList.remove('active'));
     btn.classList.add('active');
     const mode = btn.dataset.mode;
     const ch = monthlyChart;
-    if (mode === 'total') {{
-      ch.data.datasets = [{{
+    if (mode === 'total') {
+      ch.data.datasets = [{
         label: 'Total Trips', data: m.map(d => d.total_trips),
         borderColor: '#60a5fa', backgroundColor: 'rgba(96,165,250,0.1)',
         fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2
-      }}];
-    }} else if (mode === 'members') {{
-      ch.data.datasets = [{{
+      }];
+    } else if (mode === 'members') {
+      ch.data.datasets = [{
         label: 'Member Trips', data: m.map(d => d.trips_Subscriber),
         borderColor: '#60a5fa', backgroundColor: 'rgba(96,165,250,0.1)',
         fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2
-      }}];
-    }} else if (mode === 'casual') {{
-      ch.data.datasets = [{{
+      }];
+    } else if (mode === 'casual') {
+      ch.data.datasets = [{
         label: 'Casual Trips', data: m.map(d => d.trips_Customer),
         borderColor: '#00BFA5', backgroundColor: 'rgba(0,191,165,0.1)',
         fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2
-      }}];
-    }} else {{
+      }];
+    } else {
       ch.data.datasets = [
-        {{ label: 'Members', data: m.map(d => d.trips_Subscriber),
+        { label: 'Members', data: m.map(d => d.trips_Subscriber),
           borderColor: '#60a5fa', backgroundColor: 'rgba(96,165,250,0.15)',
-          fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2 }},
-        {{ label: 'Casual', data: m.map(d => d.trips_Customer),
+          fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2 },
+        { label: 'Casual', data: m.map(d => d.trips_Customer),
           borderColor: '#00BFA5', backgroundColor: 'rgba(0,191,165,0.15)',
-          fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2 }}
+          fill: true, tension: 0.3, pointRadius: 0, pointHoverRadius: 4, borderWidth: 2 }
       ];
       ch.options.plugins.legend.display = true;
-    }}
+    }
     if (mode !== 'split') ch.options.plugins.legend.display = false;
     ch.update();
-  }});
-}});
-}})();
+  });
+});
+})();
 
 // ===================== INSIGHTS =====================
-(function(){{
+(function(){
 const el = document.getElementById('insights');
 const m = DATA.monthly;
 const peakMonth = m.reduce((a,b) => b.total_trips > a.total_trips ? b : a);
@@ -395,387 +822,947 @@ const insights = [
   ['\U0001F4CA ' + growth + '% YoY', '2025 vs 2024 trip growth, showing accelerating demand for Bay Wheels'],
   ['\U0001F5FA\uFE0F ' + stationGrowth, 'stations \u2014 the network has grown steadily from its 2017 launch to a dense Bay Area-wide system'],
 ];
-el.innerHTML = insights.map(([n,d]) => `<div class="insight-card"><div class="num">${{n}}</div><div class="desc">${{d}}</div></div>`).join('');
-}})();
+el.innerHTML = insights.map(([n,d]) => `<div class="insight-card"><div class="num">${n}</div><div class="desc">${d}</div></div>`).join('');
+})();
 
 // ===================== MAP =====================
-let mapMarkers = [], mapLayer;
-function initMap() {{
-  map = L.map('map', {{ zoomControl: true }}).setView([37.77, -122.42], 13);
-  L.tileLayer('https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png', {{
+// Drawn on one canvas. Up to the last zoom in COLS.map_clusters the map shows
+// that zoom's build-time grid clusters; above it (or while searching) one
+// marker per station. Markers are built once; a colour mode change only
+// restyles them.
+let mapMarkers = [], stationLayer, clusterLayers = {}, clusterZoom = [Infinity, -Infinity];
+let mapMode = 'flow', mapQuery = '';
+function initMap() {
+  map = L.map('map', { zoomControl: true, preferCanvas: true }).setView([37.77, -122.42], 13);
+  L.tileLayer('https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png', {
     attribution: '&copy; OSM &copy; CARTO',
     maxZoom: 19
-  }}).addTo(map);
+  }).addTo(map);
+  const renderer = L.canvas({ padding: 0.5 });
 
+  buildStationMarkers(renderer);
+  buildClusterMarkers(renderer);
   renderMarkers('flow');
+  updateMapLayers();
+  map.on('zoomend', updateMapLayers);
+  renderPressureLists();
 
-  document.getElementById('mapColor').addEventListener('change', e => {{
+  document.getElementById('mapColor').addEventListener('change', e => {
     renderMarkers(e.target.value);
-  }});
-
-  document.getElementById('mapSearch').addEventListener('input', e => {{
-    const q = e.target.value.toLowerCase();
-    mapMarkers.forEach(m => {{
-      if (!q || m._stationName.toLowerCase().includes(q)) {{
-        m.setStyle({{ opacity: 1, fillOpacity: 0.7 }});
-      }} else {{
-        m.setStyle({{ opacity: 0.1, fillOpacity: 0.05 }});
-      }}
-    }});
-  }});
+  });
 
-  updateLegend('flow');
-}}
+  document.getElementById('mapSearch').addEventListener('input', e => {
+    mapQuery = e.target.value.toLowerCase();
+    mapMarkers.forEach(m => {
+      if (!mapQuery || m._stationName.toLowerCase().includes(mapQuery)) {
+        m.setStyle({ opacity: 1, fillOpacity: 0.7 });
+      } else {
+        m.setStyle({ opacity: 0.1, fillOpacity: 0.05 });
+      }
+    });
+    updateMapLayers();
+  });
+}
 
-function getFlowColor(nf) {{
+function maxOf(values) {
+  let max = 0;
+  for (let i = 0; i < values.length; i++) if (values[i] > max) max = values[i];
+  return max || 1;
+}
+
+function buildStationMarkers(renderer) {
+  const stations = DATA.stations;
+  const maxAct = maxOf(COLS.stations.total_activity);
+  stationLayer = L.layerGroup();
+  mapMarkers = stations.map((s, i) => {
+    const r = Math.max(3, Math.min(14, Math.sqrt(s.total_activity / maxAct) * 14));
+    const marker = L.circleMarker([s.lat, s.lng], {
+      renderer, radius: r, color: 'rgba(255,255,255,0.3)',
+      weight: 1, opacity: 1, fillOpacity: 0.7
+    }).addTo(stationLayer);
+    marker._stationName = s.station_name;
+
+    const flowClass = s.net_flow > 0 ? 'flow-pos' : s.net_flow < 0 ? 'flow-neg' : 'flow-neutral';
+    const flowLabel = s.net_flow > 0 ? '+' + fmt(s.net_flow) : fmt(s.net_flow);
+    marker.bindPopup(() => `
+      <div style="font-family:Inter,sans-serif;min-width:220px">
+        <div style="font-weight:700;font-size:.95rem;margin-bottom:8px">${s.station_name}</div>
+        <div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;font-size:.8rem">
+          <div>Departures:</div><div style="font-weight:600">${fmt(s.total_departures)}</div>
+          <div>Arrivals:</div><div style="font-weight:600">${fmt(s.total_arrivals)}</div>
+          <div>Net Flow:</div><div><span class="${flowClass}" style="padding:1px 6px;border-radius:3px;font-size:.75rem">${flowLabel}</span></div>
+          <div>Avg Duration:</div><div style="font-weight:600">${fmtDur(s.avg_duration_depart)}</div>
+          <div>Member %:</div><div style="font-weight:600">${fmtPct(s.subscriber_pct)}</div>
+          <div>Total Activity:</div><div style="font-weight:600">${fmt(s.total_activity)}</div>
+          ${pressureRowsHTML(i)}
+        </div>
+      </div>
+    `, { className: '' });
+    return marker;
+  });
+}
+
+function buildClusterMarkers(renderer) {
+  const c = COLS.map_clusters;
+  if (!c) return;
+  const byZoom = {};
+  for (let i = 0; i < c.length; i++) (byZoom[c.zoom[i]] = byZoom[c.zoom[i]] || []).push(i);
+  for (const z in byZoom) {
+    const rows = byZoom[z], maxAct = maxOf(rows.map(i => c.total_activity[i]));
+    const layer = L.layerGroup();
+    layer._rows = rows;
+    layer._maxAct = maxAct;
+    layer._markers = rows.map(i => {
+      const marker = L.circleMarker([c.lat[i], c.lng[i]], {
+        renderer, radius: Math.max(6, Math.sqrt(c.total_activity[i] / maxAct) * 24),
+        color: 'rgba(255,255,255,0.5)', weight: 1, opacity: 1, fillOpacity: 0.6
+      }).addTo(layer);
+      marker.bindTooltip(`${fmt(c.stations[i])} stations \u2022 ${fmt(c.total_activity[i])} trips`);
+      marker.on('click', () => map.setView([c.lat[i], c.lng[i]], Math.min(+z + 2, clusterZoom[1] + 1)));
+      return marker;
+    });
+    clusterLayers[z] = layer;
+    clusterZoom = [Math.min(clusterZoom[0], +z), Math.max(clusterZoom[1], +z)];
+  }
+}
+
+function updateMapLayers() {
+  const z = map.getZoom();
+  const showStations = mapQuery || z > clusterZoom[1];
+  const cz = showStations ? null : Math.max(clusterZoom[0], z);
+  if (showStations) map.addLayer(stationLayer); else map.removeLayer(stationLayer);
+  for (const key in clusterLayers) {
+    if (+key === cz) map.addLayer(clusterLayers[key]); else map.removeLayer(clusterLayers[key]);
+  }
+}
+
+function getFlowColor(nf) {
   if (nf > 5000) return '#22c55e';
   if (nf > 1000) return '#4ade80';
   if (nf > 0) return '#86efac';
   if (nf > -1000) return '#fca5a5';
   if (nf > -5000) return '#f87171';
   return '#ef4444';
-}}
-function getActivityColor(act, max) {{
+}
+// Average weekday net flow in bikes: filling stations green, draining red
+function getPressureColor(v) {
+  if (v >= 10) return '#22c55e';
+  if (v >= 3) return '#4ade80';
+  if (v >= 0.5) return '#86efac';
+  if (v > -0.5) return '#64748b';
+  if (v > -3) return '#fca5a5';
+  if (v > -10) return '#f87171';
+  return '#ef4444';
+}
+function getActivityColor(act, max) {
   const t = Math.min(act / max, 1);
   const r = Math.round(96 + t * 160);
   const g = Math.round(165 - t * 100);
   const b = Math.round(250 - t * 50);
-  return `rgb(${{r}},${{g}},${{b}})`;
-}}
-function getMemberColor(pct) {{
+  return `rgb(${r},${g},${b})`;
+}
+function getMemberColor(pct) {
   if (pct > 80) return '#3b82f6';
   if (pct > 60) return '#60a5fa';
   if (pct > 40) return '#a78bfa';
   if (pct > 20) return '#f59e0b';
   return '#ef4444';
-}}
+}
 
-function renderMarkers(mode) {{
-  mapMarkers.forEach(m => map.removeLayer(m));
-  mapMarkers = [];
+function renderMarkers(mode) {
+  mapMode = mode;
   const stations = DATA.stations;
-  const maxAct = Math.max(...stations.map(s => s.total_activity));
-
-  stations.forEach(s => {{
-    let color;
-    if (mode === 'flow') color = getFlowColor(s.net_flow);
-    else if (mode === 'activity') color = getActivityColor(s.total_activity, maxAct);
-    else color = getMemberColor(s.subscriber_pct);
-
-    const r = Math.max(3, Math.min(14, Math.sqrt(s.total_activity / maxAct) * 14));
-    const marker = L.circleMarker([s.lat, s.lng], {{
-      radius: r, fillColor: color, color: 'rgba(255,255,255,0.3)',
-      weight: 1, opacity: 1, fillOpacity: 0.7
-    }}).addTo(map);
-    marker._stationName = s.station_name;
-
-    const flowClass = s.net_flow > 0 ? 'flow-pos' : s.net_flow < 0 ? 'flow-neg' : 'flow-neutral';
-    const flowLabel = s.net_flow > 0 ? '+' + fmt(s.net_flow) : fmt(s.net_flow);
-    marker.bindPopup(`
-      <div style="font-family:Inter,sans-serif;min-width:220px">
-        <div style="font-weight:700;font-size:.95rem;margin-bottom:8px">${{s.station_name}}</div>
-        <div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;font-size:.8rem">
-          <div>Departures:</div><div style="font-weight:600">${{fmt(s.total_departures)}}</div>
-          <div>Arrivals:</div><div style="font-weight:600">${{fmt(s.total_arrivals)}}</div>
-          <div>Net Flow:</div><div><span class="${{flowClass}}" style="padding:1px 6px;border-radius:3px;font-size:.75rem">${{flowLabel}}</span></div>
-          <div>Avg Duration:</div><div style="font-weight:600">${{fmtDur(s.avg_duration_depart)}}</div>
-          <div>Member %:</div><div style="font-weight:600">${{fmtPct(s.subscriber_pct)}}</div>
-          <div>Total Activity:</div><div style="font-weight:600">${{fmt(s.total_activity)}}</div>
-        </div>
-      </div>
-    `, {{ className: '' }});
-    mapMarkers.push(marker);
-  }});
+  const maxAct = maxOf(COLS.stations.total_activity);
+  const pressure = PRESSURE_MODES[mode];
+  const color = (nf, act, max, pct, p) => pressure ? getPressureColor(p) : mode === 'flow' ? getFlowColor(nf)
+    : mode === 'activity' ? getActivityColor(act, max) : getMemberColor(pct);
+  const P = COLS.station_pressure;
+  mapMarkers.forEach((m, i) => {
+    const s = stations[i];
+    m.setStyle({ fillColor: color(s.net_flow, s.total_activity, maxAct, s.subscriber_pct, pressure && P[pressure][i]) });
+  });
+  const c = COLS.map_clusters;
+  for (const z in clusterLayers) {
+    const layer = clusterLayers[z];
+    layer._markers.forEach((m, k) => {
+      const i = layer._rows[k];
+      m.setStyle({ fillColor: color(c.net_flow[i], c.total_activity[i], layer._maxAct, c.subscriber_pct[i],
+                                    pressure && c[pressure][i]) });
+    });
+  }
   updateLegend(mode);
-}}
+}
 
-function updateLegend(mode) {{
+function updateLegend(mode) {
   const el = document.getElementById('mapLegend');
-  if (mode === 'flow') {{
+  if (mode === 'flow') {
     el.innerHTML = '<span><span class="dot" style="background:#22c55e"></span> Net arrivals</span><span><span class="dot" style="background:#86efac"></span> Slight net arrivals</span><span><span class="dot" style="background:#fca5a5"></span> Slight net departures</span><span><span class="dot" style="background:#ef4444"></span> Net departures</span>';
-  }} else if (mode === 'activity') {{
+  } else if (PRESSURE_MODES[mode]) {
+    const verb = mode === 'drain' ? 'by 9am' : 'by 6pm';
+    el.innerHTML = `<span><span class="dot" style="background:#22c55e"></span> Fills 10+ bikes ${verb}</span><span><span class="dot" style="background:#86efac"></span> Fills 0.5-3</span><span><span class="dot" style="background:#64748b"></span> Balanced</span><span><span class="dot" style="background:#fca5a5"></span> Drains 0.5-3</span><span><span class="dot" style="background:#ef4444"></span> Drains 10+ bikes ${verb}</span>`;
+  } else if (mode === 'activity') {
     el.innerHTML = '<span><span class="dot" style="background:rgb(96,165,250)"></span> Low activity</span><span><span class="dot" style="background:rgb(200,100,210)"></span> Medium</span><span><span class="dot" style="background:rgb(256,65,200)"></span> High activity</span>';
-  }} else {{
+  } else {
     el.innerHTML = '<span><span class="dot" style="background:#3b82f6"></span> 80%+ members</span><span><span class="dot" style="background:#60a5fa"></span> 60-80%</span><span><span class="dot" style="background:#a78bfa"></span> 40-60%</span><span><span class="dot" style="background:#f59e0b"></span> 20-40%</span><span><span class="dot" style="background:#ef4444"></span> <20%</span>';
-  }}
-}}
+  }
+}
+
+// ===================== REBALANCING PRESSURE =====================
+// COLS.station_pressure rows follow COLS.stations: a station's average
+// weekday net flow (arrivals - departures) by 9am and by 6pm.
+const PRESSURE_MODES = { drain: 'net_by_9am', fill: 'net_by_6pm' };
+const TOP_PRESSURE = 10;
+const fmtNet = v => (v > 0 ? '+' : '') + v.toFixed(1);
+
+function pressureRowsHTML(row) {
+  const P = COLS.station_pressure;
+  if (!P) return '';
+  return `<div>Weekday by 9am:</div><div style="font-weight:600">${fmtNet(P.net_by_9am[row])} bikes</div>
+          <div>Weekday by 6pm:</div><div style="font-weight:600">${fmtNet(P.net_by_6pm[row])} bikes</div>`;
+}
+
+function renderPressureLists() {
+  const P = COLS.station_pressure;
+  if (!P) {
+    document.getElementById('pressureCard').style.display = 'none';
+    document.querySelectorAll('#mapColor option[data-needs]').forEach(o => o.remove());
+    return;
+  }
+  const names = COLS.stations.station_name;
+  // The TOP_PRESSURE rows with the lowest sign * value, skipping those on the wrong side of zero
+  const ranked = (values, sign) => Array.from(values.keys()).filter(i => sign * values[i] < 0)
+    .sort((a, b) => sign * (values[a] - values[b])).slice(0, TOP_PRESSURE);
+  const list = (title, rows, values) => `<div><h5>${title}</h5><table><tbody>${rows.map(i => `
+    <tr data-row="${i}" style="cursor:pointer"><td style="max-width:260px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${names[i]}</td>
+    <td><span class="flow-indicator ${values[i] > 0 ? 'flow-pos' : 'flow-neg'}">${fmtNet(values[i])}</span></td></tr>`).join('')
+    || '<tr><td style="color:var(--text2)">None</td></tr>'}</tbody></table></div>`;
+  const el = document.getElementById('pressureLists');
+  el.innerHTML = list('Drains by 9am', ranked(P.net_by_9am, 1), P.net_by_9am)
+    + list('Fills by 6pm', ranked(P.net_by_6pm, -1), P.net_by_6pm);
+  el.querySelectorAll('tr[data-row]').forEach(tr => {
+    tr.addEventListener('click', () => {
+      const i = +tr.dataset.row, s = DATA.stations[i];
+      map.setView([s.lat, s.lng], Math.max(map.getZoom(), clusterZoom[1] + 1));
+      mapMarkers[i].openPopup();
+    });
+  });
+}
 
 // ===================== STATION TABLE =====================
-let stationData = DATA.stations.map((s,i) => ({{...s, rank: i+1}}));
-let stationSort = {{ col: 'total_activity', asc: false }};
+// Sorting walks the prebuilt permutation in COLS.station_order and search
+// marks matches through the trigram index, so a keystroke or header click
+// never re-sorts the station list; only the visible page is rendered.
+let stationSort = { col: 'total_activity', asc: false };
 let stationPage = 0;
+let stationMatches = null;   // Uint8Array of search hits per station row, or null for all
+let stationView = [];        // station rows in display order
+let stationKeys = null, stationTrigrams = null;
 const ROWS_PER_PAGE = 25;
+const SEARCH_DEBOUNCE_MS = 120;
+const FUZZY_MATCH = 0.6;     // share of the query's trigrams a typo-tolerant match must contain
 
-function renderStationTable() {{
-  let filtered = stationData;
-  const q = document.getElementById('stationSearch').value.toLowerCase();
-  if (q) filtered = filtered.filter(s => s.station_name.toLowerCase().includes(q));
+function searchKey(s) {
+  return s.toLowerCase().replace(/[^a-z0-9]+/g, ' ').trim();
+}
 
-  // Sort
-  filtered.sort((a,b) => {{
-    let va = a[stationSort.col], vb = b[stationSort.col];
-    if (typeof va === 'string') {{ va = va.toLowerCase(); vb = vb.toLowerCase(); }}
-    return stationSort.asc ? (va > vb ? 1 : -1) : (va < vb ? 1 : -1);
-  }});
+function matchStations(q) {
+  const query = searchKey(q), n = COLS.stations.length, hits = new Uint8Array(n);
+  if (!stationKeys) stationKeys = COLS.stations.station_name.map(searchKey);
+  if (query.length < 3) {
+    for (let i = 0; i < n; i++) if (stationKeys[i].includes(query)) hits[i] = 1;
+    return hits;
+  }
+  // Score stations by how many of the query's trigrams their names contain.
+  // Every substring match shares the query's first trigram, so it is scored
+  // too; typo-tolerant matches are only used when there is no substring match.
+  const t = COLS.station_trigrams, rows = COLS.station_trigram_rows.station;
+  if (!stationTrigrams) stationTrigrams = new Map(t.trigram.map((g, k) => [g, k]));
+  const padded = ' ' + query, grams = new Set(), score = new Uint16Array(n);
+  for (let j = 0; j + 3 <= padded.length; j++) grams.add(padded.slice(j, j + 3));
+  for (const g of grams) {
+    const k = stationTrigrams.get(g);
+    if (k === undefined) continue;
+    for (let p = t.offset[k], end = p + t.count[k]; p < end; p++) score[rows[p]]++;
+  }
+  let found = false;
+  for (let i = 0; i < n; i++) {
+    if (score[i] && stationKeys[i].includes(query)) found = hits[i] = 1;
+  }
+  if (found) return hits;
+  const need = Math.ceil(grams.size * FUZZY_MATCH);
+  for (let i = 0; i < n; i++) if (score[i] >= need) hits[i] = 1;
+  return hits;
+}
 
-  // Re-rank
-  filtered.forEach((s,i) => s._displayRank = i + 1);
+function updateStationView() {
+  const order = COLS.station_order && COLS.station_order[stationSort.col];
+  const n = COLS.stations.length, view = [];
+  for (let k = 0; k < n; k++) {
+    const pos = stationSort.asc ? k : n - 1 - k;
+    const i = order ? order[pos] : pos;
+    if (!stationMatches || stationMatches[i]) view.push(i);
+  }
+  stationView = view;
+}
 
-  const total = filtered.length;
-  const pages = Math.ceil(total / ROWS_PER_PAGE);
-  stationPage = Math.min(stationPage, pages - 1);
+function renderStationTable() {
+  updateStationView();
+  renderStationPage();
+}
+
+function renderStationPage() {
+  const total = stationView.length;
+  const pages = Math.max(1, Math.ceil(total / ROWS_PER_PAGE));
+  stationPage = Math.max(0, Math.min(stationPage, pages - 1));
   const start = stationPage * ROWS_PER_PAGE;
-  const pageData = filtered.slice(start, start + ROWS_PER_PAGE);
-  const maxAct = Math.max(...DATA.stations.map(s => s.total_activity));
+  const pageRows = stationView.slice(start, start + ROWS_PER_PAGE);
 
   const body = document.getElementById('stationBody');
-  body.innerHTML = pageData.map(s => {{
+  body.innerHTML = pageRows.map((i, k) => {
+    const s = DATA.stations[i];
     const flowClass = s.net_flow > 0 ? 'flow-pos' : s.net_flow < 0 ? 'flow-neg' : 'flow-neutral';
     const flowLabel = s.net_flow > 0 ? '+' + fmt(s.net_flow) : fmt(s.net_flow);
-    const depPct = (s.total_departures / s.total_activity * 100).toFixed(0);
-    const arrPct = (s.total_arrivals / s.total_activity * 100).toFixed(0);
-    return `<tr data-station="${{s.station_name}}" style="cursor:pointer">
-      <td>${{s._displayRank}}</td>
-      <td style="font-weight:500;max-width:300px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${{s.station_name}}</td>
-      <td>${{fmt(s.total_activity)}}</td>
-      <td>${{fmt(s.total_departures)}}</td>
-      <td>${{fmt(s.total_arrivals)}}</td>
-      <td><span class="flow-indicator ${{flowClass}}">${{flowLabel}}</span></td>
-      <td>${{fmtDur(s.avg_duration_depart)}}</td>
+    return `<tr data-station="${s.station_name}" style="cursor:pointer">
+      <td>${start + k + 1}</td>
+      <td style="font-weight:500;max-width:300px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${s.station_name}</td>
+      <td>${fmt(s.total_activity)}</td>
+      <td>${fmt(s.total_departures)}</td>
+      <td>${fmt(s.total_arrivals)}</td>
+      <td><span class="flow-indicator ${flowClass}">${flowLabel}</span></td>
+      <td>${fmtDur(s.avg_duration_depart)}</td>
       <td>
         <div style="display:flex;align-items:center;gap:6px">
           <div class="mini-bar" style="width:60px">
-            <div class="mini-bar-fill" style="width:${{s.subscriber_pct}}%;background:linear-gradient(90deg,#3b82f6,#60a5fa)"></div>
+            <div class="mini-bar-fill" style="width:${s.subscriber_pct}%;background:linear-gradient(90deg,#3b82f6,#60a5fa)"></div>
           </div>
-          ${{fmtPct(s.subscriber_pct)}}
+          ${fmtPct(s.subscriber_pct)}
         </div>
       </td>
     </tr>`;
-  }}).join('');
+  }).join('');
 
   // Page controls
   const pc = document.getElementById('stationPages');
-  let pcHTML = `<button class="page-btn" onclick="stationPage=0;renderStationTable()" ${{stationPage===0?'disabled':''}}>\u00AB</button>`;
-  pcHTML += `<button class="page-btn" onclick="stationPage--;renderStationTable()" ${{stationPage===0?'disabled':''}}>Prev</button>`;
-  pcHTML += `<span style="font-size:.8rem;color:var(--text2);padding:0 8px">${{start+1}}\u2013${{Math.min(start+ROWS_PER_PAGE,total)}} of ${{total}}</span>`;
-  pcHTML += `<button class="page-btn" onclick="stationPage++;renderStationTable()" ${{stationPage>=pages-1?'disabled':''}}>Next</button>`;
-  pcHTML += `<button class="page-btn" onclick="stationPage=${{pages-1}};renderStationTable()" ${{stationPage>=pages-1?'disabled':''}}>\u00BB</button>`;
+  let pcHTML = `<button class="page-btn" onclick="stationPage=0;renderStationPage()" ${stationPage===0?'disabled':''}>\u00AB</button>`;
+  pcHTML += `<button class="page-btn" onclick="stationPage--;renderStationPage()" ${stationPage===0?'disabled':''}>Prev</button>`;
+  pcHTML += `<span style="font-size:.8rem;color:var(--text2);padding:0 8px">${total ? start+1 : 0}\u2013${Math.min(start+ROWS_PER_PAGE,total)} of ${total}</span>`;
+  pcHTML += `<button class="page-btn" onclick="stationPage++;renderStationPage()" ${stationPage>=pages-1?'disabled':''}>Next</button>`;
+  pcHTML += `<button class="page-btn" onclick="stationPage=${pages-1};renderStationPage()" ${stationPage>=pages-1?'disabled':''}>\u00BB</button>`;
   pc.innerHTML = pcHTML;
 
   // Row click handlers
-  body.querySelectorAll('tr').forEach(tr => {{
+  body.querySelectorAll('tr').forEach(tr => {
     tr.addEventListener('click', () => showStationDetail(tr.dataset.station));
-  }});
-}}
+  });
+}
+
+// Station name -> row of COLS.stations, which is also its row of the
+// station x month matrix.
+let stationRows = null;
+function stationRow(name) {
+  if (!stationRows) stationRows = new Map(COLS.stations.station_name.map((n, i) => [n, i]));
+  return stationRows.get(name);
+}
+
+// Top destinations and origins of one station row, from the OD offset tables
+function stationOdHTML(row) {
+  const od = COLS.station_od;
+  if (!od) return '';
+  const list = (title, t, offset, count) => {
+    let rows = '';
+    for (let k = offset; k < offset + count; k++) {
+      rows += `<tr data-station="${t.station_name[k]}" style="cursor:pointer">
+        <td style="max-width:220px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${t.station_name[k]}</td>
+        <td>${fmt(t.trips[k])}</td><td>${fmtDur(t.avg_duration[k])}</td></tr>`;
+    }
+    return `<div><h5>${title}</h5><table><tbody>${rows || '<tr><td style="color:var(--text2)">No trips</td></tr>'}</tbody></table></div>`;
+  };
+  return `<div class="od-grid">${list('Top destinations', COLS.station_destinations, od.dest_offset[row], od.dest_count[row])}`
+    + `${list('Top origins', COLS.station_origins, od.orig_offset[row], od.orig_count[row])}</div>`;
+}
+
+// Hourly net flow (arrivals - departures) of one station row on an average
+// weekday and weekend day, from COLS.station_hourly_flow (24 rows per station)
+let stationFlowChart = null;
+function stationFlowHTML() {
+  return COLS.station_hourly_flow
+    ? '<div class="station-heatmap"><h5>Net flow by hour (average day)</h5><div class="chart-container" style="height:200px"><canvas id="stationFlowCanvas"></canvas></div></div>'
+    : '';
+}
+function showStationFlow(row) {
+  const f = COLS.station_hourly_flow;
+  if (!f) return;
+  const hours = Array.from({ length: 24 }, (_, h) => h);
+  const net = day => hours.map(h => +(f[day + '_arrivals'][row * 24 + h] - f[day + '_departures'][row * 24 + h]).toFixed(2));
+  if (stationFlowChart) stationFlowChart.destroy();
+  stationFlowChart = new Chart(document.getElementById('stationFlowCanvas'), {
+    type: 'bar',
+    data: {
+      labels: hours.map(h => h + ':00'),
+      datasets: [
+        { label: 'Weekday', data: net('weekday'), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 3, borderSkipped: false },
+        { label: 'Weekend day', data: net('weekend'), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 3, borderSkipped: false }
+      ]
+    },
+    options: {
+      responsive: true, maintainAspectRatio: false,
+      plugins: { legend: { position: 'top', labels: { usePointStyle: true, pointStyle: 'circle' } },
+        tooltip: { callbacks: { label: c => c.dataset.label + ': ' + fmtNet(c.raw) + ' bikes' } } },
+      scales: {
+        y: { ticks: { callback: v => fmtNet(v) }, grid: { color: 'rgba(255,255,255,0.04)' } },
+        x: { ticks: { maxTicksLimit: 12 }, grid: { display: false } }
+      }
+    }
+  });
+}
 
 let stationDetailChart = null;
-function showStationDetail(name) {{
-  const s = DATA.stations.find(x => x.station_name === name);
-  if (!s) return;
-  const smData = DATA.station_monthly.filter(x => x.station_name === name).sort((a,b) => a.year_month.localeCompare(b.year_month));
+function showStationDetail(name) {
+  const row = stationRow(name);
+  if (row === undefined) return;
   const el = document.getElementById('stationDetail');
-
-  if (smData.length === 0) {{
-    el.innerHTML = `<div class="station-detail"><h4>${{name}}</h4><p style="color:var(--text2)">No monthly trend data available for this station (not in top 50 by activity).</p></div>`;
+  if (!shardLoaded('station_detail')) {
+    el.innerHTML = `<div class="station-detail"><h4>${name}</h4><p style="color:var(--text2)">Loading monthly trend\u2026</p></div>`;
+    loadShard('station_detail').then(() => showStationDetail(name))
+      .catch(() => { el.querySelector('p').textContent = 'Could not load the monthly trend.'; });
+    return;
+  }
+  const matrix = COLS.station_month_trips || { length: 0 };
+  let months = Object.keys(matrix).filter(k => k !== 'length');
+  let trips = months.map(m => matrix[m][row]);
+  // Trim the months before the station opened and after it last saw a trip
+  const first = trips.findIndex(n => n > 0), last = trips.length - 1 - [...trips].reverse().findIndex(n => n > 0);
+  if (first < 0) {
+    el.innerHTML = `<div class="station-detail"><h4>${name}</h4><p style="color:var(--text2)">No monthly trend data available for this station.</p>${stationOdHTML(row)}${stationHeatmapHTML()}</div>`;
+    showStationHeatmap(el, row);
     return;
-  }}
+  }
+  months = months.slice(first, last + 1);
+  trips = trips.slice(first, last + 1);
 
-  el.innerHTML = `<div class="station-detail"><h4>${{name}}</h4><div class="chart-container" style="height:250px"><canvas id="stationDetailCanvas"></canvas></div></div>`;
+  el.innerHTML = `<div class="station-detail"><h4>${name}</h4><div class="chart-container" style="height:250px"><canvas id="stationDetailCanvas"></canvas></div>${stationOdHTML(row)}${stationFlowHTML()}${stationHeatmapHTML()}</div>`;
+  el.querySelectorAll('.od-grid tr').forEach(tr => {
+    tr.addEventListener('click', () => showStationDetail(tr.dataset.station));
+  });
+  showStationFlow(row);
+  showStationHeatmap(el, row);
 
   if (stationDetailChart) stationDetailChart.destroy();
-  stationDetailChart = new Chart(document.getElementById('stationDetailCanvas'), {{
+  stationDetailChart = new Chart(document.getElementById('stationDetailCanvas'), {
     type: 'bar',
-    data: {{
-      labels: smData.map(d => d.year_month),
-      datasets: [{{ label: 'Monthly Trips', data: smData.map(d => d.trips),
-        backgroundColor: 'rgba(96,165,250,0.5)', borderRadius: 3, borderSkipped: false }}]
-    }},
-    options: {{
+    data: {
+      labels: months,
+      datasets: [{ label: 'Monthly Trips', data: trips,
+        backgroundColor: 'rgba(96,165,250,0.5)', borderRadius: 3, borderSkipped: false }]
+    },
+    options: {
       responsive: true, maintainAspectRatio: false,
-      plugins: {{ legend: {{ display: false }}, tooltip: {{ callbacks: {{ label: c => fmt(c.raw) + ' trips' }} }} }},
-      scales: {{
-        y: {{ ticks: {{ callback: v => v >= 1000 ? (v/1000).toFixed(0)+'K' : v }}, grid: {{ color: 'rgba(255,255,255,0.04)' }} }},
-        x: {{ ticks: {{ maxTicksLimit: 10, maxRotation: 45 }}, grid: {{ display: false }} }}
-      }}
-    }}
-  }});
-}}
+      plugins: { legend: { display: false }, tooltip: { callbacks: { label: c => fmt(c.raw) + ' trips' } } },
+      scales: {
+        y: { ticks: { callback: v => v >= 1000 ? (v/1000).toFixed(0)+'K' : v }, grid: { color: 'rgba(255,255,255,0.04)' } },
+        x: { ticks: { maxTicksLimit: 10, maxRotation: 45 }, grid: { display: false } }
+      }
+    }
+  });
+}
 
-document.getElementById('stationSearch').addEventListener('input', () => {{ stationPage = 0; renderStationTable(); }});
-document.querySelectorAll('#stationTable th').forEach(th => {{
-  th.addEventListener('click', () => {{
+function initStationTable() {
+let searchTimer = null;
+document.getElementById('stationSearch').addEventListener('input', e => {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => {
+    stationMatches = e.target.value.trim() ? matchStations(e.target.value) : null;
+    stationPage = 0;
+    renderStationTable();
+  }, SEARCH_DEBOUNCE_MS);
+});
+document.querySelectorAll('#stationTable th').forEach(th => {
+  th.addEventListener('click', () => {
     const col = th.dataset.col;
     if (stationSort.col === col) stationSort.asc = !stationSort.asc;
-    else {{ stationSort.col = col; stationSort.asc = col === 'station_name'; }}
+    else { stationSort.col = col; stationSort.asc = col === 'station_name'; }
     document.querySelectorAll('#stationTable th').forEach(t => t.classList.remove('sorted'));
     th.classList.add('sorted');
     th.querySelector('.sort-icon').textContent = stationSort.asc ? '\\u25B2' : '\\u25BC';
     stationPage = 0;
     renderStationTable();
-  }});
-}});
+  });
+});
 renderStationTable();
+}
 
 // ===================== ROUTE TABLE =====================
-let routeSort = {{ col: 'count', asc: false }};
-function renderRouteTable() {{
-  let routes = DATA.top_routes.map((r,i) => ({{...r, rank: i+1}}));
+let routeSort = { col: 'count', asc: false };
+function renderRouteTable() {
   const q = document.getElementById('routeSearch').value.toLowerCase();
-  if (q) routes = routes.filter(r => r.start_station_name.toLowerCase().includes(q) || r.end_station_name.toLowerCase().includes(q));
+  let ids = DATA.top_routes.map((r,i) => i);
+  if (q) {
+    // Match station names once, then follow each match's offsets to its routes
+    const idx = COLS.route_stations || { length: 0 }, hits = new Set();
+    for (let s = 0; s < idx.length; s++) {
+      if (!idx.station_name[s].toLowerCase().includes(q)) continue;
+      for (let k = idx.offset[s], end = k + idx.count[s]; k < end; k++) hits.add(COLS.route_station_routes.route[k]);
+    }
+    ids = [...hits];
+  }
+  let routes = ids.map(i => ({...DATA.top_routes[i], rank: i+1}));
 
-  routes.sort((a,b) => {{
-    const map = {{ rank: 'trip_count', start: 'start_station_name', end: 'end_station_name', count: 'trip_count', dur: 'avg_duration' }};
+  routes.sort((a,b) => {
+    const map = { rank: 'trip_count', start: 'start_station_name', end: 'end_station_name', count: 'trip_count', dur: 'avg_duration' };
     const col = map[routeSort.col] || routeSort.col;
     let va = a[col], vb = b[col];
-    if (typeof va === 'string') {{ va = va.toLowerCase(); vb = vb.toLowerCase(); }}
+    if (typeof va === 'string') { va = va.toLowerCase(); vb = vb.toLowerCase(); }
     return routeSort.asc ? (va > vb ? 1 : -1) : (va < vb ? 1 : -1);
-  }});
+  });
 
   routes.forEach((r,i) => r._rank = i + 1);
   const maxTrips = Math.max(...DATA.top_routes.map(r => r.trip_count));
 
-  document.getElementById('routeBody').innerHTML = routes.map(r => {{
+  document.getElementById('routeBody').innerHTML = routes.map(r => {
     const barW = (r.trip_count / maxTrips * 100).toFixed(0);
     return `<tr>
-      <td>${{r._rank}}</td>
-      <td style="max-width:250px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${{r.start_station_name}}</td>
-      <td style="max-width:250px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${{r.end_station_name}}</td>
+      <td>${r._rank}</td>
+      <td style="max-width:250px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${r.start_station_name}</td>
+      <td style="max-width:250px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap">${r.end_station_name}</td>
       <td>
         <div style="display:flex;align-items:center;gap:8px">
           <div class="mini-bar" style="width:100px">
-            <div class="mini-bar-fill" style="width:${{barW}}%;background:linear-gradient(90deg,#60a5fa,#00BFA5)"></div>
+            <div class="mini-bar-fill" style="width:${barW}%;background:linear-gradient(90deg,#60a5fa,#00BFA5)"></div>
           </div>
-          ${{fmt(r.trip_count)}}
+          ${fmt(r.trip_count)}
         </div>
       </td>
-      <td>${{fmtDur(r.avg_duration)}}</td>
+      <td>${fmtDur(r.avg_duration)}</td>
     </tr>`;
-  }}).join('');
-}}
+  }).join('');
+}
 
+function initRouteTable() {
 document.getElementById('routeSearch').addEventListener('input', renderRouteTable);
-document.querySelectorAll('#routeTable th').forEach(th => {{
-  th.addEventListener('click', () => {{
+document.querySelectorAll('#routeTable th').forEach(th => {
+  th.addEventListener('click', () => {
     const col = th.dataset.col;
     if (routeSort.col === col) routeSort.asc = !routeSort.asc;
-    else {{ routeSort.col = col; routeSort.asc = col === 'start' || col === 'end'; }}
+    else { routeSort.col = col; routeSort.asc = col === 'start' || col === 'end'; }
     document.querySelectorAll('#routeTable th').forEach(t => t.classList.remove('sorted'));
     th.classList.add('sorted');
     th.querySelector('.sort-icon').textContent = routeSort.asc ? '\\u25B2' : '\\u25BC';
     renderRouteTable();
-  }});
-}});
+  });
+});
 renderRouteTable();
+}
+
+// ===================== HEATMAPS =====================
+// Trips per slot of the week as a 7-row grid, Monday first: values[dow * slotsPerDay + slot].
+// Shading is by the square root of the share of the busiest slot so quiet hours still show.
+const HEATMAP_DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'];
+function drawHeatmap(canvas, values, slotMinutes, what) {
+  const perDay = 24 * 60 / slotMinutes, left = 34, top = 16;
+  const dpr = window.devicePixelRatio || 1, w = canvas.clientWidth, h = canvas.clientHeight;
+  canvas.width = w * dpr;
+  canvas.height = h * dpr;
+  const ctx = canvas.getContext('2d');
+  ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+  ctx.clearRect(0, 0, w, h);
+  const cw = (w - left) / perDay, ch = (h - top) / 7;
+  let max = 0;
+  for (let i = 0; i < values.length; i++) if (values[i] > max) max = values[i];
+  ctx.fillStyle = '#1a2236';
+  ctx.fillRect(left, top, w - left, h - top);
+  for (let d = 0; d < 7; d++) {
+    for (let k = 0; k < perDay; k++) {
+      const v = values[d * perDay + k];
+      if (!v) continue;
+      ctx.fillStyle = `rgba(96,165,250,${Math.sqrt(v / max).toFixed(3)})`;
+      ctx.fillRect(left + k * cw, top + d * ch, Math.ceil(cw), Math.ceil(ch) - 1);
+    }
+  }
+  ctx.fillStyle = '#94a3b8';
+  ctx.font = '11px Inter, sans-serif';
+  ctx.textBaseline = 'middle';
+  HEATMAP_DAYS.forEach((name, d) => ctx.fillText(name, 0, top + (d + 0.5) * ch));
+  ctx.textBaseline = 'top';
+  for (let hour = 0; hour < 24; hour += 3) ctx.fillText(hour + ':00', left + hour * (60 / slotMinutes) * cw, 0);
+
+  const clock = m => Math.floor(m / 60) + ':' + String(m % 60).padStart(2, '0');
+  canvas.onmousemove = e => {
+    const r = canvas.getBoundingClientRect();
+    const k = Math.floor((e.clientX - r.left - left) / cw), d = Math.floor((e.clientY - r.top - top) / ch);
+    if (k < 0 || k >= perDay || d < 0 || d >= 7) { canvas.title = ''; return; }
+    canvas.title = `${HEATMAP_DAYS[d]} ${clock(k * slotMinutes)}\u2013${clock((k + 1) * slotMinutes)}: `
+      + `${fmt(values[d * perDay + k])} ${what}`;
+  };
+}
+
+// Departures / arrivals toggle for one heatmap; ``valuesFor(mode)`` returns the grid to draw
+function bindHeatmap(toggles, canvas, slotMinutes, valuesFor) {
+  let mode = 'departures';
+  const draw = () => drawHeatmap(canvas, valuesFor(mode), slotMinutes, mode);
+  toggles.querySelectorAll('.toggle-btn').forEach(btn => {
+    btn.addEventListener('click', () => {
+      toggles.querySelectorAll('.toggle-btn').forEach(b => b.classList.remove('active'));
+      btn.classList.add('active');
+      mode = btn.dataset.mode;
+      draw();
+    });
+  });
+  draw();
+  return draw;
+}
+
+const HEATMAP_TOGGLES = '<button class="toggle-btn active" data-mode="departures">Departures</button>'
+  + '<button class="toggle-btn" data-mode="arrivals">Arrivals</button>';
 
-// ===================== HOURLY CHART =====================
-let hourlyChart;
-(function(){{
+// Weekly heatmap of one station row, drawn once the heatmap shard has loaded
+function stationHeatmapHTML() {
+  return SHARD_URLS.station_heatmaps
+    ? `<div class="station-heatmap"><h5>Weekly pattern</h5><div class="toggle-row">${HEATMAP_TOGGLES}</div><canvas class="heatmap"></canvas></div>`
+    : '';
+}
+function showStationHeatmap(el, row) {
+  const box = el.querySelector('.station-heatmap');
+  if (!box) return;
+  if (!shardLoaded('station_heatmaps')) {
+    loadShard('station_heatmaps').then(() => { if (box.isConnected) showStationHeatmap(el, row); })
+      .catch(() => { box.querySelector('h5').textContent = 'Could not load the weekly pattern.'; });
+    return;
+  }
+  if (!COLS.station_slots) {
+    box.querySelector('h5').textContent = 'No weekly pattern available.';
+    return;
+  }
+  const minutes = DATA.station_slot_minutes, n = 7 * 24 * 60 / minutes;
+  box.querySelector('h5').textContent = `Weekly pattern (${minutes}-minute slots)`;
+  bindHeatmap(box.querySelector('.toggle-row'), box.querySelector('canvas'), minutes,
+    mode => COLS.station_slots[mode].subarray(row * n, (row + 1) * n));
+}
+
+// ===================== TIME PATTERNS =====================
+let hourlyChart, dowChart;
+function initTimeCharts() {
+
+// Hourly
+(function(){
 const h = DATA.hourly;
-hourlyChart = new Chart(document.getElementById('hourlyChart'), {{
+hourlyChart = new Chart(document.getElementById('hourlyChart'), {
   type: 'bar',
-  data: {{
+  data: {
     labels: h.map(d => d.hour + ':00'),
     datasets: [
-      {{ label: 'Members', data: h.map(d => d.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false }},
-      {{ label: 'Casual', data: h.map(d => d.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }}
+      { label: 'Members', data: h.map(d => d.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false },
+      { label: 'Casual', data: h.map(d => d.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }
     ]
-  }},
-  options: {{
+  },
+  options: {
     responsive: true, maintainAspectRatio: false,
-    plugins: {{ legend: {{ position: 'top', labels: {{ usePointStyle: true, pointStyle: 'circle' }} }},
-      tooltip: {{ callbacks: {{ label: c => c.dataset.label + ': ' + fmt(c.raw) }} }}
-    }},
-    scales: {{
-      x: {{ stacked: true, grid: {{ display: false }} }},
-      y: {{ stacked: true, ticks: {{ callback: v => (v/1e6).toFixed(1) + 'M' }}, grid: {{ color: 'rgba(255,255,255,0.04)' }} }}
-    }}
-  }}
-}});
-
-document.querySelectorAll('#hourlyToggles .toggle-btn').forEach(btn => {{
-  btn.addEventListener('click', () => {{
+    plugins: { legend: { position: 'top', labels: { usePointStyle: true, pointStyle: 'circle' } },
+      tooltip: { callbacks: { label: c => c.dataset.label + ': ' + fmt(c.raw) } }
+    },
+    scales: {
+      x: { stacked: true, grid: { display: false } },
+      y: { stacked: true, ticks: { callback: v => (v/1e6).toFixed(1) + 'M' }, grid: { color: 'rgba(255,255,255,0.04)' } }
+    }
+  }
+});
+
+document.querySelectorAll('#hourlyToggles .toggle-btn').forEach(btn => {
+  btn.addEventListener('click', () => {
     document.querySelectorAll('#hourlyToggles .toggle-btn').forEach(b => b.classList.remove('active'));
     btn.classList.add('active');
     const ch = hourlyChart;
-    if (btn.dataset.mode === 'count') {{
+    if (btn.dataset.mode === 'count') {
       ch.data.datasets = [
-        {{ label: 'Members', data: h.map(d => d.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false }},
-        {{ label: 'Casual', data: h.map(d => d.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }}
+        { label: 'Members', data: h.map(d => d.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false },
+        { label: 'Casual', data: h.map(d => d.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }
       ];
       ch.options.scales.x.stacked = true;
       ch.options.scales.y.stacked = true;
       ch.options.scales.y.ticks.callback = v => (v/1e6).toFixed(1) + 'M';
-    }} else {{
-      ch.data.datasets = [{{
+    } else {
+      ch.data.datasets = [{
         label: 'Avg Duration', data: h.map(d => d.avg_duration),
         backgroundColor: 'rgba(245,158,11,0.7)', borderRadius: 4, borderSkipped: false
-      }}];
+      }];
       ch.options.scales.x.stacked = false;
       ch.options.scales.y.stacked = false;
       ch.options.scales.y.ticks.callback = v => fmtDur(v);
-    }}
+    }
     ch.update();
-  }});
-}});
-}})();
+  });
+});
+})();
 
-// ===================== DAY OF WEEK CHART =====================
-let dowChart;
-(function(){{
+// Day of week
+(function(){
 const d = DATA.dow;
-dowChart = new Chart(document.getElementById('dowChart'), {{
+dowChart = new Chart(document.getElementById('dowChart'), {
   type: 'bar',
-  data: {{
+  data: {
     labels: d.map(x => x.day_name),
     datasets: [
-      {{ label: 'Members', data: d.map(x => x.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false }},
-      {{ label: 'Casual', data: d.map(x => x.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }}
+      { label: 'Members', data: d.map(x => x.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false },
+      { label: 'Casual', data: d.map(x => x.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }
     ]
-  }},
-  options: {{
+  },
+  options: {
     responsive: true, maintainAspectRatio: false,
-    plugins: {{ legend: {{ position: 'top', labels: {{ usePointStyle: true, pointStyle: 'circle' }} }},
-      tooltip: {{ callbacks: {{ label: c => c.dataset.label + ': ' + fmt(c.raw) }} }}
-    }},
-    scales: {{
-      x: {{ stacked: true, grid: {{ display: false }} }},
-      y: {{ stacked: true, ticks: {{ callback: v => (v/1e6).toFixed(1) + 'M' }}, grid: {{ color: 'rgba(255,255,255,0.04)' }} }}
-    }}
-  }}
-}});
-
-document.querySelectorAll('#dowToggles .toggle-btn').forEach(btn => {{
-  btn.addEventListener('click', () => {{
+    plugins: { legend: { position: 'top', labels: { usePointStyle: true, pointStyle: 'circle' } },
+      tooltip: { callbacks: { label: c => c.dataset.label + ': ' + fmt(c.raw) } }
+    },
+    scales: {
+      x: { stacked: true, grid: { display: false } },
+      y: { stacked: true, ticks: { callback: v => (v/1e6).toFixed(1) + 'M' }, grid: { color: 'rgba(255,255,255,0.04)' } }
+    }
+  }
+});
+
+document.querySelectorAll('#dowToggles .toggle-btn').forEach(btn => {
+  btn.addEventListener('click', () => {
     document.querySelectorAll('#dowToggles .toggle-btn').forEach(b => b.classList.remove('active'));
     btn.classList.add('active');
     const ch = dowChart;
-    if (btn.dataset.mode === 'count') {{
+    if (btn.dataset.mode === 'count') {
       ch.data.datasets = [
-        {{ label: 'Members', data: d.map(x => x.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false }},
-        {{ label: 'Casual', data: d.map(x => x.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }}
+        { label: 'Members', data: d.map(x => x.trips_Subscriber), backgroundColor: 'rgba(96,165,250,0.7)', borderRadius: 4, borderSkipped: false },
+        { label: 'Casual', data: d.map(x => x.trips_Customer), backgroundColor: 'rgba(0,191,165,0.7)', borderRadius: 4, borderSkipped: false }
       ];
       ch.options.scales.x.stacked = true;
       ch.options.scales.y.stacked = true;
       ch.options.scales.y.ticks.callback = v => (v/1e6).toFixed(1) + 'M';
-    }} else {{
-      ch.data.datasets = [{{
+    } else {
+      ch.data.datasets = [{
         label: 'Avg Duration', data: d.map(x => x.avg_duration),
         backgroundColor: 'rgba(245,158,11,0.7)', borderRadius: 4, borderSkipped: false
-      }}];
+      }];
       ch.options.scales.x.stacked = false;
       ch.options.scales.y.stacked = false;
       ch.options.scales.y.ticks.callback = v => fmtDur(v);
-    }}
+    }
     ch.update();
-  }});
-}});
-}})();
+  });
+});
+})();
+
+// Weekly heatmap (older data files have none)
+(function(){
+const hm = DATA.heatmap;
+if (!hm) { document.getElementById('heatmapCard').style.display = 'none'; return; }
+document.getElementById('heatmapTitle').textContent = `Weekly Pattern (${hm.slot_minutes}-minute slots)`;
+const toggles = document.getElementById('heatmapToggles');
+toggles.innerHTML = HEATMAP_TOGGLES;
+const grids = { departures: hm.departures.flat(), arrivals: hm.arrivals.flat() };
+const draw = bindHeatmap(toggles, document.getElementById('systemHeatmap'), hm.slot_minutes, mode => grids[mode]);
+window.addEventListener('resize', draw);
+})();
+}
+'''
+
+# Content-hashed static files
+out_dir = os.path.dirname(args.output) or '.'
+shard_dir = os.path.join(out_dir, args.shard_dir)
+asset_dir = os.path.join(out_dir, args.asset_dir)
+os.makedirs(shard_dir, exist_ok=True)
+os.makedirs(asset_dir, exist_ok=True)
+shard_files = {name: write_hashed(shard_dir, name, 'json', payload_json[name]) for name in shards if name != 'overview'}
+shard_urls = {name: f'{args.shard_dir}/{fname}' for name, fname in shard_files.items()}
+css_file = write_hashed(asset_dir, 'app', 'css', app_css)
+js_file = write_hashed(asset_dir, 'app', 'js', app_js)
+css_url = f'{args.asset_dir}/{css_file}'
+js_url = f'{args.asset_dir}/{js_file}'
+# Never prune the directory the JSON input or the HTML lives in, whatever it holds
+roots = {os.path.realpath(out_dir), os.path.realpath(os.path.dirname(args.input) or '.')}
+keep = set(shard_files.values()) | {css_file, js_file}  # the two directories may be the same one
+pruned = 0
+for directory in dict.fromkeys(os.path.realpath(d) for d in (shard_dir, asset_dir)):
+    if directory in roots:
+        print(f"Not pruning {directory}: it is also the input or output directory")
+    else:
+        pruned += prune_hashed(directory, keep)
+
+# Output of preprocess.py --sample-rate holds scaled estimates
+sample = data.get('sample')
+sample_note = (f"Approximate preview: estimated from a {sample['rate'] * 100:g}% sample of trips "
+               f"({sample['sampled_trips']:,} rows read), counts scaled up") if sample else ''
+if sample:
+    print(sample_note)
+
+html = f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Bay Wheels Explorer</title>
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
+<script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<link rel="stylesheet" href="{css_url}">
+</head>
+<body>
+<div class="hero">
+<h1><span class="icon">\U0001F6B2</span> Bay Wheels Explorer</h1>
+<p class="sub" id="heroSub"></p>
+<div class="stats-row" id="heroStats"></div>
+</div>
+{f'<div class="sample-banner">{sample_note}</div>' if sample else ''}
+<nav class="tabs" id="tabs">
+<button class="tab active" data-tab="overview">Overview</button>
+<button class="tab" data-tab="map">Station Map</button>
+<button class="tab" data-tab="rankings">Station Rankings</button>
+<button class="tab" data-tab="routes">Top Routes</button>
+<button class="tab" data-tab="time">Time Patterns</button>
+</nav>
+<div class="content">
+
+<!-- OVERVIEW -->
+<div class="panel active" id="panel-overview">
+<div class="grid grid-2" style="margin-bottom:20px">
+<div class="card"><h3>Yearly Growth</h3><div class="chart-container"><canvas id="yearlyChart"></canvas></div></div>
+<div class="card"><h3>Bike Type Breakdown</h3><div class="chart-container"><canvas id="bikeChart"></canvas></div></div>
+</div>
+<div class="card" style="margin-bottom:20px">
+<h3>Monthly Trip Volume</h3>
+<div class="toggle-row" id="monthlyToggles">
+<button class="toggle-btn active" data-mode="total">Total</button>
+<button class="toggle-btn" data-mode="members">Members</button>
+<button class="toggle-btn" data-mode="casual">Casual</button>
+<button class="toggle-btn" data-mode="split">Members vs Casual</button>
+</div>
+<div class="chart-container tall"><canvas id="monthlyChart"></canvas></div>
+</div>
+<div class="grid grid-3" id="insights"></div>
+</div>
+
+<!-- MAP -->
+<div class="panel" id="panel-map">
+<div class="card">
+<h3>Station Network Map</h3>
+<div class="map-controls">
+<input type="text" id="mapSearch" placeholder="Search stations...">
+<select id="mapColor">
+<option value="flow">Color by Net Flow</option>
+<option value="activity">Color by Total Activity</option>
+<option value="member">Color by Member %</option>
+<option value="drain" data-needs="station_pressure">Color by Weekday Drain by 9am</option>
+<option value="fill" data-needs="station_pressure">Color by Weekday Fill by 6pm</option>
+</select>
+</div>
+<div id="map"></div>
+<div class="map-legend" id="mapLegend"></div>
+</div>
+<div class="card" id="pressureCard" style="margin-top:20px">
+<h3>Rebalancing Pressure (average weekday, bikes per day)</h3>
+<div class="od-grid" id="pressureLists"></div>
+</div>
+</div>
+
+<!-- RANKINGS -->
+<div class="panel" id="panel-rankings">
+<div class="card">
+<h3>All Stations \u2014 Performance Rankings</h3>
+<input type="text" class="search-box" id="stationSearch" placeholder="Search stations by name...">
+<div style="overflow-x:auto"><table id="stationTable"><thead><tr>
+<th data-col="rank"># <span class="sort-icon">\u25B2</span></th>
+<th data-col="station_name">Station <span class="sort-icon">\u25B2</span></th>
+<th data-col="total_activity">Activity <span class="sort-icon">\u25B2</span></th>
+<th data-col="total_departures">Depart <span class="sort-icon">\u25B2</span></th>
+<th data-col="total_arrivals">Arrive <span class="sort-icon">\u25B2</span></th>
+<th data-col="net_flow">Net Flow <span class="sort-icon">\u25B2</span></th>
+<th data-col="avg_duration_depart">Avg Duration <span class="sort-icon">\u25B2</span></th>
+<th data-col="subscriber_pct">Member % <span class="sort-icon">\u25B2</span></th>
+</tr></thead><tbody id="stationBody"></tbody></table></div>
+<div class="page-controls" id="stationPages"></div>
+</div>
+<div id="stationDetail"></div>
+</div>
+
+<!-- ROUTES -->
+<div class="panel" id="panel-routes">
+<div class="card">
+<h3>Top 100 Most Popular Routes</h3>
+<input type="text" class="search-box" id="routeSearch" placeholder="Search routes by station name...">
+<div style="overflow-x:auto"><table id="routeTable"><thead><tr>
+<th data-col="rank"># <span class="sort-icon">\u25B2</span></th>
+<th data-col="start">From <span class="sort-icon">\u25B2</span></th>
+<th data-col="end">To <span class="sort-icon">\u25B2</span></th>
+<th data-col="count">Trips <span class="sort-icon">\u25B2</span></th>
+<th data-col="dur">Avg Duration <span class="sort-icon">\u25B2</span></th>
+</tr></thead><tbody id="routeBody"></tbody></table></div>
+</div>
+</div>
+
+<!-- TIME PATTERNS -->
+<div class="panel" id="panel-time">
+<div class="grid grid-2">
+<div class="card">
+<h3>Hourly Distribution</h3>
+<div class="toggle-row" id="hourlyToggles">
+<button class="toggle-btn active" data-mode="count">Trip Count</button>
+<button class="toggle-btn" data-mode="duration">Avg Duration</button>
+</div>
+<div class="chart-container tall"><canvas id="hourlyChart"></canvas></div>
+</div>
+<div class="card">
+<h3>Day of Week</h3>
+<div class="toggle-row" id="dowToggles">
+<button class="toggle-btn active" data-mode="count">Trip Count</button>
+<button class="toggle-btn" data-mode="duration">Avg Duration</button>
+</div>
+<div class="chart-container tall"><canvas id="dowChart"></canvas></div>
+</div>
+</div>
+<div class="card" id="heatmapCard" style="margin-top:20px">
+<h3 id="heatmapTitle">Weekly Pattern</h3>
+<div class="toggle-row" id="heatmapToggles"></div>
+<canvas class="heatmap" id="systemHeatmap" style="height:240px"></canvas>
+</div>
+</div>
+
+</div>
+
+<div style="text-align:center;padding:40px;color:var(--text2);font-size:.75rem;border-top:1px solid var(--border);margin-top:40px">
+Data source: Lyft Bay Wheels open data \u2022 {data['summary']['total_trips']:,} trips {'estimated' if sample else 'analyzed'} \u2022 {data['summary']['date_range_start']} to {data['summary']['date_range_end']}
+</div>
+
+<script>
+const PAYLOAD = {payload_json['overview']};
+const SHARD_URLS = {json.dumps(shard_urls)};
 </script>
+<script src="{js_url}"></script>
 </body>
 </html>'''
 
 with open(args.output, 'w') as f:
     f.write(html)
+write_compressed(args.output, html.encode())
 
 print(f"Dashboard written to: {args.output}")
 print(f"File size: {len(html) / 1024 / 1024:.2f} MB")
+print(f"Static files ({'gzip + brotli' if brotli else 'gzip only, brotli not installed'}; "
+      f"{pruned} stale files removed):")
+for path in [os.path.join(asset_dir, css_file), os.path.join(asset_dir, js_file)] + \
+        [os.path.join(shard_dir, f) for f in shard_files.values()]:
+    sizes = [os.path.getsize(path + ext) for ext in ('', '.gz', '.br') if os.path.exists(path + ext)]
+    print(f"  {os.path.relpath(path, out_dir):<40} " + ' / '.join(f'{n / 1024:.1f} KB' for n in sizes))
+# Like for like: the shipped keys of the input JSON, columnar vs row JSON; the
+# tables built here (clusters, flow, OD, heatmaps, indexes) on their own line
+copied = [{k: v for k, v in part.items() if k in data} for part in shards.values()]
+derived = [{k: v for k, v in part.items() if k not in data} for part in shards.values()]
+encoded_kb, encoded_gz = payload_sizes([json.dumps(encode_payload(p), separators=(',', ':')) for p in copied if p])
+rows_kb, rows_gz = payload_sizes([json.dumps(p, separators=(',', ':')) for p in copied if p])
+derived_kb, derived_gz = payload_sizes([json.dumps(encode_payload(p), separators=(',', ':')) for p in derived if p])
+print(f"Data payload for the keys of {os.path.basename(args.input)}: {encoded_kb:.1f} KB ({encoded_gz:.1f} KB gzip), "
+      f"as row JSON {rows_kb:.1f} KB ({rows_gz:.1f} KB gzip); encoded in {encode_ms:.0f} ms")
+print(f"Derived tables (map clusters, station flow, station x month, OD, heatmaps, search and route indexes): "
+      f"{derived_kb:.1f} KB ({derived_gz:.1f} KB gzip) more")
+have_node = shutil.which('node') is not None
+print(f"{'shard':<16} {'KB':>8} {'gzip KB':>8} {'decode ms':>10}")
+for name, p in payload_json.items():
+    decode_ms = time_decoder(p) if have_node else None
+    where = 'inline' if name == 'overview' else shard_urls[name]
+    print(f"{name:<16} {len(p) / 1024:>8.1f} {len(gzip.compress(p.encode())) / 1024:>8.1f} "
+          f"{'-' if decode_ms is None else f'{decode_ms:.1f}':>10}  {where}")
+if not have_node:
+    print("Decode times skipped (node not found)")
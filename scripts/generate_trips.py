@@ -0,0 +1,192 @@
+"""
+Write synthetic Bay Wheels trip ZIPs for testing and benchmarking preprocess.py.
+
+Each month is one ``YYYYMM-<system>-tripdata.csv.zip`` in the schema the
+real data used at the time: the legacy Ford GoBike layout (start_time /
+duration_sec / user_type) before April 2020 and the Bay Wheels layout
+(started_at / member_casual / rideable_type) from then on, or either one
+throughout with --schema. Stations are scattered around the three service
+areas with skewed popularity, most trips end near where they started,
+departures follow weekday commute peaks, durations are log-normal, and a
+small share of trips has no station (dockless e-bikes), a multi-day or a
+negative duration, as in the real files. Output is deterministic for a
+given --seed.
+
+Usage:
+    python scripts/generate_trips.py ./synthetic_data
+    python scripts/generate_trips.py ./synthetic_data --stations 1000 --months 36 --rows 500000
+    python scripts/generate_trips.py ./synthetic_data --start-month 2020-01 --schema new
+"""
+import argparse
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+NEW_SCHEMA_FROM = '2020-04'
+SERVICE_AREAS = (  # centre lat, lng, spread (degrees), share of stations
+    (37.775, -122.418, 0.025, 0.55),   # San Francisco
+    (37.815, -122.270, 0.030, 0.30),   # East Bay
+    (37.335, -121.890, 0.020, 0.15),   # San Jose
+)
+STREETS = ('Market', 'Mission', 'Howard', 'Folsom', 'Townsend', 'Valencia', 'Broadway', 'Telegraph',
+           'Shattuck', 'San Pablo', 'Grand', 'Santa Clara', 'Embarcadero', 'Polk', 'Divisadero', 'Fell')
+CROSS = ('1st', '2nd', '3rd', '4th', '5th', '8th', '10th', '16th', '24th', 'Main', 'Beale', 'Fremont',
+         'Spear', 'Oak', 'Pine', 'Bush', 'Post', 'Geary')
+NEAR_SHARE = 0.7    # trips ending at one of the start's NEAR_STATIONS nearest stations
+NEAR_STATIONS = 20
+CHUNK_ROWS = 250_000
+LEGACY_COLUMNS = ('duration_sec', 'start_time', 'end_time', 'start_station_id', 'start_station_name',
+                  'start_station_latitude', 'start_station_longitude', 'end_station_id', 'end_station_name',
+                  'end_station_latitude', 'end_station_longitude', 'bike_id', 'user_type',
+                  'bike_share_for_all_trip')
+NEW_COLUMNS = ('ride_id', 'rideable_type', 'started_at', 'ended_at', 'start_station_name', 'start_station_id',
+               'end_station_name', 'end_station_id', 'start_lat', 'start_lng', 'end_lat', 'end_lng',
+               'member_casual')
+
+
+def make_stations(n, rng):
+    """Station names, ids and coordinates, plus each one's popularity and nearest neighbours."""
+    area = rng.choice(len(SERVICE_AREAS), n, p=[a[3] for a in SERVICE_AREAS])
+    centre = np.array([a[:3] for a in SERVICE_AREAS])[area]
+    lat = (centre[:, 0] + rng.normal(0, 1, n) * centre[:, 2]).round(6)
+    lng = (centre[:, 1] + rng.normal(0, 1, n) * centre[:, 2]).round(6)
+    names = []
+    for i in range(n):
+        name = f'{STREETS[i % len(STREETS)]} St at {CROSS[(i // len(STREETS)) % len(CROSS)]} St'
+        names.append(name if i < len(STREETS) * len(CROSS) else f'{name} ({i // (len(STREETS) * len(CROSS))})')
+    popularity = rng.zipf(1.6, n).astype(np.float64).clip(max=200)
+    popularity /= popularity.sum()
+    k = min(NEAR_STATIONS, n)
+    near = np.empty((n, k), dtype=np.int64)
+    for i in range(n):  # one row of distances at a time keeps this O(n) in memory
+        d = (lat - lat[i]) ** 2 + ((lng - lng[i]) * 0.79) ** 2
+        near[i] = np.argpartition(d, k - 1)[:k]
+    return {'name': np.array(names, dtype=object), 'id': np.arange(n) + 3, 'lat': lat, 'lng': lng,
+            'popularity': popularity, 'near': near}
+
+
+def trip_times(month, n, rng):
+    """Start times (datetime64[ms]) and durations (seconds) for ``n`` trips in ``month``."""
+    first = np.datetime64(month, 'D')
+    days = int((np.datetime64(np.datetime64(month, 'M') + 1, 'D') - first).astype(int))
+    day = rng.integers(0, days, n)
+    weekend = ((first + day).astype(np.int64) + 3) % 7 >= 5   # 1970-01-01 was a Thursday
+    commute = np.where(rng.random(n) < 0.5, rng.normal(8.3, 1.1, n), rng.normal(17.4, 1.4, n))
+    leisure = rng.normal(14.0, 3.5, n)
+    hour = np.where(weekend | (rng.random(n) < 0.35), leisure, commute) % 24
+    start = (first + day).astype('datetime64[ms]') + (hour * 3_600_000).astype('timedelta64[ms]')
+    duration = np.exp(rng.normal(np.log(660), 0.65, n))
+    duration[weekend] *= 1.4
+    odd = rng.random(n)
+    stuck, negative = odd < 0.001, (odd >= 0.001) & (odd < 0.0015)
+    duration[stuck] = rng.uniform(86_400, 3 * 86_400, stuck.sum())   # not docked properly
+    duration[negative] = -rng.uniform(1, 600, negative.sum())        # clock errors
+    return start, duration
+
+
+def _stamps(t, fractional):
+    s = np.char.replace(np.datetime_as_string(t, unit='ms' if fractional else 's'), 'T', ' ')
+    return np.char.add(s, '0') if fractional else s   # legacy files carry 4 fractional digits
+
+
+def month_frame(month, n, stations, legacy, rng):
+    """One chunk of trips for ``month`` as the DataFrame of the monthly CSV."""
+    start_time, duration = trip_times(month, n, rng)
+    end_time = start_time + (np.abs(duration) * 1000).astype('timedelta64[ms]')
+    s = rng.choice(len(stations['name']), n, p=stations['popularity'])
+    e = np.where(rng.random(n) < NEAR_SHARE,
+                 stations['near'][s, rng.integers(0, stations['near'].shape[1], n)],
+                 rng.choice(len(stations['name']), n, p=stations['popularity']))
+    member = rng.random(n) < (0.8 if legacy else 0.6)
+    jitter = rng.normal(0, 0.0004, (4, n))
+    slat, slng = stations['lat'][s], stations['lng'][s]
+    elat, elng = stations['lat'][e], stations['lng'][e]
+    if legacy:
+        df = pd.DataFrame({
+            'duration_sec': duration.astype(np.int64),
+            'start_time': _stamps(start_time, True), 'end_time': _stamps(end_time, True),
+            'start_station_id': stations['id'][s], 'start_station_name': stations['name'][s],
+            'start_station_latitude': slat, 'start_station_longitude': slng,
+            'end_station_id': stations['id'][e], 'end_station_name': stations['name'][e],
+            'end_station_latitude': elat, 'end_station_longitude': elng,
+            'bike_id': rng.integers(1, 10_000, n),
+            'user_type': np.where(member, 'Subscriber', 'Customer'),
+            'bike_share_for_all_trip': np.where(rng.random(n) < 0.05, 'Yes', 'No'),
+        }, columns=LEGACY_COLUMNS)
+        return df
+    electric = rng.random(n) < 0.55
+    dockless = electric & (rng.random(n) < 0.3)  # parked away from a dock: no station, rough coordinates
+    no_start = dockless & (rng.random(n) < 0.5)
+    no_end = dockless & ~no_start
+    start_name = np.where(no_start, None, stations['name'][s])
+    end_name = np.where(no_end, None, stations['name'][e])
+    df = pd.DataFrame({
+        'ride_id': [f'{x:016X}' for x in rng.integers(0, 2 ** 63, n, dtype=np.int64).tolist()],
+        'rideable_type': np.where(electric, 'electric_bike', 'classic_bike'),
+        'started_at': _stamps(start_time, False), 'ended_at': _stamps(end_time, False),
+        'start_station_name': start_name,
+        'start_station_id': np.where(no_start, None, stations['id'][s].astype(str)),
+        'end_station_name': end_name,
+        'end_station_id': np.where(no_end, None, stations['id'][e].astype(str)),
+        'start_lat': np.where(no_start, (slat + jitter[0]).round(2), slat),
+        'start_lng': np.where(no_start, (slng + jitter[1]).round(2), slng),
+        'end_lat': np.where(no_end, (elat + jitter[2]).round(2), elat),
+        'end_lng': np.where(no_end, (elng + jitter[3]).round(2), elng),
+        'member_casual': np.where(member, 'member', 'casual'),
+    }, columns=NEW_COLUMNS)
+    return df
+
+
+def write_month(out_dir, month, rows, stations, legacy, rng):
+    """Write one month's ZIP in CHUNK_ROWS pieces; returns its path."""
+    stem = f"{month.replace('-', '')}-{'fordgobike' if legacy else 'baywheels'}-tripdata"
+    path = os.path.join(out_dir, f'{stem}.csv.zip')
+    with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as z:
+        with z.open(f'{stem}.csv', 'w', force_zip64=True) as raw, \
+                io.TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+            for done in range(0, rows, CHUNK_ROWS):
+                n = min(CHUNK_ROWS, rows - done)
+                month_frame(month, n, stations, legacy, rng).to_csv(f, index=False, header=done == 0)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def generate(out_dir, stations=500, months=12, rows=100_000, start_month='2019-10', schema='auto', seed=0):
+    """Write ``months`` monthly ZIPs of ``rows`` trips each to ``out_dir``; returns their paths."""
+    if schema not in ('auto', 'legacy', 'new'):
+        raise ValueError(f'Unknown schema {schema!r}')
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    station_table = make_stations(stations, rng)
+    first = np.datetime64(start_month, 'M')
+    paths = []
+    for i in range(months):
+        month = str(first + i)
+        legacy = schema == 'legacy' or (schema == 'auto' and month < NEW_SCHEMA_FROM)
+        paths.append(write_month(out_dir, month, rows, station_table, legacy, rng))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Bay Wheels trip ZIPs')
+    parser.add_argument('out_dir', help='Directory for the monthly ZIPs')
+    parser.add_argument('--stations', type=int, default=500, help='Number of stations')
+    parser.add_argument('--months', type=int, default=12, help='Number of consecutive months')
+    parser.add_argument('--rows', type=int, default=100_000, help='Trips per month')
+    parser.add_argument('--start-month', default='2019-10', help='First month, YYYY-MM')
+    parser.add_argument('--schema', choices=('auto', 'legacy', 'new'), default='auto',
+                        help=f'CSV layout; auto switches from legacy to new at {NEW_SCHEMA_FROM} like the real data')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    paths = generate(args.out_dir, stations=args.stations, months=args.months, rows=args.rows,
+                     start_month=args.start_month, schema=args.schema, seed=args.seed)
+    size = sum(os.path.getsize(p) for p in paths)
+    print(f'Wrote {len(paths)} ZIPs, {len(paths) * args.rows:,} trips, {size / 1024 / 1024:.1f} MB to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
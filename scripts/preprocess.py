@@ -1,293 +1,2685 @@
 """
 Memory-efficient preprocessing: process each ZIP file individually,
-aggregate incrementally, and write compact JSON.
+aggregate incrementally, and write compact JSON plus the full
+origin-destination matrix (od_matrix.npz, see "Origin-destination matrix")
+and per-station weekly heatmaps (station_heatmaps.npz, see "Station heatmaps").
+
+Each ZIP's partial aggregates are cached under --cache-dir, keyed by the
+SHA-256 of the file contents, so a rebuild only parses ZIPs that are new or
+changed and merges the rest from cache. Entries for ZIPs that are no longer
+in --data-dir are pruned at the end of the run.
+
+CSVs are streamed in --chunk-rows chunks with only the needed columns parsed
+(compact dtypes), so peak memory does not grow with the size of a month.
+Uncached CSVs can be parsed on a process pool with --workers; partials are
+always merged back in file order, so the output matches a serial run.
+
+With --store DIR the ZIPs are instead normalized once into a columnar trip
+store (one partition of typed .npy columns per month, see "Columnar trip
+store" below) and every run aggregates the memory-mapped partitions, so
+re-aggregating the full history never touches a CSV again.
+
+Each JSON key comes from an aggregator plugin (see "Aggregators"); --only
+runs a subset and updates just their keys in an existing output, and
+--sample-rate reads a fixed hash-picked share of the rows and scales the
+counts up, for a quick approximate preview (see "Row sampling"). Trips seen
+in an earlier file (a republished or overlapping month) are matched by a
+64-bit key and dropped, or only counted with --dedupe report (see "Trip
+keys"). Dockless e-bike trips without a station name are attributed to the
+nearest station within SNAP_RADIUS_M (see "Station snapping"). The module
+also works as a library:
+
+    import preprocess
+    agg = preprocess.ingest(zip_files, aggregators=['monthly', 'hourly'])
+    output = preprocess.build_output(agg)
 
 Usage:
     python scripts/preprocess.py --data-dir ./data/
+    python scripts/preprocess.py --data-dir ./data/ --workers 0
+    python scripts/preprocess.py --data-dir ./data/ --no-cache
+    python scripts/preprocess.py --data-dir ./data/ --route-counters 20000 --validate-routes
+    python scripts/preprocess.py --data-dir ./data/ --store ./trip_store
+    python scripts/preprocess.py --data-dir ./data/ --store ./trip_store --cube ./activity_cube
+    python scripts/preprocess.py --data-dir ./data/ --profile
+    python scripts/preprocess.py --data-dir ./data/ --only monthly,hourly
+    python scripts/preprocess.py --data-dir ./data/ --sample-rate 0.02 --output ./preview/dashboard_data.json
+    python scripts/preprocess.py --data-dir ./data/ --dedupe report
 """
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import zipfile
 import os
 import json
 import glob
 import argparse
-from collections import defaultdict
+import sys
+import functools
+import hashlib
+import pickle
 import traceback
-import gc
-
-parser = argparse.ArgumentParser(description='Preprocess Bay Wheels trip data')
-parser.add_argument('--data-dir', default='./data/', help='Directory containing ZIP/CSV files')
-parser.add_argument('--output', default='./dashboard_data.json', help='Output JSON path')
-args = parser.parse_args()
-
-DATA_DIR = args.data_dir
-WORK_DIR = os.path.dirname(args.output) or '.'
-
-zip_files = sorted(glob.glob(os.path.join(DATA_DIR, "*.zip")))
-print(f"Found {len(zip_files)} zip files")
-
-# Incremental aggregators
-monthly_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0,
-                                    'classic': 0, 'electric': 0, 'docked': 0, 'other': 0})
-hourly_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0})
-dow_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0})
-station_depart = defaultdict(lambda: {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0,
-                                        'lat_sum': 0, 'lng_sum': 0, 'coord_count': 0})
-station_arrive = defaultdict(int)
-route_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0})
-station_monthly_agg = defaultdict(int)
-yearly_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0, 'start_stations': set(), 'end_stations': set()})
-bike_type_agg = defaultdict(lambda: {'trips': 0, 'dur_sum': 0})
-total_trips = 0
-min_date = None
-max_date = None
-
-for idx, zf_path in enumerate(zip_files):
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump whenever the partial layout or the aggregation rules change so that
+# stale entries are recomputed instead of merged.
+CACHE_VERSION = 10
+
+
+# ============================================================
+# Profiling
+# ============================================================
+# With --profile, every ``stage(...)`` block below adds its wall time, rows
+# and change in resident memory to PROFILE under the file being processed.
+# Without it ``stage`` returns a shared no-op, so the hooks cost nothing.
+PROFILE = None
+
+
+def _rss_bytes():
+    """Current resident set size (falls back to the peak where /proc is missing)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageProfile:
+    """Per (source file, stage) totals: [seconds, rows, rss delta bytes, calls]."""
+
+    def __init__(self):
+        self.source = '(setup)'
+        self.schemas = {}   # source -> 'legacy' / 'new' CSV layout; 'other' when not a CSV
+        self.records = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds, rows=0, rss_delta=0):
+        r = self.records.setdefault((self.source, name), [0.0, 0, 0, 0])
+        r[0] += seconds
+        r[1] += rows
+        r[2] += rss_delta
+        r[3] += 1
+
+    def report(self):
+        """Machine-readable form: one entry per (source, stage) plus per-stage totals by schema."""
+        def entry(seconds, rows, rss, calls):
+            return {'seconds': round(seconds, 4), 'rows': rows,
+                    'rows_per_sec': round(rows / seconds) if rows and seconds > 0 else None,
+                    'rss_delta_mb': round(rss / 2 ** 20, 1), 'calls': calls}
+
+        totals = {}
+        for (source, name), r in self.records.items():
+            t = totals.setdefault(name, {}).setdefault(self.schemas.get(source, 'other'), [0.0, 0, 0, 0])
+            for i, v in enumerate(r):
+                t[i] += v
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 3),
+            'peak_rss_mb': round(_peak_rss_bytes() / 2 ** 20, 1),
+            'stages': [{'source': source, 'schema': self.schemas.get(source), 'stage': name, **entry(*r)}
+                       for (source, name), r in self.records.items()],
+            'totals': {name: {schema: entry(*t) for schema, t in by_schema.items()}
+                       for name, by_schema in totals.items()},
+        }
+
+
+def _peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _Stage:
+    __slots__ = ('name', 'rows', 'start', 'rss')
+
+    def __init__(self, name, rows):
+        self.name, self.rows = name, rows
+
+    def __enter__(self):
+        self.rss = _rss_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        PROFILE.add(self.name, time.perf_counter() - self.start, self.rows, _rss_bytes() - self.rss)
+
+
+class _NoStage:
+    rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name, rows=0):
+    """Context manager timing one block into PROFILE; set ``.rows`` on it if only known at the end."""
+    return _NO_STAGE if PROFILE is None else _Stage(name, rows)
+
+
+def profile_source(name, schema=None):
+    """Attribute the following stages to ``name`` (a CSV member, partition or output step)."""
+    if PROFILE is not None:
+        PROFILE.source = name
+        if schema is not None:
+            PROFILE.schemas[name] = schema
+
+
+class _TimedReader:
+    """File wrapper charging the time spent in ``read`` (ZIP inflate + disk) to 'decompress'."""
+
+    def __init__(self, f):
+        self._f = f
+        self.seconds = 0.0
+
+    def read(self, n=-1):
+        t = time.perf_counter()
+        data = self._f.read(n)
+        self.seconds += time.perf_counter() - t
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def print_profile(report):
+    """Summary table of ``StageProfile.report()``: stages by total time, split by CSV schema."""
+    schemas = sorted({s for by_schema in report['totals'].values() for s in by_schema})
+    rows = []
+    for name, by_schema in report['totals'].items():
+        seconds = sum(t['seconds'] for t in by_schema.values())
+        n = sum(t['rows'] for t in by_schema.values())
+        rss = sum(t['rss_delta_mb'] for t in by_schema.values())
+        rows.append((seconds, name, n, rss, by_schema))
+    rows.sort(reverse=True)
+    wall = report['wall_seconds']
+    print(f"\nProfile ({wall:.2f}s wall, peak RSS {report['peak_rss_mb']:.0f} MB):")
+    print(f"{'stage':<22}" + ''.join(f"{s + ' s':>11}" for s in schemas)
+          + f"{'total s':>10}{'% wall':>8}{'rows/s':>13}{'RSS +MB':>9}")
+    for seconds, name, n, rss, by_schema in rows:
+        cols = ''.join(f"{by_schema[s]['seconds']:>11.3f}" if s in by_schema else f"{'-':>11}" for s in schemas)
+        rate = f'{n / seconds:,.0f}' if n and seconds > 0 else '-'
+        print(f"{name:<22}{cols}{seconds:>10.3f}{seconds / wall * 100 if wall else 0:>7.1f}%{rate:>13}{rss:>9.1f}")
+
+
+# ============================================================
+# Partial aggregates
+# ============================================================
+TRIP_FIELDS = ('trips', 'dur_sum', 'sub', 'cust')
+MONTHLY_FIELDS = TRIP_FIELDS + ('classic', 'electric', 'docked')
+STATION_FIELDS = TRIP_FIELDS + ('lat_sum', 'lng_sum')
+ROUTE_FIELDS = ('trips', 'dur_sum')
+COUNT_FIELDS = ('trips',)
+BIKE_TYPES = ('classic_bike', 'electric_bike', 'docked_bike')
+TOP_ROUTES = 100
+DOW_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# Heatmaps count departures / arrivals per SLOT_MINUTES slot of the week
+SLOT_MINUTES = 15
+DAY_SLOTS = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = 7 * DAY_SLOTS
+# Rebalancing pressure: a station's average weekday net flow (arrivals -
+# departures) from FLOW_DAY_START to 9am and to 6pm
+FLOW_DAY_START = 5
+# Duration histograms: fixed log2 bins, HIST_BINS_PER_OCTAVE per doubling of
+# seconds, up to the 24h cut-off. Fixed bins merge by adding counts, and a
+# quantile interpolated inside its bin is off by less than one bin (~4%).
+HIST_BINS_PER_OCTAVE = 16
+HIST_BINS = int(np.ceil(np.log2(86400) * HIST_BINS_PER_OCTAVE)) + 1
+DURATION_QUANTILES = (0.5, 0.9)
+
+
+class KeyedTable:
+    """Rows of float64 metrics addressed by hashable keys.
+
+    Keys are interned to dense row ids in first-seen order and the metrics
+    live in one 2-D array (row id x field) that grows geometrically, so
+    adding a file's worth of groups is a single fancy-indexed ``+=``.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.keys = []
+        self.ids = {}
+        self.values = np.zeros((0, len(fields)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, keys):
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, k in enumerate(keys):
+            j = self.ids.get(k)
+            if j is None:
+                j = self.ids[k] = len(self.keys)
+                self.keys.append(k)
+            ids[i] = j
+        if len(self.keys) > len(self.values):
+            grown = np.zeros((max(len(self.keys), 2 * len(self.values)), len(self.fields)))
+            grown[:len(self.values)] = self.values
+            self.values = grown
+        return ids
+
+    def add(self, keys, values):
+        """Add one row of ``values`` per key; ``keys`` must be unique."""
+        ids = self.intern(keys)
+        self.values[ids] += values
+
+    def merge(self, other):
+        self.add(other.keys, other.values[:len(other)])
+
+    def column(self, field):
+        return self.values[:len(self.keys), self.fields.index(field)]
+
+    def rows(self):
+        """(key, {field: value}) in first-seen key order.
+
+        Values stay NumPy scalars so ``round`` keeps NumPy's semantics, as the
+        output has always been rounded from NumPy sums.
+        """
+        for k, v in zip(self.keys, self.values[:len(self.keys)]):
+            yield k, dict(zip(self.fields, v))
+
+    def __getstate__(self):
+        return {'fields': self.fields, 'keys': self.keys, 'values': self.values[:len(self.keys)]}
+
+    def __setstate__(self, state):
+        self.fields = state['fields']
+        self.keys = state['keys']
+        self.values = state['values']
+        self.ids = {k: i for i, k in enumerate(self.keys)}
+
+
+class NameIndex:
+    """Grow-only dictionary of names -> dense int ids."""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, names):
+        ids = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            j = self.ids.get(name)
+            if j is None:
+                j = self.ids[name] = len(self.names)
+                self.names.append(name)
+            ids[i] = j
+        return ids
+
+    def __getstate__(self):
+        return {'names': self.names}
+
+    def __setstate__(self, state):
+        self.names = state['names']
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+
+class StationIndex(NameIndex):
+    """Grow-only dictionary of station names -> dense int ids.
+
+    Raw ``start_station_id`` / ``end_station_id`` values seen next to a name
+    are kept as aliases of its id (the most recent file wins when an id is
+    reused). Aggregates only ever hold the ints; names are looked up again
+    when the output is written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.aliases = {}
+
+    def alias(self, raw_ids, ids):
+        self.aliases.update(zip(raw_ids, ids))
+
+    def lookup(self, key):
+        """Dense id for a station name or raw station id, or None."""
+        j = self.ids.get(key)
+        return self.aliases.get(key) if j is None else j
+
+    def __getstate__(self):
+        return {'names': self.names, 'aliases': self.aliases}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.aliases = state['aliases']
+
+
+def pack_pair(a, b):
+    """Pack two int32 id arrays into sortable int64 keys."""
+    return (a.astype(np.int64) << 32) | (b.astype(np.int64) & 0xFFFFFFFF)
+
+
+def unpack_pair(keys):
+    return keys >> 32, ((keys & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+
+
+class PackedTable:
+    """Metrics for pairs of ids (see ``pack_pair``), kept sorted by packed key.
+
+    Batches are merged with ``searchsorted`` + ``np.insert``, so there is no
+    per-key Python work however many origin-destination pairs a file has.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0, len(fields)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, keys, values):
+        """Add one row of ``values`` per key; ``keys`` must be unique."""
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        self.values[pos[found]] += values[found]
+        new = ~found
+        if new.any():
+            self.keys = np.insert(self.keys, pos[new], keys[new])
+            self.values = np.insert(self.values, pos[new], values[new], axis=0)
+
+    def merge(self, other, keys=None):
+        """Fold in another table, optionally under re-keyed ``keys``."""
+        self.add(other.keys if keys is None else keys, other.values)
+
+    def column(self, field):
+        return self.values[:, self.fields.index(field)]
+
+    def keep(self, mask):
+        self.keys, self.values = self.keys[mask], self.values[mask]
+
+
+class SpaceSaving:
+    """Heavy-hitter summary over packed keys in a fixed number of counters.
+
+    Mergeable Space-Saving: every tracked key keeps an upper bound on its
+    count (``trips``) and the exact number of trips seen while it was
+    tracked (``observed``, a lower bound, with ``dur_sum`` over those
+    trips). A key that is not tracked occurred at most ``floor`` times.
+    Merging adds counts over the union of keys, charging each side's floor
+    to keys it didn't track, then keeps the ``capacity`` largest.
+    """
+
+    fields = ('trips', 'observed', 'dur_sum')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.floor = 0.0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0, len(self.fields)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, field):
+        return self.values[:, self.fields.index(field)]
+
+    def merge(self, other, keys=None):
+        """Fold in another summary or an exact ``PackedTable`` (optionally re-keyed)."""
+        keys = other.keys if keys is None else keys
+        if isinstance(other, SpaceSaving):
+            other_values, other_floor = other.values, other.floor
+        else:
+            trips = other.column('trips')
+            other_values, other_floor = np.column_stack([trips, trips, other.column('dur_sum')]), 0.0
+
+        n_self = len(self.keys)
+        union, inv = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        merged = np.zeros((len(union), len(self.fields)))
+        merged[inv[:n_self]] += self.values
+        merged[inv[n_self:]] += other_values
+        in_self = np.zeros(len(union), dtype=bool)
+        in_self[inv[:n_self]] = True
+        in_other = np.zeros(len(union), dtype=bool)
+        in_other[inv[n_self:]] = True
+        merged[~in_self, 0] += self.floor
+        merged[~in_other, 0] += other_floor
+        floor = self.floor + other_floor
+
+        if len(union) > self.capacity:
+            order = np.argpartition(-merged[:, 0], self.capacity - 1)
+            floor = max(floor, merged[order[self.capacity:], 0].max())
+            keep = np.sort(order[:self.capacity])
+            union, merged = union[keep], merged[keep]
+        self.keys, self.values, self.floor = union, merged, floor
+
+
+class TripKeySet:
+    """Set of trip keys (see ``trip_keys``) as sorted uint64 runs, 8 bytes per key.
+
+    Each added batch becomes a run, merged into the one before it while that
+    is at most twice its size, so there are O(log n) runs to search and no
+    Python object per key: the whole history (21M trips) takes ~170 MB.
+    ``parent`` (the keys of earlier sources) is searched as well but never
+    merged into this set or pickled with it.
+    """
+
+    def __init__(self, parent=None):
+        self.runs = []
+        self.parent = parent
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def keys(self):
+        """All keys, sorted."""
+        if len(self.runs) == 1:
+            return self.runs[0]
+        return np.sort(np.concatenate(self.runs)) if self.runs else np.zeros(0, dtype=np.uint64)
+
+    def contains(self, keys):
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            found |= run[np.minimum(np.searchsorted(run, keys), len(run) - 1)] == keys
+        if self.parent is not None:
+            found |= self.parent.contains(keys)
+        return found
+
+    def add_new(self, keys):
+        """Add a batch of keys; True for rows whose key was not seen before (0 always is)."""
+        uniq, first = np.unique(keys, return_index=True)
+        fresh = (uniq != 0) & ~self.contains(uniq)
+        new = keys == 0
+        new[first[fresh]] = True
+        self._add(uniq[fresh])
+        return new
+
+    def update(self, other):
+        """Add every key of another set."""
+        keys = other.keys()
+        self._add(keys[~self.contains(keys)])
+
+    def _add(self, run):
+        """Add sorted keys that are not in the set yet."""
+        if not len(run):
+            return
+        self.runs.append(run)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            b, a = self.runs.pop(), self.runs.pop()
+            merged = np.empty(len(a) + len(b), dtype=np.uint64)
+            pos = np.searchsorted(a, b) + np.arange(len(b))
+            rest = np.ones(len(merged), dtype=bool)
+            rest[pos] = False
+            merged[pos] = b
+            merged[rest] = a
+            self.runs.append(merged)
+
+    def __getstate__(self):
+        return {'runs': [self.keys()] if self.runs else []}
+
+    def __setstate__(self, state):
+        self.runs = state['runs']
+        self.parent = None
+
+
+def _fit(a, n):
+    """``a`` zero-padded along axis 0 to at least ``n`` rows."""
+    if len(a) >= n:
+        return a
+    grown = np.zeros((max(n, 2 * len(a)),) + a.shape[1:], dtype=a.dtype)
+    grown[:len(a)] = a
+    return grown
+
+
+def bitset_add(bits, ids):
+    """Set ``ids`` in a uint8 bitset, growing it as needed."""
+    if len(ids):
+        bits = _fit(bits, int(ids.max()) // 8 + 1)
+        np.bitwise_or.at(bits, ids // 8, (1 << (ids % 8)).astype(np.uint8))
+    return bits
+
+
+def bitset_ids(bits):
+    return np.flatnonzero(np.unpackbits(bits, bitorder='little'))
+
+
+def duration_bins(dur):
+    """Histogram bin of each duration in seconds (see ``HIST_BINS``)."""
+    bins = np.log2(np.maximum(dur, 1.0)) * HIST_BINS_PER_OCTAVE
+    return np.minimum(bins.astype(np.int64), HIST_BINS - 1)
+
+
+def duration_quantiles(entity, bins, counts, qs=DURATION_QUANTILES):
+    """Per-entity duration quantiles from sparse histogram counts.
+
+    ``entity`` / ``bins`` / ``counts`` describe the non-empty bins, sorted by
+    (entity, bin). Returns (entities, array of entity x quantile seconds),
+    interpolating log-linearly inside the bin that holds each quantile.
+    """
+    entities, first = np.unique(entity, return_index=True)
+    if not len(entities):
+        return entities, np.zeros((0, len(qs)))
+    cum = np.cumsum(counts)
+    before = cum[first] - counts[first]
+    totals = np.add.reduceat(counts, first)
+    out = np.empty((len(entities), len(qs)))
+    for j, q in enumerate(qs):
+        target = before + q * totals
+        i = np.searchsorted(cum, target)
+        frac = (target - (cum[i] - counts[i])) / counts[i]
+        out[:, j] = 2.0 ** ((bins[i] + frac) / HIST_BINS_PER_OCTAVE)
+    return entities, out
+
+
+def _dense_bins(hist):
+    """(entity, bin, count) arrays for the non-empty cells of an entity x bin array."""
+    nz = np.flatnonzero(hist)
+    return nz // HIST_BINS, nz % HIST_BINS, hist.ravel()[nz]
+
+
+def new_aggregates(aggregators=None, dedupe=None):
+    """Empty partial for ``aggregators`` (names, default all; see AGGREGATORS).
+
+    One per CSV member, plus the running total. Besides each aggregator's
+    own entries it always carries the station / bike type dictionaries, the
+    row count, date range and member list. With ``dedupe`` ('drop' or
+    'report') it also collects the keys of its trips to find duplicates.
+    """
+    names = resolve_aggregators(aggregators)
+    agg = {
+        'aggregators': names,
+        'stations': StationIndex(),
+        'bike_types': NameIndex(),                      # rideable_type -> code in encoded trips
+        'total_trips': 0,
+        'min_date': None,
+        'max_date': None,
+        # (csv_name, rows) for every CSV member, in processing order
+        'members': [],
+        # {'rate', 'sampled_trips'} once the totals of a sampled run are scaled up
+        'sample': None,
+        # Duplicate trips: 'drop' / 'report' / None, keys seen so far, and how
+        # many rows repeated one (dropped with 'drop', only counted with 'report')
+        'dedupe': dedupe,
+        'trip_keys': TripKeySet() if dedupe else None,
+        'duplicates': 0,
+        # Dockless trips attributed to the nearest station: [starts, ends]
+        'snapped': np.zeros(2, dtype=np.int64),
+    }
+    for name in names:
+        agg.update(AGGREGATORS[name].new())
+    return agg
+
+
+def _count_pairs(table, a, b):
+    """Add one count per (a, b) row to a ``PackedTable`` keyed by ``pack_pair(a, b)``."""
+    keys, codes = np.unique(pack_pair(a, b), return_inverse=True)
+    table.add(keys, np.bincount(codes)[:, None].astype(np.float64))
+
+
+def _count_bins(table, entity, bins, n, offset=0):
+    """Like ``_count_pairs`` for (entity, duration bin) with entities in [0, n)."""
+    counts = np.bincount(entity.astype(np.int64) * HIST_BINS + bins, minlength=n * HIST_BINS)
+    e, b, c = _dense_bins(counts)
+    table.add(pack_pair(e + offset, b), c[:, None].astype(np.float64))
+
+
+def _sums(codes, n, weights):
+    """Per-code totals of each weight column (``None`` counts rows), via ``np.bincount``."""
+    out = np.empty((n, len(weights)))
+    for j, w in enumerate(weights):
+        out[:, j] = np.bincount(codes, weights=w, minlength=n)
+    return out
+
+
+def _scale_rows(values, fields, factor, basis='trips'):
+    """Scale a row x field array of sample totals up by ``factor``, in place.
+
+    Counts are scaled and rounded. ``*_sum`` fields follow the rounded
+    ``basis`` count of their row, so every average over it is unchanged.
+    """
+    base = values[:, fields.index(basis)].copy()
+    scaled = np.rint(base * factor)
+    ratio = np.divide(scaled, base, out=np.zeros_like(base), where=base > 0)
+    for j, field in enumerate(fields):
+        values[:, j] = values[:, j] * ratio if field.endswith('_sum') else np.rint(values[:, j] * factor)
+
+
+def _scale_counts(a, factor):
+    """Count array ``a`` scaled up by ``factor`` and rounded, keeping its dtype."""
+    return np.rint(a * factor).astype(a.dtype)
+
+
+# Columns the aggregators and trip keys read, with compact dtypes. Everything
+# else in the monthly CSVs (end coordinates, demographics, ...) is never parsed.
+TRIP_DTYPES = {
+    # legacy schema: start_time / duration_sec / user_type
+    'duration_sec': 'float64',
+    'start_station_latitude': 'float32',
+    'start_station_longitude': 'float32',
+    'end_station_latitude': 'float32',   # end coordinates only snap dockless ends (see StationLocator)
+    'end_station_longitude': 'float32',
+    'user_type': 'category',
+    # new schema: started_at / member_casual / rideable_type
+    'start_lat': 'float32',
+    'start_lng': 'float32',
+    'end_lat': 'float32',
+    'end_lng': 'float32',
+    'member_casual': 'category',
+    'rideable_type': 'category',
+    'bike_id': 'float64',  # legacy trip keys only (see trip_keys)
+    # both
+    'start_station_name': 'category',
+    'end_station_name': 'category',
+    'start_station_id': 'category',
+    'end_station_id': 'category',
+}
+TRIP_COLUMNS = frozenset(TRIP_DTYPES) | {'start_time', 'started_at', 'ended_at', 'ride_id'}
+CHUNK_ROWS = 500_000
+
+# Encoded trips (``encode_trips``), one array per column. This is also the
+# on-disk layout of a trip store partition.
+TRIP_STORE_DTYPES = {
+    'start': np.int64,          # epoch seconds
+    'duration': np.float32,     # seconds
+    'start_station': np.int32,  # StationIndex id, -1 = none
+    'end_station': np.int32,
+    'lat': np.float32,          # start coordinates
+    'lng': np.float32,
+    'user': np.uint8,           # USER_* code
+    'bike': np.uint8,           # NameIndex id of rideable_type, BIKE_NONE = missing
+    'key': np.uint64,           # trip key (see trip_keys), 0 = none
+    'snapped': np.uint8,        # SNAPPED_* flags (see snap_dockless)
+}
+USER_OTHER, USER_SUBSCRIBER, USER_CUSTOMER = 0, 1, 2
+SNAPPED_START, SNAPPED_END = 1, 2
+USER_TYPES = ('other', 'Subscriber', 'Customer')  # by USER_* code
+BIKE_NONE = 255
+
+
+# Timestamp layouts seen across the trip files, tried in order. The first
+# three are ISO-style and go through NumPy's datetime64 parser.
+TIMESTAMP_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f',     # legacy: 2017-06-30 23:59:12.3450
+    '%Y-%m-%d %H:%M:%S',        # new: 2020-04-26 17:45:14
+    '%Y-%m-%d %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+)
+ISO_FORMATS = frozenset(TIMESTAMP_FORMATS[:3])
+# Month indices count from the first month of the system data.
+MONTH_EPOCH = np.datetime64('2017-06', 'M')
+MONTH_EPOCH_ORDINAL = 2017 * 12 + 5
+
+
+def detect_timestamp_format(values, sample_size=1000):
+    """First entry of ``TIMESTAMP_FORMATS`` that parses a sample of ``values``, else None."""
+    sample = values.dropna().head(sample_size)
+    if sample.empty:
+        return None
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+        except (ValueError, TypeError):
+            continue
+        return fmt
+    return None
+
+
+def parse_timestamps(values, fmt):
+    """Parse a string column with the file's detected format into datetime64[us].
+
+    Rows that don't match ``fmt`` (or every row, if no format was detected)
+    fall back to pandas' inference; anything unparseable becomes NaT.
+    """
+    if fmt in ISO_FORMATS:
+        try:
+            return values.to_numpy(dtype=object, na_value='NaT').astype('datetime64[us]')
+        except ValueError:
+            pass
+    if fmt is None:
+        parsed = pd.to_datetime(values, errors='coerce', format='mixed')
+    else:
+        parsed = pd.to_datetime(values, errors='coerce', format=fmt)
+        missed = parsed.isna() & values.notna()
+        if missed.any():
+            parsed[missed] = pd.to_datetime(values[missed], errors='coerce', format='mixed')
+    return parsed.to_numpy(dtype='datetime64[us]')
+
+
+def calendar_codes(start):
+    """(month index since 2017-06, hour-of-week dow * 24 + hour) for datetime64 values."""
+    month = (start.astype('datetime64[M]') - MONTH_EPOCH).astype(np.int32)
+    secs = start.astype('datetime64[s]').astype(np.int64)
+    days = secs // 86400
+    hour = (secs - days * 86400) // 3600
+    dow = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday is 0
+    return month, (dow * 24 + hour).astype(np.int16)
+
+
+def week_slots(secs):
+    """Slot of the week (dow * DAY_SLOTS + slot of the day) for int64 epoch seconds."""
+    days = secs // 86400
+    return ((days + 3) % 7) * DAY_SLOTS + (secs - days * 86400) // (SLOT_MINUTES * 60)
+
+
+def month_label(month):
+    """'YYYY-MM' for a month index."""
+    y, m = divmod(MONTH_EPOCH_ORDINAL + month, 12)
+    return f'{y:04d}-{m + 1:02d}'
+
+
+def month_index(label):
+    """Month index of a 'YYYY-MM' label (inverse of ``month_label``)."""
+    y, m = label.split('-')
+    return int(y) * 12 + int(m) - 1 - MONTH_EPOCH_ORDINAL
+
+
+def month_year(month):
+    """Calendar year of a month index (scalar or array)."""
+    return (MONTH_EPOCH_ORDINAL + month) // 12
+
+
+def _constant_category(value, index):
+    """Categorical Series holding ``value`` on every row (all missing for None)."""
+    if value is None:
+        return pd.Series(pd.Categorical.from_codes(np.full(len(index), -1, dtype=np.int8), []), index=index)
+    return pd.Series(pd.Categorical.from_codes(np.zeros(len(index), dtype=np.int8), [value]), index=index)
+
+
+def normalize_trips(df, formats, locator):
+    """Map one raw chunk of either schema onto the columns the aggregators use.
+
+    Returns start_time, duration_sec, is_sub, is_cust, rideable_type,
+    start/end station names and raw ids, start and end coordinates and the
+    trip key, with invalid rows (no start time or coordinates, duration
+    outside (0, 24h)) removed. ``formats`` caches the detected timestamp
+    format per column across the chunks of one file, and the docked starts
+    are added to its ``locator`` (a StationLocator).
+    """
+    def timestamps(col):
+        with stage('datetime_parse', len(df)):
+            if col not in formats:
+                formats[col] = detect_timestamp_format(df[col])
+            return parse_timestamps(df[col], formats[col])
+
+    def station_id(col):
+        return df[col] if col in df.columns else _constant_category(None, df.index)
+
+    def coordinates(lat_col, lng_col):
+        if lat_col in df.columns and lng_col in df.columns:
+            return df[lat_col].to_numpy(), df[lng_col].to_numpy()
+        return np.full(len(df), np.nan, np.float32), np.full(len(df), np.nan, np.float32)
+
+    if 'started_at' in df.columns:
+        start = timestamps('started_at')
+        duration = (timestamps('ended_at') - start) / np.timedelta64(1, 's')
+        lat, lng = df['start_lat'].to_numpy(), df['start_lng'].to_numpy()
+        end_lat, end_lng = coordinates('end_lat', 'end_lng')
+        is_sub = df['member_casual'] == 'member'
+        is_cust = df['member_casual'] == 'casual'
+        if 'rideable_type' in df.columns:
+            bike = df['rideable_type']
+        else:
+            bike = _constant_category('unknown', df.index)
+        with stage('trip_keys', len(df)):
+            key = string_keys(df['ride_id']) if 'ride_id' in df.columns else np.zeros(len(df), np.uint64)
+    else:
+        start = timestamps('start_time')
+        duration = df['duration_sec'].to_numpy()
+        lat, lng = df['start_station_latitude'].to_numpy(), df['start_station_longitude'].to_numpy()
+        end_lat, end_lng = coordinates('end_station_latitude', 'end_station_longitude')
+        is_sub = df['user_type'] == 'Subscriber'
+        is_cust = df['user_type'] == 'Customer'
+        bike = _constant_category('classic_bike', df.index)
+        with stage('trip_keys', len(df)):
+            key = legacy_trip_keys(start, duration, station_id('start_station_id'),
+                                   df['bike_id'].to_numpy() if 'bike_id' in df.columns else np.full(len(df), np.nan))
+
+    with stage('filter', len(df)):
+        keep = ~np.isnat(start) & ~np.isnan(lat) & ~np.isnan(lng) & (duration > 0) & (duration < 86400)
+        trips = pd.DataFrame({
+            'start_time': start, 'duration_sec': duration,
+            'is_sub': is_sub, 'is_cust': is_cust, 'rideable_type': bike,
+            'start_station_name': df['start_station_name'], 'end_station_name': df['end_station_name'],
+            'start_station_id': station_id('start_station_id'), 'end_station_id': station_id('end_station_id'),
+            'lat': lat, 'lng': lng, 'end_lat': end_lat, 'end_lng': end_lng, 'key': key,
+        }, index=df.index)[keep]
+    with stage('snap', len(trips)):
+        locator.add(trips['start_station_name'], trips['lat'].to_numpy(), trips['lng'].to_numpy())
+    return trips
+
+
+# Station snapping: dockless e-bike trips carry coordinates but no station
+# name. Within one file, every station's position is the mean start
+# coordinate of its docked departures (what station_depart averages), and a
+# trip without a start or end name is attributed to the nearest station
+# within SNAP_RADIUS_M. ``read_trips`` holds such trips back until the whole
+# file has been read, and positions are summed as integers, so a CSV snaps
+# the same way whatever --chunk-rows, serially, on a worker, from the cache
+# or into the store. Changing the radius changes partials and store
+# partitions: bump CACHE_VERSION and STORE_VERSION with it.
+SNAP_RADIUS_M = 250
+SNAP_UNITS_PER_DEGREE = 10 ** 6  # positions are summed as exact integer micro-degrees
+METERS_PER_DEGREE = 111_195  # of latitude, on a sphere of the Earth's mean radius
+
+
+class StationLocator:
+    """Station positions seen in one file, and nearest-station lookups on a grid.
+
+    Stations are bucketed into square cells of ``radius`` metres on an
+    equirectangular projection, so a point only has to look at the stations
+    of its own cell and the eight around it. Cells are sorted by column, then
+    row, so each of the three neighbouring columns is one contiguous run of
+    stations. The lookups are vectorized over the points: the i-th station of
+    every point's run in one column is one NumPy pass, and runs are a handful
+    of stations long.
+    """
+
+    def __init__(self, radius=SNAP_RADIUS_M):
+        self.radius = radius
+        self.names = NameIndex()
+        self.sums = np.zeros((0, 3), dtype=np.int64)  # name id x (trips, lat_sum, lng_sum in SNAP_UNITS_PER_DEGREE)
+        self._grid = None                             # built on the first lookup after an add
+
+    def add(self, names, lat, lng):
+        """Add the coordinates of every row whose ``names`` (categorical) entry is set."""
+        codes = names.cat.codes.to_numpy()
+        ok = codes >= 0
+        if not ok.any():
+            return
+        ids = self.names.intern(names.cat.categories.tolist())[codes[ok]]
+        n = len(self.names)
+        self.sums = _fit(self.sums, n)
+        self.sums[:n, 0] += np.bincount(ids, minlength=n)
+        # Integer sums per id (np.bincount would add in float64): sort by id, reduce each run
+        order = np.argsort(ids, kind='stable')
+        starts = np.flatnonzero(np.diff(ids[order], prepend=-1))
+        for j, values in ((1, lat[ok]), (2, lng[ok])):
+            units = np.rint(values[order].astype(np.float64) * SNAP_UNITS_PER_DEGREE).astype(np.int64)
+            self.sums[ids[order][starts], j] += np.add.reduceat(units, starts)
+        self._grid = None
+
+    def position(self, ids):
+        """Mean (lat, lng) of station name ids."""
+        trips = self.sums[ids, 0] * SNAP_UNITS_PER_DEGREE
+        return self.sums[ids, 1] / trips, self.sums[ids, 2] / trips
+
+    def _project(self, lat, lng):
+        return lng * self._x_scale, lat * METERS_PER_DEGREE
+
+    def _cells(self, x, y, dx=0, dy=0):
+        """Sortable int64 key of the cell (column + dx, row + dy) of each point."""
+        col = np.floor(x / self.radius).astype(np.int64) + dx
+        row = np.floor(y / self.radius).astype(np.int64) + dy
+        return (col << 32) + (row + (1 << 31))
+
+    def _build(self):
+        ids = np.flatnonzero(self.sums[:len(self.names), 0] > 0)
+        lat, lng = self.position(ids)
+        self._x_scale = METERS_PER_DEGREE * np.cos(np.radians(np.median(lat))) if len(ids) else 0.0
+        x, y = self._project(lat, lng)
+        cells = self._cells(x, y)
+        order = np.argsort(cells, kind='stable')
+        self._grid = (cells[order], ids[order], x[order], y[order])
+
+    def nearest(self, lat, lng):
+        """Name id of the closest station within ``radius`` of each (finite) point, -1 where there is none."""
+        if self._grid is None:
+            self._build()
+        cells, ids, gx, gy = self._grid
+        out = np.full(len(lat), -1, dtype=np.int64)
+        if not len(cells) or not len(lat):
+            return out
+        x, y = self._project(lat.astype(np.float64), lng.astype(np.float64))
+        best = np.full(len(lat), float(self.radius) ** 2)
+        for dx in (-1, 0, 1):
+            lo = np.searchsorted(cells, self._cells(x, y, dx, -1), 'left')
+            count = np.searchsorted(cells, self._cells(x, y, dx, 1), 'right') - lo
+            for k in range(int(count.max())):
+                rows = np.flatnonzero(count > k)
+                j = lo[rows] + k
+                d2 = (x[rows] - gx[j]) ** 2 + (y[rows] - gy[j]) ** 2
+                closer = d2 < best[rows]
+                best[rows[closer]] = d2[closer]
+                out[rows[closer]] = ids[j[closer]]
+        return out
+
+    def snap(self, names, lat, lng):
+        """Fill the missing entries of ``names`` that have coordinates with the nearest station.
+
+        Returns (names, rows, ids): the filled categorical Series, the
+        positions that were filled and the station name id each one got.
+        """
+        codes = names.cat.codes.to_numpy()
+        rows = np.flatnonzero((codes < 0) & np.isfinite(lat) & np.isfinite(lng))
+        found = self.nearest(lat[rows], lng[rows])
+        rows, found = rows[found >= 0], found[found >= 0]
+        if not len(rows):
+            return names, rows, found
+        used, inv = np.unique(found, return_inverse=True)
+        used_names = pd.Index([self.names.names[i] for i in used.tolist()])
+        categories = names.cat.categories
+        categories = categories.append(used_names.difference(categories))
+        codes = _station_codes(names, categories)
+        codes[rows] = categories.get_indexer(used_names)[inv]
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=names.index), rows, found
+
+
+def snap_dockless(trips, locator):
+    """Attribute trips without a start / end station name to the nearest station (see StationLocator).
+
+    ``locator`` must already hold the docked starts of the whole file. A
+    snapped start takes the station's position as its coordinates, as a
+    docked one has, so station positions are not pulled around by rough
+    dockless coordinates. Adds the ``snapped`` SNAPPED_* flags and drops the
+    end coordinates.
+    """
+    lat, lng = trips['lat'].to_numpy(dtype=np.float32), trips['lng'].to_numpy(dtype=np.float32)
+    flags = np.zeros(len(trips), dtype=np.uint8)
+    start_names, rows, ids = locator.snap(trips['start_station_name'], lat, lng)
+    if len(rows):
+        lat, lng = lat.copy(), lng.copy()
+        lat[rows], lng[rows] = locator.position(ids)
+        flags[rows] |= SNAPPED_START
+    end_names, rows, _ = locator.snap(trips['end_station_name'], trips['end_lat'].to_numpy(),
+                                      trips['end_lng'].to_numpy())
+    flags[rows] |= SNAPPED_END
+    return trips.drop(columns=['end_lat', 'end_lng']).assign(
+        start_station_name=start_names, end_station_name=end_names, lat=lat, lng=lng, snapped=flags)
+
+
+# Trip keys: a 64-bit hash per raw row that is the same wherever the trip is
+# published, so a re-uploaded or overlapping month can be recognised (see
+# TripKeySet). New-schema rows hash their ride_id; legacy rows have none, so
+# they hash (start time, duration, start station id, bike_id), duration
+# standing in for the end time. Key 0 means "no key": such rows are never
+# treated as duplicates.
+def _splitmix64(z):
+    """splitmix64 finalizer (a bijection on uint64) of a uint64 array."""
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _hash_columns(columns):
+    """64-bit hash per row of equal-length 8-byte columns, chained through ``_splitmix64``."""
+    h = np.full(len(columns[0]), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for c in columns:
+        h = _splitmix64(h ^ np.ascontiguousarray(c).view(np.uint64))
+    return h
+
+
+def string_keys(values):
+    """64-bit hash of every string in ``values`` (a Series); 0 where missing.
+
+    Strings are packed into 8-byte words; the all-zero padding words past a
+    string's end are skipped, so the hash does not depend on the longest
+    string in the chunk.
+    """
+    missing = values.isna().to_numpy()
+    strings = values.to_numpy(dtype=object, na_value='')
+    try:
+        raw = strings.astype(np.bytes_)
+    except UnicodeEncodeError:
+        raw = np.array([v.encode() for v in strings], dtype=np.bytes_)
+    width = -(-max(raw.dtype.itemsize, 1) // 8)
+    words = raw.astype(f'S{width * 8}').view('<u8').reshape(len(raw), width)
+    h = np.full(len(raw), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for j in range(width):
+        w = words[:, j]
+        h = np.where(w != 0, _splitmix64(h ^ w), h)
+    h[h == 0] = 1
+    h[missing] = 0
+    return h
+
+
+def legacy_trip_keys(start, duration, station_ids, bike_ids):
+    """Keys of legacy rows from parsed start times, durations (s), raw station ids (categorical) and bike ids."""
+    codes = station_ids.cat.codes.to_numpy()
+    category_keys = string_keys(pd.Series(station_ids.cat.categories.astype(str)))
+    station = np.where(codes >= 0, category_keys[codes], np.uint64(0))
+    h = _hash_columns([start.astype('datetime64[us]').astype(np.int64), duration.astype(np.float64),
+                       station, bike_ids.astype(np.float64)])
+    h[h == 0] = 1
+    h[np.isnat(start)] = 0
+    return h
+
+
+# Row sampling: --sample-rate keeps a fixed pseudo-random subset of the rows
+# of every CSV (or store partition). Row i of source ``key`` is kept when the
+# i-th output of a splitmix64 stream seeded by ``key`` falls below
+# rate * 2**64, so a rerun keeps the same rows and a lower rate keeps a subset
+# of them. CSV rows are dropped as raw lines before the parser sees them, so
+# a sampled run skips most of the parsing as well as the aggregation. Sampled
+# previews therefore skip --dedupe unless it is asked for explicitly; then the
+# choice is made by trip key after parsing instead, so every copy of a trip is
+# kept or left out together and the duplicates of the sample are still found.
+SAMPLE_BLOCK_BYTES = 1 << 22
+
+
+def sample_seed(key):
+    """64-bit seed for the rows of one source (a CSV member or store partition name)."""
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'little')
+
+
+def sample_mask(rows, rate, seed):
+    """Boolean mask: which of the row positions ``rows`` (int array) are kept at ``rate``."""
+    z = np.uint64(seed) + (rows.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+    return _splitmix64(z) < _sample_threshold(rate)
+
+
+def key_sample_mask(keys, rate, seed, first_row=0):
+    """``sample_mask`` by trip key: every row with the same key gets the same answer.
+
+    Rows without a key (0) fall back to their position, counted from ``first_row``.
+    """
+    keep = _splitmix64(keys) < _sample_threshold(rate)
+    missing = np.flatnonzero(keys == 0)
+    if len(missing):
+        keep[missing] = sample_mask(first_row + missing, rate, seed)
+    return keep
+
+
+def _sample_threshold(rate):
+    return np.uint64(min(int(rate * 2.0 ** 64), 2 ** 64 - 1))
+
+
+class _SampledReader:
+    """File wrapper passing on the header line and the ``sample_mask`` rows of the CSV after it.
+
+    Works on SAMPLE_BLOCK_BYTES of raw lines at a time. Assumes no quoted
+    field spans lines, which holds for the trip files.
+    """
+
+    def __init__(self, f, rate, key):
+        self._f = f
+        self._rate = rate
+        self._seed = sample_seed(key)
+        self._header = True
+        self._rows = 0       # data rows seen so far
+        self._carry = b''    # incomplete last line of the previous block
+        self._out = b''
+        self._eof = False
+
+    def _fill(self):
+        block = self._f.read(SAMPLE_BLOCK_BYTES)
+        if block:
+            data = self._carry + block
+            cut = data.rfind(b'\n') + 1
+            data, self._carry = data[:cut], data[cut:]
+        else:
+            self._eof = True
+            data, self._carry = self._carry, b''
+            if data and not data.endswith(b'\n'):
+                data += b'\n'
+        if self._header and data:
+            cut = data.find(b'\n') + 1
+            self._out += data[:cut]
+            data = data[cut:]
+            self._header = False
+        if not data:
+            return
+        buf = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(buf == ord('\n')) + 1
+        keep = sample_mask(self._rows + np.arange(len(ends)), self._rate, self._seed)
+        self._rows += len(ends)
+        self._out += buf[np.repeat(keep, np.diff(ends, prepend=0))].tobytes()
+
+    def read(self, n=-1):
+        while not self._eof and (n < 0 or len(self._out) < n):
+            self._fill()
+        if n < 0 or n >= len(self._out):
+            data, self._out = self._out, b''
+        else:
+            data, self._out = self._out[:n], self._out[n:]
+        return data
+
+
+def read_trips(f, chunk_rows=CHUNK_ROWS, sample_rate=1.0, sample_key=''):
+    """Yield normalized trip chunks from one CSV of either schema.
+
+    Only ``TRIP_COLUMNS`` are parsed, ``chunk_rows`` at a time, so peak memory
+    is set by the chunk size rather than by the size of the month. Timestamps
+    are read as strings and parsed with the format detected on the first chunk.
+    With ``sample_rate`` below 1 only the rows ``sample_mask`` keeps for
+    ``sample_key`` are parsed.
+
+    Trips without a start or end station name are held back until the whole
+    file has been read, then snapped against all of its docked stations (see
+    ``snap_dockless``) and yielded last, so they cost memory for the file's
+    dockless share on top of one chunk.
+    """
+    if sample_rate < 1:
+        f = _SampledReader(f, sample_rate, sample_key)
+    locator, held = StationLocator(), []
+    for trips in _parse_trips(f, chunk_rows, locator):
+        with stage('snap', len(trips)):
+            dockless = (trips['start_station_name'].isna() | trips['end_station_name'].isna()).to_numpy()
+            if dockless.any():
+                held.append(trips[dockless])
+                trips = trips[~dockless]
+            trips = trips.drop(columns=['end_lat', 'end_lng']).assign(snapped=np.zeros(len(trips), np.uint8))
+        yield trips
+    if held:
+        with stage('snap', sum(len(t) for t in held)):
+            trips = snap_dockless(_concat_trips(held), locator)
+        for i in range(0, len(trips), chunk_rows):
+            yield trips.iloc[i:i + chunk_rows]
+
+
+def _parse_trips(f, chunk_rows, locator):
+    """``normalize_trips`` chunks of one CSV, before station snapping."""
+    if PROFILE is None:
+        reader = pd.read_csv(f, usecols=lambda c: c in TRIP_COLUMNS, dtype=TRIP_DTYPES, chunksize=chunk_rows)
+        formats = {}
+        for chunk in reader:
+            yield normalize_trips(chunk, formats, locator)
+        return
+
+    # Profiled: read time inside the parser (including row sampling) is reported as decompress
+    f = _TimedReader(f)
+    reader = pd.read_csv(f, usecols=lambda c: c in TRIP_COLUMNS, dtype=TRIP_DTYPES, chunksize=chunk_rows)
+    formats = {}
+    while True:
+        rss, inflate, t = _rss_bytes(), f.seconds, time.perf_counter()
+        chunk = next(reader, None)
+        elapsed, inflate = time.perf_counter() - t, f.seconds - inflate
+        if chunk is None:
+            PROFILE.add('decompress', inflate)
+            break
+        profile_source(PROFILE.source, 'new' if 'started_at' in chunk.columns else 'legacy')
+        PROFILE.add('decompress', inflate, len(chunk))
+        PROFILE.add('csv_parse', elapsed - inflate, len(chunk), _rss_bytes() - rss)
+        yield normalize_trips(chunk, formats, locator)
+
+
+def _concat_trips(frames):
+    """One frame from normalized chunks; categorical columns are unioned rather than turned into objects."""
+    cols = {}
+    for col in frames[0].columns:
+        parts = [f[col] for f in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            cols[col] = union_categoricals(parts)
+        else:
+            cols[col] = np.concatenate([p.to_numpy() for p in parts])
+    return pd.DataFrame(cols)
+
+
+def _record_aliases(stations, raw_ids, codes, ids):
+    """Remember which dense id each raw station id column value was seen with."""
+    raw_codes = raw_ids.cat.codes.to_numpy()
+    ok = (raw_codes >= 0) & (codes >= 0)
+    if ok.any():
+        pairs = np.unique(pack_pair(raw_codes[ok], codes[ok]))
+        raw, local = unpack_pair(pairs)
+        stations.alias(raw_ids.cat.categories[raw].tolist(), ids[local].tolist())
+
+
+def _station_codes(names, categories):
+    """Codes of a categorical station column re-expressed in ``categories``."""
+    codes = names.cat.codes.to_numpy()
+    remap = categories.get_indexer(names.cat.categories)
+    return np.where(codes >= 0, remap[codes], -1)
+
+
+def _recode(codes, ids, dtype=np.int32, missing=-1):
+    """Map ``codes`` through ``ids``; negative or ``missing`` codes stay ``missing``."""
+    out = np.full(len(codes), missing, dtype=dtype)
+    ok = (codes >= 0) & (codes != missing)
+    out[ok] = ids[codes[ok]]
+    return out
+
+
+def encode_trips(df, stations, bike_types):
+    """Turn a normalized chunk into typed trip columns (see ``TRIP_STORE_DTYPES``).
+
+    Station names are interned into ``stations`` (raw ids become aliases) and
+    rideable types into ``bike_types``, so only int codes are left.
+    """
+    start_names, end_names = df['start_station_name'], df['end_station_name']
+    names = start_names.cat.categories.union(end_names.cat.categories)
+    ids = stations.intern(names.tolist())
+    s_codes = _station_codes(start_names, names)
+    e_codes = _station_codes(end_names, names)
+    _record_aliases(stations, df['start_station_id'], s_codes, ids)
+    _record_aliases(stations, df['end_station_id'], e_codes, ids)
+
+    user = np.full(len(df), USER_OTHER, dtype=np.uint8)
+    user[df['is_sub'].to_numpy(dtype=bool)] = USER_SUBSCRIBER
+    user[df['is_cust'].to_numpy(dtype=bool)] = USER_CUSTOMER
+    bike = df['rideable_type']
+    return {
+        'start': df['start_time'].to_numpy().astype('datetime64[s]').astype(np.int64),
+        'duration': df['duration_sec'].to_numpy(dtype=np.float32),
+        'start_station': _recode(s_codes, ids),
+        'end_station': _recode(e_codes, ids),
+        'lat': df['lat'].to_numpy(dtype=np.float32),
+        'lng': df['lng'].to_numpy(dtype=np.float32),
+        'user': user,
+        'bike': _recode(bike.cat.codes.to_numpy(), bike_types.intern(bike.cat.categories.tolist()),
+                        np.uint8, BIKE_NONE),
+        'key': df['key'].to_numpy(dtype=np.uint64),
+        'snapped': df['snapped'].to_numpy(dtype=np.uint8),
+    }
+
+
+def aggregate_csv(f, agg, chunk_rows=CHUNK_ROWS, sample_rate=1.0, sample_key=''):
+    """Stream one trip CSV into ``agg``. Returns the number of kept rows."""
+    by_key = sample_rate < 1 and agg['trip_keys'] is not None
+    n = rows = 0
+    for trips in read_trips(f, chunk_rows, 1.0 if by_key else sample_rate, sample_key):
+        if by_key:
+            with stage('sample', len(trips)):
+                keys = trips['key'].to_numpy()
+                trips = trips[key_sample_mask(keys, sample_rate, sample_seed(sample_key), rows)]
+                rows += len(keys)
+        with stage('encode', len(trips)):
+            encoded = encode_trips(trips, agg['stations'], agg['bike_types'])
+        n += aggregate_batch(encoded, agg)
+    return n
+
+
+def aggregate_batch(trips, agg):
+    """Add encoded trips (an ``encode_trips`` batch or a trip store partition) to ``agg``.
+
+    Station and bike codes must come from ``agg['stations']`` and
+    ``agg['bike_types']``. With ``agg['dedupe']`` rows whose key was seen
+    before are counted and, for 'drop', left out. Returns the rows added.
+    """
+    n = len(trips['start'])
+    if agg['trip_keys'] is not None and n:
+        with stage('dedupe', n):
+            new = agg['trip_keys'].add_new(trips['key'])
+            repeated = n - int(new.sum())
+            agg['duplicates'] += repeated
+            if repeated and agg['dedupe'] == 'drop':
+                trips = {col: a[new] for col, a in trips.items()}
+                n = len(trips['start'])
+    start = trips['start']
+    agg['total_trips'] += n
+    if n == 0:
+        return n
+    snapped = trips['snapped']
+    agg['snapped'] += [np.count_nonzero(snapped & SNAPPED_START), np.count_nonzero(snapped & SNAPPED_END)]
+
+    with stage('agg.calendar', n):
+        # Date range
+        d_min = pd.Timestamp(int(start.min()), unit='s')
+        d_max = pd.Timestamp(int(start.max()), unit='s')
+        if agg['min_date'] is None or d_min < agg['min_date']:
+            agg['min_date'] = d_min
+        if agg['max_date'] is None or d_max > agg['max_date']:
+            agg['max_date'] = d_max
+        batch = Batch(trips, len(agg['stations']))
+
+    for name in agg['aggregators']:
+        with stage(f'agg.{name}', n):
+            AGGREGATORS[name].update(agg, batch)
+    return n
+
+
+def list_members(zf_path):
+    with zipfile.ZipFile(zf_path, 'r') as z:
+        return [f for f in z.namelist() if f.endswith('.csv') and '__MACOSX' not in f]
+
+
+def process_member(task, exclude=None):
+    """Aggregate one (zip, csv member, chunk rows, aggregators, sample rate, dedupe) task.
+
+    Returns (partial, error). Trips whose keys are in the ``exclude``
+    TripKeySet count as duplicates too.
+    """
+    zf_path, csv_name, chunk_rows, aggregators, sample_rate, dedupe = task
+    part = new_aggregates(aggregators, dedupe)
+    if exclude is not None:
+        part['trip_keys'].parent = exclude
+    profile_source(csv_name)
     try:
         with zipfile.ZipFile(zf_path, 'r') as z:
-            csv_files = [f for f in z.namelist() if f.endswith('.csv') and '__MACOSX' not in f]
-            for csv_name in csv_files:
-                with z.open(csv_name) as f:
-                    df = pd.read_csv(f, low_memory=False)
-
-                    # Normalize columns
-                    if 'started_at' in df.columns:
-                        df = df.rename(columns={
-                            'started_at': 'start_time', 'ended_at': 'end_time',
-                            'start_lat': 'start_station_latitude', 'start_lng': 'start_station_longitude',
-                            'end_lat': 'end_station_latitude', 'end_lng': 'end_station_longitude',
-                            'member_casual': 'user_type',
-                        })
-                        df['user_type'] = df['user_type'].map({'member': 'Subscriber', 'casual': 'Customer'}).fillna('Unknown')
-                        df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce')
-                        df['end_time'] = pd.to_datetime(df['end_time'], errors='coerce')
-                        df['duration_sec'] = (df['end_time'] - df['start_time']).dt.total_seconds()
-                        if 'rideable_type' not in df.columns:
-                            df['rideable_type'] = 'unknown'
-                    else:
-                        df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce')
-                        df['end_time'] = pd.to_datetime(df['end_time'], errors='coerce')
-                        df['rideable_type'] = 'classic_bike'
-
-                    # Filter
-                    df = df.dropna(subset=['start_time', 'start_station_latitude', 'start_station_longitude'])
-                    df = df[(df['duration_sec'] > 0) & (df['duration_sec'] < 86400)]
-
-                    n = len(df)
-                    total_trips += n
-
-                    # Date range
-                    d_min = df['start_time'].min()
-                    d_max = df['start_time'].max()
-                    if min_date is None or d_min < min_date:
-                        min_date = d_min
-                    if max_date is None or d_max > max_date:
-                        max_date = d_max
-
-                    # Extract features
-                    df['year_month'] = df['start_time'].dt.to_period('M').astype(str)
-                    df['hour'] = df['start_time'].dt.hour
-                    df['dow'] = df['start_time'].dt.dayofweek
-                    df['year'] = df['start_time'].dt.year
-                    df['is_sub'] = (df['user_type'] == 'Subscriber').astype(int)
-                    df['is_cust'] = (df['user_type'] == 'Customer').astype(int)
-
-                    # Monthly
-                    for ym, grp in df.groupby('year_month'):
-                        a = monthly_agg[ym]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-                        a['sub'] += grp['is_sub'].sum()
-                        a['cust'] += grp['is_cust'].sum()
-                        for bt in ['classic_bike', 'electric_bike', 'docked_bike']:
-                            a[bt.split('_')[0]] += (grp['rideable_type'] == bt).sum()
-
-                    # Hourly
-                    for h, grp in df.groupby('hour'):
-                        a = hourly_agg[h]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-                        a['sub'] += grp['is_sub'].sum()
-                        a['cust'] += grp['is_cust'].sum()
-
-                    # Day of week
-                    for d, grp in df.groupby('dow'):
-                        a = dow_agg[d]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-                        a['sub'] += grp['is_sub'].sum()
-                        a['cust'] += grp['is_cust'].sum()
-
-                    # Station departures
-                    valid_start = df.dropna(subset=['start_station_name'])
-                    for sname, grp in valid_start.groupby('start_station_name'):
-                        a = station_depart[sname]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-                        a['sub'] += grp['is_sub'].sum()
-                        a['cust'] += grp['is_cust'].sum()
-                        a['lat_sum'] += grp['start_station_latitude'].sum()
-                        a['lng_sum'] += grp['start_station_longitude'].sum()
-                        a['coord_count'] += len(grp)
-
-                    # Station arrivals
-                    valid_end = df.dropna(subset=['end_station_name'])
-                    for ename, cnt in valid_end['end_station_name'].value_counts().items():
-                        station_arrive[ename] += cnt
-
-                    # Top routes (only count, save memory)
-                    valid_both = df.dropna(subset=['start_station_name', 'end_station_name'])
-                    for (s, e), grp in valid_both.groupby(['start_station_name', 'end_station_name']):
-                        r = route_agg[(s, e)]
-                        r['trips'] += len(grp)
-                        r['dur_sum'] += grp['duration_sec'].sum()
-
-                    # Station monthly (all stations)
-                    for (sname, ym), grp in valid_start.groupby(['start_station_name', 'year_month']):
-                        station_monthly_agg[(sname, ym)] += len(grp)
-
-                    # Yearly
-                    for y, grp in df.groupby('year'):
-                        a = yearly_agg[y]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-                        sn = grp['start_station_name'].dropna().unique()
-                        en = grp['end_station_name'].dropna().unique() if 'end_station_name' in grp.columns else []
-                        a['start_stations'].update(sn)
-                        a['end_stations'].update(en)
-
-                    # Bike type
-                    for bt, grp in df.groupby('rideable_type'):
-                        a = bike_type_agg[bt]
-                        a['trips'] += len(grp)
-                        a['dur_sum'] += grp['duration_sec'].sum()
-
-                    print(f"  [{idx+1}/{len(zip_files)}] {csv_name}: {n:,} rows (total: {total_trips:,})")
-
-                    del df
-                    gc.collect()
+            with z.open(csv_name) as f:
+                n = aggregate_csv(f, part, chunk_rows, sample_rate, csv_name)
+        part['members'].append((csv_name, n))
+    except Exception as e:
+        return part, f"{e}\n{traceback.format_exc()}"
+    finally:
+        if exclude is not None:
+            part['trip_keys'].parent = None
+    return part, None
 
+
+def merge_aggregates(total, part):
+    """Fold a partial produced by ``process_member`` (or a merged ZIP partial) into ``total``.
+
+    ``part`` must hold at least the aggregators of ``total``; cached ZIP
+    partials hold all of them.
+    """
+    # Re-key the partial's station ids into the running dictionary
+    stations = part['stations']
+    remap = total['stations'].intern(stations.names)
+    total['stations'].alias(stations.aliases.keys(), remap[list(stations.aliases.values())].tolist())
+    for name in total['aggregators']:
+        AGGREGATORS[name].merge(total, part, remap)
+    total['total_trips'] += part['total_trips']
+    if part['min_date'] is not None and (total['min_date'] is None or part['min_date'] < total['min_date']):
+        total['min_date'] = part['min_date']
+    if part['max_date'] is not None and (total['max_date'] is None or part['max_date'] > total['max_date']):
+        total['max_date'] = part['max_date']
+    total['members'].extend(part['members'])
+    if total['trip_keys'] is not None:
+        total['trip_keys'].update(part['trip_keys'])
+    total['duplicates'] += part['duplicates']
+    total['snapped'] += part['snapped']
+
+
+def merge_deduped(total, part, redo):
+    """``merge_aggregates``, counting trips of ``part`` that ``total`` already holds as duplicates.
+
+    With 'drop' such a part is first rebuilt by ``redo(seen)``, which must
+    re-aggregate its source with the ``seen`` TripKeySet excluded (see
+    ``process_member``); sources that share no trips merge as they are.
+    Returns the part that was merged.
+    """
+    if total['trip_keys'] is not None:
+        overlap = int(total['trip_keys'].contains(part['trip_keys'].keys()).sum())
+        if overlap and total['dedupe'] == 'drop':
+            part = redo(total['trip_keys'])
+        else:
+            total['duplicates'] += overlap
+    merge_aggregates(total, part)
+    return part
+
+
+def scale_aggregates(agg, rate):
+    """Turn totals over a ``rate`` row sample into estimates for every row.
+
+    Each aggregator scales its counts and sums by 1 / ``rate`` (see
+    ``Aggregator.scale``) and ``build_output`` flags the output as approximate.
+    """
+    factor = 1 / rate
+    agg['sample'] = {'rate': rate, 'sampled_trips': agg['total_trips']}
+    agg['total_trips'] = int(round(agg['total_trips'] * factor))
+    for name in agg['aggregators']:
+        AGGREGATORS[name].scale(agg, factor)
+
+
+# ============================================================
+# Aggregators
+# ============================================================
+# Every key of dashboard_data.json comes from an ``Aggregator`` registered in
+# AGGREGATORS. ``new`` returns its empty entries of the aggregate dict,
+# ``update`` adds one ``Batch`` of encoded trips, ``merge`` folds a partial's
+# entries into the totals and ``finalize`` returns its JSON keys. State stays
+# in the plain dict, so partials still pickle into the cache and travel to
+# worker processes. ``--only`` (``aggregators=`` in ``ingest`` /
+# ``aggregate_store``) runs a subset plus whatever it ``requires``.
+OUTPUT_KEYS = ('summary', 'monthly', 'stations', 'station_flow', 'hourly', 'dow', 'heatmap', 'top_routes',
+               'station_monthly', 'yearly', 'bike_type', 'route_sketch')  # key order of dashboard_data.json
+MIN_STATION_TRIPS = 10  # departures for a station to be listed
+
+
+class Batch:
+    """One batch of encoded trips plus the per-row values several aggregators share."""
+
+    def __init__(self, trips, n_stations):
+        self.trips = trips
+        self.n = len(trips['start'])
+        self.month, self.how = calendar_codes(trips['start'].view('datetime64[s]'))
+        # Month indices are dense, so an offset turns them into codes
+        self.first_month = int(self.month.min())
+        self.m_codes = self.month - self.first_month
+        self.nm = int(self.m_codes.max()) + 1
+
+        # Per-row weights shared by every dimension
+        self.dur = trips['duration'].astype(np.float64)
+        user = trips['user']
+        self.is_sub = (user == USER_SUBSCRIBER).astype(np.float64)
+        self.is_cust = (user == USER_CUSTOMER).astype(np.float64)
+        self.trip_weights = [None, self.dur, self.is_sub, self.is_cust]
+
+        # Stations (ids are global to agg['stations']; -1 = no station)
+        self.s, self.e = trips['start_station'], trips['end_station']
+        self.has_s, self.has_e = self.s >= 0, self.e >= 0
+        self.both = self.has_s & self.has_e
+        self.s_ids, self.e_ids = self.s[self.has_s], self.e[self.has_e]
+        self.ns = n_stations
+
+    @functools.cached_property
+    def bins(self):
+        """Duration histogram bin of every row (see duration_bins)."""
+        return duration_bins(self.dur)
+
+
+class Aggregator:
+    name = None
+    outputs = ()   # JSON keys ``finalize`` returns
+    requires = ()  # aggregators whose state this one reads
+
+    def new(self):
+        """Empty entries this aggregator adds to the aggregate dict."""
+        return {}
+
+    def update(self, agg, batch):
+        """Add one ``Batch`` to ``agg``."""
+
+    def merge(self, total, part, remap):
+        """Fold ``part``'s entries into ``total``; ``remap[id]`` is a part station id in ``total``."""
+
+    def scale(self, agg, factor):
+        """Scale the merged totals of a row sample up by ``factor`` (1 / sample rate).
+
+        Duration histograms are left as they are: they only feed quantiles,
+        which the sample already estimates.
+        """
+
+    def finalize(self, agg):
+        """{JSON key: value} for the merged totals."""
+        return {}
+
+
+AGGREGATORS = {}
+
+
+def register(cls):
+    """Class decorator: add one instance of an ``Aggregator`` to AGGREGATORS."""
+    AGGREGATORS[cls.name] = cls()
+    return cls
+
+
+def resolve_aggregators(names=None):
+    """``names`` (default: all) plus everything they require, in registration order."""
+    if names is None:
+        return tuple(AGGREGATORS)
+    unknown = sorted(set(names) - set(AGGREGATORS))
+    if unknown:
+        raise ValueError(f"Unknown aggregator(s) {', '.join(unknown)}; choose from {', '.join(AGGREGATORS)}")
+    wanted = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending.extend(AGGREGATORS[name].requires)
+    return tuple(name for name in AGGREGATORS if name in wanted)
+
+
+def _listed_stations(agg):
+    """Boolean mask over station ids: stations with at least MIN_STATION_TRIPS departures."""
+    return agg['station_depart'][:len(agg['stations']), 0] >= MIN_STATION_TRIPS
+
+
+def _listed_order(agg):
+    """Ids of the listed stations in ``stations`` output order (most active first)."""
+    ids = np.flatnonzero(_listed_stations(agg))
+    activity = agg['station_depart'][ids, 0] + _fit(agg['station_arrive'], len(agg['stations']))[ids]
+    return ids[np.argsort(-activity, kind='stable')]
+
+
+@register
+class SummaryAggregator(Aggregator):
+    name = 'summary'
+    outputs = ('summary',)
+    requires = ('stations',)
+
+    def finalize(self, agg):
+        total_trips = agg['total_trips']
+        min_date, max_date = agg['min_date'], agg['max_date']
+        sub_trips = agg['station_depart'][:, STATION_FIELDS.index('sub')].sum()
+        return {'summary': {
+            'total_trips': total_trips,
+            'date_range_start': str(min_date.date()) if min_date else 'N/A',
+            'date_range_end': str(max_date.date()) if max_date else 'N/A',
+            'total_stations': int(_listed_stations(agg).sum()),
+            'subscriber_pct': round(sub_trips / total_trips * 100, 1) if total_trips > 0 else 0,
+        }}
+
+
+@register
+class MonthlyAggregator(Aggregator):
+    name = 'monthly'
+    outputs = ('monthly',)
+
+    def new(self):
+        return {
+            'monthly': KeyedTable(MONTHLY_FIELDS),      # month index (see month_label)
+            'month_hist': PackedTable(COUNT_FIELDS),    # (month index, duration bin)
+        }
+
+    def update(self, agg, b):
+        bike = b.trips['bike']
+        bike_ids = agg['bike_types'].ids
+        bike_weights = [(bike == bike_ids[bt]).astype(np.float64) if bt in bike_ids else np.zeros(b.n)
+                        for bt in BIKE_TYPES]
+        mo = _sums(b.m_codes, b.nm, b.trip_weights + bike_weights)
+        seen = mo[:, 0] > 0
+        agg['monthly'].add((np.flatnonzero(seen) + b.first_month).tolist(), mo[seen])
+        _count_bins(agg['month_hist'], b.m_codes, b.bins, b.nm, b.first_month)
+
+    def merge(self, total, part, remap):
+        total['monthly'].merge(part['monthly'])
+        total['month_hist'].merge(part['month_hist'])
+
+    def scale(self, agg, factor):
+        _scale_rows(agg['monthly'].values, MONTHLY_FIELDS, factor)
+
+    def finalize(self, agg):
+        month_q = _packed_quantiles(agg['month_hist'])
+        monthly_list = []
+        for ym, a in sorted(agg['monthly'].rows()):
+            monthly_list.append({
+                'year_month': month_label(ym), 'total_trips': int(a['trips']),
+                'avg_duration': _avg(a['dur_sum'], a['trips']),
+                **_quantile_fields(month_q.get(ym)),
+                'trips_Subscriber': int(a['sub']), 'trips_Customer': int(a['cust']),
+                'bike_classic': int(a['classic']), 'bike_electric': int(a['electric']),
+                'bike_docked': int(a['docked']),
+            })
+        return {'monthly': monthly_list}
+
+
+@register
+class StationsAggregator(Aggregator):
+    name = 'stations'
+    outputs = ('stations',)
+
+    def new(self):
+        return {
+            'station_depart': np.zeros((0, len(STATION_FIELDS))),  # station id x field
+            'station_arrive': np.zeros(0),                          # station id
+            'station_hist': PackedTable(COUNT_FIELDS),              # (start id, duration bin)
+        }
+
+    def update(self, agg, b):
+        has_s, ns = b.has_s, b.ns
+        agg['station_depart'] = _fit(agg['station_depart'], ns)
+        agg['station_depart'][:ns] += _sums(b.s_ids, ns, [None, b.dur[has_s], b.is_sub[has_s], b.is_cust[has_s],
+                                                          b.trips['lat'][has_s].astype(np.float64),
+                                                          b.trips['lng'][has_s].astype(np.float64)])
+        agg['station_arrive'] = _fit(agg['station_arrive'], ns)
+        agg['station_arrive'][:ns] += np.bincount(b.e_ids, minlength=ns)
+        _count_bins(agg['station_hist'], b.s_ids, b.bins[has_s], ns)
+
+    def merge(self, total, part, remap):
+        ns = len(total['stations'])
+        n_part = len(part['stations'])
+        total['station_depart'] = _fit(total['station_depart'], ns)
+        total['station_depart'][remap] += _fit(part['station_depart'], n_part)[:n_part]
+        total['station_arrive'] = _fit(total['station_arrive'], ns)
+        total['station_arrive'][remap] += _fit(part['station_arrive'], n_part)[:n_part]
+        a, b = unpack_pair(part['station_hist'].keys)
+        total['station_hist'].merge(part['station_hist'], pack_pair(remap[a], b))
+
+    def scale(self, agg, factor):
+        _scale_rows(agg['station_depart'], STATION_FIELDS, factor)  # lat_sum / lng_sum keep the mean position
+        agg['station_arrive'] = _scale_counts(agg['station_arrive'], factor)
+
+    def finalize(self, agg):
+        station_q = _packed_quantiles(agg['station_hist'])
+        names = agg['stations'].names
+        station_list = []
+        for sid in np.flatnonzero(_listed_stations(agg)).tolist():
+            a = dict(zip(STATION_FIELDS, agg['station_depart'][sid]))
+            departures = int(a['trips'])
+            arrivals = int(agg['station_arrive'][sid])
+            station_list.append({
+                'station_name': names[sid],
+                'lat': round(a['lat_sum'] / a['trips'], 6), 'lng': round(a['lng_sum'] / a['trips'], 6),
+                'total_departures': departures, 'total_arrivals': arrivals,
+                'total_activity': departures + arrivals,
+                'net_flow': arrivals - departures,
+                'avg_duration_depart': _avg(a['dur_sum'], a['trips']),
+                **{f'{k}_depart': v for k, v in _quantile_fields(station_q.get(sid)).items()},
+                'subscriber_departures': int(a['sub']), 'customer_departures': int(a['cust']),
+                'subscriber_pct': round(a['sub'] / a['trips'] * 100, 1),
+            })
+        station_list.sort(key=lambda x: x['total_activity'], reverse=True)
+        return {'stations': station_list}
+
+
+@register
+class HourOfWeekAggregator(Aggregator):
+    """Trips by hour of week, the state behind ``hourly`` and ``dow``."""
+    name = 'hour_of_week'
+
+    def new(self):
+        return {
+            'hourly': np.zeros((24, len(TRIP_FIELDS))),
+            'dow': np.zeros((7, len(TRIP_FIELDS))),
+            'how_hist': np.zeros((7 * 24, HIST_BINS)),  # hour-of-week x duration bin
+        }
+
+    def update(self, agg, b):
+        # One pass over hour-of-week, folded both ways
+        week = _sums(b.how, 7 * 24, b.trip_weights).reshape(7, 24, -1)
+        agg['hourly'] += week.sum(axis=0)
+        agg['dow'] += week.sum(axis=1)
+        agg['how_hist'] += np.bincount(b.how.astype(np.int64) * HIST_BINS + b.bins,
+                                       minlength=7 * 24 * HIST_BINS).reshape(7 * 24, HIST_BINS)
+
+    def merge(self, total, part, remap):
+        total['hourly'] += part['hourly']
+        total['dow'] += part['dow']
+        total['how_hist'] += part['how_hist']
+
+    def scale(self, agg, factor):
+        _scale_rows(agg['hourly'], TRIP_FIELDS, factor)
+        _scale_rows(agg['dow'], TRIP_FIELDS, factor)
+
+
+@register
+class HourlyAggregator(Aggregator):
+    name = 'hourly'
+    outputs = ('hourly',)
+    requires = ('hour_of_week',)
+
+    def finalize(self, agg):
+        hour_q = _dense_quantiles(agg['how_hist'].reshape(7, 24, HIST_BINS).sum(axis=0))
+        hourly_list = []
+        for h, (trips, dur_sum, sub, cust) in enumerate(agg['hourly']):
+            hourly_list.append({
+                'hour': h, 'total_trips': int(trips),
+                'avg_duration': _avg(dur_sum, trips),
+                **_quantile_fields(hour_q.get(h)),
+                'trips_Subscriber': int(sub), 'trips_Customer': int(cust),
+            })
+        return {'hourly': hourly_list}
+
+
+@register
+class DowAggregator(Aggregator):
+    name = 'dow'
+    outputs = ('dow',)
+    requires = ('hour_of_week',)
+
+    def finalize(self, agg):
+        dow_q = _dense_quantiles(agg['how_hist'].reshape(7, 24, HIST_BINS).sum(axis=1))
+        dow_list = []
+        for d, (trips, dur_sum, sub, cust) in enumerate(agg['dow']):
+            dow_list.append({
+                'day_of_week': d, 'day_name': DOW_NAMES[d], 'total_trips': int(trips),
+                'avg_duration': _avg(dur_sum, trips),
+                **_quantile_fields(dow_q.get(d)),
+                'trips_Subscriber': int(sub), 'trips_Customer': int(cust),
+            })
+        return {'dow': dow_list}
+
+
+@register
+class HeatmapAggregator(Aggregator):
+    """Departures and arrivals per slot of the week, system-wide and per station.
+
+    Trips arrive in the slot of their end time. The system-wide grid goes to
+    the JSON; the per-station grids are written to station_heatmaps.npz
+    (see "Station heatmaps").
+    """
+    name = 'heatmap'
+    outputs = ('heatmap',)
+
+    def new(self):
+        return {
+            'slot_depart': np.zeros((0, WEEK_SLOTS), dtype=np.uint32),  # start id x week slot
+            'slot_arrive': np.zeros((0, WEEK_SLOTS), dtype=np.uint32),  # end id x week slot
+            'system_slots': np.zeros((2, WEEK_SLOTS), dtype=np.int64),  # departures, arrivals x week slot
+        }
+
+    def update(self, agg, b):
+        start = b.trips['start']
+        depart = week_slots(start)
+        arrive = week_slots(start + np.rint(b.dur).astype(np.int64))
+        agg['system_slots'][0] += np.bincount(depart, minlength=WEEK_SLOTS)
+        agg['system_slots'][1] += np.bincount(arrive, minlength=WEEK_SLOTS)
+        # One bincount per direction over packed (station, slot) codes
+        for key, ids, has, slots in (('slot_depart', b.s_ids, b.has_s, depart),
+                                     ('slot_arrive', b.e_ids, b.has_e, arrive)):
+            counts = np.bincount(ids.astype(np.int64) * WEEK_SLOTS + slots[has], minlength=b.ns * WEEK_SLOTS)
+            agg[key] = _fit(agg[key], b.ns)
+            agg[key][:b.ns] += counts.reshape(b.ns, WEEK_SLOTS).astype(np.uint32)
+
+    def merge(self, total, part, remap):
+        ns = len(total['stations'])
+        n_part = len(part['stations'])
+        for key in ('slot_depart', 'slot_arrive'):
+            total[key] = _fit(total[key], ns)
+            total[key][remap] += _fit(part[key], n_part)[:n_part]
+        total['system_slots'] += part['system_slots']
+
+    def scale(self, agg, factor):
+        for key in ('slot_depart', 'slot_arrive', 'system_slots'):
+            agg[key] = _scale_counts(agg[key], factor)
+
+    def finalize(self, agg):
+        departures, arrivals = agg['system_slots'].reshape(2, 7, DAY_SLOTS).tolist()
+        return {'heatmap': {'slot_minutes': SLOT_MINUTES, 'departures': departures, 'arrivals': arrivals}}
+
+
+@register
+class StationFlowAggregator(Aggregator):
+    """Hourly inflow / outflow per station on an average weekday and weekend day.
+
+    Folded from the heatmap aggregator's per-station slot counts, so it adds
+    nothing to the per-batch pass. Averages are over the days of the months
+    each station was in use; rows follow the ``stations`` output.
+    """
+    name = 'station_flow'
+    outputs = ('station_flow',)
+    requires = ('stations', 'heatmap', 'station_monthly')
+
+    @staticmethod
+    def station_days(agg, n):
+        """(weekdays, weekend days) per station id in the months it had departures, within the data range."""
+        sid, month = unpack_pair(agg['station_monthly'].keys)
+        weekdays = np.zeros(n)
+        total = np.zeros(n)
+        if len(sid) and agg['min_date'] is not None:
+            first = (MONTH_EPOCH + month).astype('datetime64[D]')
+            last = (MONTH_EPOCH + month + 1).astype('datetime64[D]')
+            first = np.maximum(first, np.datetime64(agg['min_date'].date()))
+            last = np.minimum(last, np.datetime64(agg['max_date'].date()) + 1)
+            weekdays = np.bincount(sid, weights=np.busday_count(first, last), minlength=n)
+            total = np.bincount(sid, weights=(last - first).astype(np.int64), minlength=n)
+        return weekdays, total - weekdays
+
+    def finalize(self, agg):
+        names = agg['stations'].names
+        ids = _listed_order(agg)
+        weekdays, weekend_days = (np.maximum(d[ids], 1)[:, None] for d in self.station_days(agg, len(names)))
+        # station x hour, averaged per weekday / weekend day
+        profiles = {}
+        for key, grid in (('departures', agg['slot_depart']), ('arrivals', agg['slot_arrive'])):
+            week = _fit(grid, len(names))[ids].reshape(len(ids), 7, 24, DAY_SLOTS // 24).sum(axis=3, dtype=np.float64)
+            profiles[f'weekday_{key}'] = week[:, :5].sum(axis=1) / weekdays
+            profiles[f'weekend_{key}'] = week[:, 5:].sum(axis=1) / weekend_days
+        net = profiles['weekday_arrivals'] - profiles['weekday_departures']
+        by_9am = net[:, FLOW_DAY_START:9].sum(axis=1)
+        by_6pm = net[:, FLOW_DAY_START:18].sum(axis=1)
+
+        station_flow = []
+        for k, sid in enumerate(ids.tolist()):
+            station_flow.append({
+                'station_name': names[sid],
+                'net_by_9am': round(float(by_9am[k]), 1) + 0.0,  # + 0.0: no -0.0 in the JSON
+                'net_by_6pm': round(float(by_6pm[k]), 1) + 0.0,
+                **{key: [round(v, 2) for v in p[k].tolist()] for key, p in profiles.items()},
+            })
+        return {'station_flow': station_flow}
+
+
+@register
+class RoutesAggregator(Aggregator):
+    """Station-to-station routes; by far the costliest aggregator on a large history."""
+    name = 'routes'
+    outputs = ('top_routes', 'route_sketch')
+
+    def new(self):
+        return {
+            'route': PackedTable(ROUTE_FIELDS),             # (start id, end id)
+            'route_hist': PackedTable(COUNT_FIELDS),        # (start id, end id * HIST_BINS + duration bin)
+        }
+
+    def update(self, agg, b):
+        # (start id, end id) packed into one int64
+        s, e, both = b.s[b.both], b.e[b.both], b.both
+        r_keys, r_codes = np.unique(pack_pair(s, e), return_inverse=True)
+        agg['route'].add(r_keys, _sums(r_codes, len(r_keys), [None, b.dur[both]]))
+        _count_pairs(agg['route_hist'], s, e.astype(np.int64) * HIST_BINS + b.bins[both])
+
+    def merge(self, total, part, remap):
+        a, b = unpack_pair(part['route'].keys)
+        route_keys = pack_pair(remap[a], remap[b])
+        total['route'].merge(part['route'], route_keys)
+        if 'route_exact' in total:
+            total['route_exact'].merge(part['route'], route_keys)
+        a, b = unpack_pair(part['route_hist'].keys)
+        total['route_hist'].merge(part['route_hist'],
+                                  pack_pair(remap[a], remap[b // HIST_BINS] * HIST_BINS + b % HIST_BINS))
+        if isinstance(total['route'], SpaceSaving):
+            # Only routes the summary tracks keep a histogram (of their observed trips)
+            a, b = unpack_pair(total['route_hist'].keys)
+            total['route_hist'].keep(np.isin(pack_pair(a, b // HIST_BINS), total['route'].keys))
+
+    def scale(self, agg, factor):
+        route = agg['route']
+        if isinstance(route, SpaceSaving):
+            # dur_sum covers the observed trips only
+            _scale_rows(route.values, SpaceSaving.fields, factor, basis='observed')
+            route.floor = float(np.rint(route.floor * factor))
+        else:
+            _scale_rows(route.values, ROUTE_FIELDS, factor)
+        if 'route_exact' in agg:
+            _scale_rows(agg['route_exact'].values, ROUTE_FIELDS, factor)
+
+    def finalize(self, agg):
+        # Top routes (stable, so ties stay in station-id order). For a SpaceSaving
+        # summary trip_count is an upper bound and dur_sum covers only the
+        # observed trips, so each route also carries its possible overcount.
+        names = agg['stations'].names
+        route = agg['route']
+        sketch = isinstance(route, SpaceSaving)
+        route_trips = route.column('trips')
+        route_seen = route.column('observed') if sketch else route_trips
+        route_dur = route.column('dur_sum')
+        route_start, route_end = unpack_pair(route.keys)
+        route_q = _route_quantiles(agg['route_hist'])
+        top_routes = []
+        for i in top_route_ids(route).tolist():
+            entry = {
+                'start_station_name': names[route_start[i]], 'end_station_name': names[route_end[i]],
+                'trip_count': int(route_trips[i]),
+                'avg_duration': _avg(route_dur[i], route_seen[i]),
+                **_quantile_fields(route_q.get(int(route.keys[i]))),
+            }
+            if sketch:
+                entry['trip_count_error'] = int(route_trips[i] - route_seen[i])
+            top_routes.append(entry)
+        if sketch:
+            return {'top_routes': top_routes, 'route_sketch': route_sketch_bounds(route)}
+        return {'top_routes': top_routes}
+
+
+@register
+class StationMonthlyAggregator(Aggregator):
+    name = 'station_monthly'
+    outputs = ('station_monthly',)
+    requires = ('stations',)  # reports the listed stations only
+
+    def new(self):
+        return {'station_monthly': PackedTable(COUNT_FIELDS)}  # (start id, month index)
+
+    def update(self, agg, b):
+        _count_pairs(agg['station_monthly'], b.s_ids, b.month[b.has_s])
+
+    def merge(self, total, part, remap):
+        a, b = unpack_pair(part['station_monthly'].keys)
+        total['station_monthly'].merge(part['station_monthly'], pack_pair(remap[a], b))
+
+    def scale(self, agg, factor):
+        _scale_rows(agg['station_monthly'].values, COUNT_FIELDS, factor)
+
+    def finalize(self, agg):
+        names = agg['stations'].names
+        listed = _listed_stations(agg)
+        station_monthly_list = []
+        sm = agg['station_monthly']
+        for sid, ym, cnt in zip(*unpack_pair(sm.keys), sm.column('trips')):
+            if listed[sid]:
+                station_monthly_list.append({'station_name': names[sid], 'year_month': month_label(ym),
+                                             'trips': int(cnt)})
+        # Station ids follow first-seen order, which depends on --chunk-rows
+        station_monthly_list.sort(key=lambda r: (r['station_name'], r['year_month']))
+        return {'station_monthly': station_monthly_list}
+
+
+@register
+class YearlyAggregator(Aggregator):
+    name = 'yearly'
+    outputs = ('yearly',)
+
+    def new(self):
+        return {
+            'yearly': KeyedTable(ROUTE_FIELDS),  # year
+            'yearly_stations': {},               # year -> bitset of start/end ids
+        }
+
+    def update(self, agg, b):
+        y_codes, years = pd.factorize(month_year(b.month), sort=True)
+        agg['yearly'].add(years.tolist(), _sums(y_codes, len(years), [None, b.dur]))
+        for yc, y in enumerate(years.tolist()):
+            in_year = y_codes == yc
+            seen = np.concatenate([b.s_ids[in_year[b.has_s]], b.e_ids[in_year[b.has_e]]])
+            agg['yearly_stations'][y] = bitset_add(agg['yearly_stations'].get(y, np.zeros(0, np.uint8)), seen)
+
+    def merge(self, total, part, remap):
+        total['yearly'].merge(part['yearly'])
+        for y, bits in part['yearly_stations'].items():
+            total['yearly_stations'][y] = bitset_add(total['yearly_stations'].get(y, np.zeros(0, np.uint8)),
+                                                     remap[bitset_ids(bits)])
+
+    def scale(self, agg, factor):
+        # unique_stations stays the count seen in the sample
+        _scale_rows(agg['yearly'].values, ROUTE_FIELDS, factor)
+
+    def finalize(self, agg):
+        yearly_list = []
+        for y, a in sorted(agg['yearly'].rows()):
+            yearly_list.append({
+                'year': int(y), 'total_trips': int(a['trips']),
+                'avg_duration': _avg(a['dur_sum'], a['trips']),
+                'unique_stations': len(bitset_ids(agg['yearly_stations'].get(y, np.zeros(0, np.uint8)))),
+            })
+        return {'yearly': yearly_list}
+
+
+@register
+class BikeTypeAggregator(Aggregator):
+    name = 'bike_type'
+    outputs = ('bike_type',)
+
+    def new(self):
+        return {'bike_type': KeyedTable(ROUTE_FIELDS)}  # rideable_type
+
+    def update(self, agg, b):
+        # Rows added in name order, as the categorical chunks did
+        bike = b.trips['bike']
+        has_b = bike != BIKE_NONE
+        bike_names = agg['bike_types'].names
+        bt = _sums(bike[has_b], len(bike_names), [None, b.dur[has_b]])
+        seen = sorted(np.flatnonzero(bt[:, 0] > 0).tolist(), key=bike_names.__getitem__)
+        agg['bike_type'].add([bike_names[i] for i in seen], bt[seen])
+
+    def merge(self, total, part, remap):
+        total['bike_type'].merge(part['bike_type'])
+
+    def scale(self, agg, factor):
+        _scale_rows(agg['bike_type'].values, ROUTE_FIELDS, factor)
+
+    def finalize(self, agg):
+        bike_type_list = []
+        for bt, a in agg['bike_type'].rows():
+            bike_type_list.append({
+                'rideable_type': bt, 'total_trips': int(a['trips']),
+                'avg_duration': _avg(a['dur_sum'], a['trips']),
+            })
+        return {'bike_type': bike_type_list}
+
+
+# ============================================================
+# Per-ZIP cache
+# ============================================================
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_entry(cache_dir, digest):
+    return os.path.join(cache_dir, f'{digest}.v{CACHE_VERSION}.pkl')
+
+
+def load_cached(entry):
+    try:
+        with open(entry, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        print(f"  ERROR with {os.path.basename(zf_path)}: {e}")
-        traceback.print_exc()
+        print(f"  Ignoring unreadable cache entry {os.path.basename(entry)}: {e}")
+        return None
+
+
+def store_cached(entry, part):
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = entry + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, entry)
+
+
+def prune_cache(cache_dir, live_entries):
+    """Remove entries for ZIPs that were changed or deleted (or an older CACHE_VERSION)."""
+    removed = 0
+    for path in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        if path not in live_entries:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+# ============================================================
+# Ingest
+# ============================================================
+def new_totals(route_counters=0, validate_routes=False, aggregators=None, dedupe=None):
+    """Empty running totals; routes go to a SpaceSaving summary when ``route_counters`` is set."""
+    agg = new_aggregates(aggregators, dedupe)
+    if route_counters and 'routes' in agg['aggregators']:
+        if validate_routes:
+            agg['route_exact'] = agg['route']
+        agg['route'] = SpaceSaving(route_counters)
+    return agg
+
+
+def _rerun_member(task, seen):
+    """``process_member`` again with the trips of ``seen`` excluded (the ``redo`` of ``merge_deduped``)."""
+    part, error = process_member(task, seen)
+    if error is not None:
+        print(f"  ERROR with {os.path.basename(task[0])}: {error}")
+    return part
+
+
+def _rerun_zip(zf_path, task_args, seen):
+    """Aggregate every member of a ZIP again with the trips of ``seen`` excluded."""
+    aggregators, dedupe = task_args[1], task_args[3]
+    part = new_aggregates(aggregators, dedupe)
+    part['trip_keys'].parent = seen
+    for m in list_members(zf_path):
+        merge_aggregates(part, _rerun_member((zf_path, m) + task_args, part['trip_keys']))
+    part['trip_keys'].parent = None
+    return part
+
+
+def resolve_dedupe(dedupe, sample_rate=1.0):
+    """'drop', 'report' or None for a ``dedupe`` argument.
+
+    'auto' drops duplicates in full runs and skips the check in sampled ones,
+    which would otherwise have to parse every row to sample by trip key (see
+    "Row sampling"); 'off' is None.
+    """
+    if dedupe == 'auto':
+        return 'drop' if sample_rate >= 1 else None
+    return None if dedupe == 'off' else dedupe
+
+
+def ingest(zip_files, cache_dir=None, workers=1, chunk_rows=CHUNK_ROWS,
+           route_counters=0, validate_routes=False, aggregators=None, sample_rate=1.0, dedupe='auto'):
+    """Aggregate ``zip_files`` into one set of totals.
+
+    ZIPs missing from the cache are split into (zip, csv member) tasks and run
+    on ``workers`` processes. Partials are merged back in file order whatever
+    the worker count, so the totals are identical to a serial run.
+
+    With ``route_counters`` the running route totals are a ``SpaceSaving``
+    summary of that many counters instead of exact counts (per-file partials
+    stay exact); ``validate_routes`` also keeps the exact table to compare.
+
+    ``aggregators`` (names, default all) limits the work to those outputs.
+    Cached ZIP partials are still merged, but new ones are only cached when
+    every aggregator ran.
+
+    With ``sample_rate`` below 1 only that share of the rows is read (see
+    ``sample_mask``) and the totals are scaled up to estimates; the cache is
+    neither read nor written.
+
+    ``dedupe`` ('drop', 'report', 'off' or 'auto', see ``resolve_dedupe``)
+    handles trips that appear more than once, within a file or across files
+    (see ``trip_keys``): the first one in file order is kept and later ones
+    are dropped or only counted. Cached partials keep their ZIP's trip keys
+    (8 bytes per trip); a ZIP that shares trips with an earlier one is
+    re-parsed without them.
+    """
+    dedupe = resolve_dedupe(dedupe, sample_rate)
+    if sample_rate < 1:
+        cache_dir = None
+    agg = new_totals(route_counters, validate_routes, aggregators, dedupe)
+    names = agg['aggregators']
+    task_args = (chunk_rows, names, sample_rate, dedupe)
+    cache_complete = names == tuple(AGGREGATORS)
+    live_entries = set()
+    cache_hits = 0
+
+    # Resolve the cache first so the pool only sees work that has to be done
+    plan = []
+    tasks = []
+    for zf_path in zip_files:
+        entry = None
+        part = None
+        if cache_dir is not None:
+            profile_source(os.path.basename(zf_path))
+            with stage('cache_read'):
+                entry = cache_entry(cache_dir, file_digest(zf_path))
+                live_entries.add(entry)
+                part = load_cached(entry)
+            if part is not None and part['dedupe'] != dedupe:
+                part = None
+        members = []
+        if part is None:
+            try:
+                members = list_members(zf_path)
+            except Exception as e:
+                print(f"  ERROR with {os.path.basename(zf_path)}: {e}")
+                traceback.print_exc()
+                continue
+            tasks.extend((zf_path, m) + task_args for m in members)
+        else:
+            cache_hits += 1
+        plan.append((zf_path, entry, part, len(members)))
+
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        results = pool.map(process_member, tasks)
+    else:
+        results = map(process_member, tasks)
+
+    member_tasks = iter(tasks)
+    try:
+        for idx, (zf_path, entry, part, n_members) in enumerate(plan):
+            cached = part is not None
+            if not cached:
+                part = new_aggregates(names, dedupe)
+                complete = cache_complete
+                for _ in range(n_members):
+                    member, error = next(results)
+                    task = next(member_tasks)
+                    if error is not None:
+                        print(f"  ERROR with {os.path.basename(zf_path)}: {error}")
+                        complete = False
+                    with stage('merge'):
+                        merge_deduped(part, member, functools.partial(_rerun_member, task))
+                profile_source(os.path.basename(zf_path))
+                if entry is not None and complete:
+                    with stage('cache_write'):
+                        store_cached(entry, part)
+
+            before, duplicates = agg['total_trips'], agg['duplicates']
+            with stage('merge'):
+                merged = merge_deduped(agg, part, functools.partial(_rerun_zip, zf_path, task_args))
+            for csv_name, n in merged['members']:
+                before += n
+                note = ' [cached]' if merged is part and cached else ''
+                print(f"  [{idx+1}/{len(zip_files)}] {csv_name}: {n:,} rows (total: {before:,}){note}")
+            if agg['duplicates'] > duplicates:
+                print(f"  {os.path.basename(zf_path)}: {agg['duplicates'] - duplicates:,} trips seen before "
+                      f"({'dropped' if dedupe == 'drop' else 'counted again'})")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if cache_dir is not None:
+        pruned = prune_cache(cache_dir, live_entries)
+        print(f"Cache: {cache_hits}/{len(zip_files)} ZIPs reused, {pruned} stale entries removed ({cache_dir})")
+    if sample_rate < 1:
+        scale_aggregates(agg, sample_rate)
+    return agg
+
+
+# ============================================================
+# Columnar trip store
+# ============================================================
+# Layout of --store DIR:
+#   manifest.json               station / bike type dictionaries and, per
+#                               source ZIP (by SHA-256), its members and parts
+#   YYYY-MM/<digest[:16]>/*.npy one column per TRIP_STORE_DTYPES entry for the
+#                               trips of that ZIP starting in that month
+# Dictionaries only grow, so codes in existing parts stay valid when ZIPs
+# are added or removed.
+STORE_VERSION = 3
+
+
+def load_store_manifest(store_dir):
+    path = os.path.join(store_dir, 'manifest.json')
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = None
+    if manifest is not None and manifest.get('version') == STORE_VERSION:
+        return manifest
+    if manifest is not None:
+        print(f"  Trip store {store_dir} has an old layout, rebuilding")
+        for month_dir in glob.glob(os.path.join(store_dir, '[0-9][0-9][0-9][0-9]-[0-9][0-9]')):
+            shutil.rmtree(month_dir)
+    return {'version': STORE_VERSION, 'stations': {'names': [], 'aliases': {}},
+            'bike_types': [], 'sources': {}}
+
+
+def save_store_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def store_dictionaries(manifest):
+    """(StationIndex, NameIndex of bike types) recorded in a store manifest."""
+    stations = StationIndex()
+    stations.__setstate__(manifest['stations'])
+    bike_types = NameIndex()
+    bike_types.__setstate__({'names': manifest['bike_types']})
+    return stations, bike_types
+
+
+def write_part(path, trips):
+    tmp = path + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    for col, dtype in TRIP_STORE_DTYPES.items():
+        np.save(os.path.join(tmp, f'{col}.npy'), np.ascontiguousarray(trips[col], dtype=dtype))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def open_part(path):
+    """Memory-map the columns of one store partition (see ``TRIP_STORE_DTYPES``)."""
+    return {col: np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r') for col in TRIP_STORE_DTYPES}
+
+
+def remove_part(store_dir, part):
+    shutil.rmtree(os.path.join(store_dir, part), ignore_errors=True)
+    month_dir = os.path.join(store_dir, os.path.dirname(part))
+    if os.path.isdir(month_dir) and not os.listdir(month_dir):
+        os.rmdir(month_dir)
+
+
+def extract_member(task):
+    """Encode one (zip, csv member, chunk rows) task for the store. Returns (extract, error).
+
+    Codes in the extract refer to its own dictionaries; ``sync_store``
+    re-keys them into the store's.
+    """
+    zf_path, csv_name, chunk_rows = task
+    stations, bike_types = StationIndex(), NameIndex()
+    batches = []
+    profile_source(csv_name)
+    try:
+        with zipfile.ZipFile(zf_path, 'r') as z:
+            with z.open(csv_name) as f:
+                for trips in read_trips(f, chunk_rows):
+                    with stage('encode', len(trips)):
+                        batches.append(encode_trips(trips, stations, bike_types))
+    except Exception as e:
+        return None, f"{e}\n{traceback.format_exc()}"
+    trips = {col: np.concatenate([b[col] for b in batches] or [np.zeros(0, dtype)])
+             for col, dtype in TRIP_STORE_DTYPES.items()}
+    return {'trips': trips, 'stations': stations, 'bike_types': bike_types,
+            'member': (csv_name, len(trips['start']))}, None
+
+
+def sync_store(store_dir, zip_files, workers=1, chunk_rows=CHUNK_ROWS):
+    """Bring the trip store in ``store_dir`` in line with ``zip_files``.
+
+    Only ZIPs whose contents are not in the store yet are parsed; parts of
+    ZIPs that changed or disappeared are deleted.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = load_store_manifest(store_dir)
+    sources = manifest['sources']
+    stations, bike_types = store_dictionaries(manifest)
+
+    digests = {zf_path: file_digest(zf_path) for zf_path in zip_files}
+    live = set(digests.values())
+    removed = 0
+    for digest in [d for d in sources if d not in live]:
+        for part in sources.pop(digest)['parts']:
+            remove_part(store_dir, part)
+        removed += 1
+
+    plan = []
+    tasks = []
+    for zf_path in zip_files:
+        if digests[zf_path] in sources:
+            continue
+        try:
+            members = list_members(zf_path)
+        except Exception as e:
+            print(f"  ERROR with {os.path.basename(zf_path)}: {e}")
+            traceback.print_exc()
+            continue
+        tasks.extend((zf_path, m, chunk_rows) for m in members)
+        plan.append((zf_path, len(members)))
+
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        results = pool.map(extract_member, tasks)
+    else:
+        results = map(extract_member, tasks)
+
+    try:
+        for idx, (zf_path, n_members) in enumerate(plan):
+            batches, members, complete = [], [], True
+            for _ in range(n_members):
+                extract, error = next(results)
+                if error is not None:
+                    print(f"  ERROR with {os.path.basename(zf_path)}: {error}")
+                    complete = False
+                    continue
+                # Re-key into the store dictionaries
+                trips = extract['trips']
+                remap = stations.intern(extract['stations'].names)
+                stations.alias(extract['stations'].aliases.keys(),
+                               remap[list(extract['stations'].aliases.values())].tolist())
+                trips['start_station'] = _recode(trips['start_station'], remap)
+                trips['end_station'] = _recode(trips['end_station'], remap)
+                trips['bike'] = _recode(trips['bike'], bike_types.intern(extract['bike_types'].names),
+                                        np.uint8, BIKE_NONE)
+                batches.append(trips)
+                members.append(extract['member'])
+            if not complete:
+                continue  # retried on the next run
+
+            # Partition by start month
+            profile_source(os.path.basename(zf_path))
+            with stage('store_write') as st:
+                trips = {col: np.concatenate([b[col] for b in batches] or [np.zeros(0, dtype)])
+                         for col, dtype in TRIP_STORE_DTYPES.items()}
+                month, _ = calendar_codes(trips['start'].view('datetime64[s]'))
+                order = np.argsort(month, kind='stable')
+                months, first = np.unique(month[order], return_index=True)
+                digest = digests[zf_path]
+                parts = []
+                for m, lo, hi in zip(months.tolist(), first, np.append(first[1:], len(order))):
+                    part = os.path.join(month_label(m), digest[:16])
+                    write_part(os.path.join(store_dir, part),
+                               {col: a[order[lo:hi]] for col, a in trips.items()})
+                    parts.append(part)
+                sources[digest] = {'zip': os.path.basename(zf_path), 'members': members, 'parts': parts}
+                manifest['stations'] = stations.__getstate__()
+                manifest['bike_types'] = bike_types.names
+                save_store_manifest(store_dir, manifest)
+                st.rows = len(order)
+            print(f"  [{idx+1}/{len(plan)}] {os.path.basename(zf_path)}: "
+                  f"{len(order):,} rows stored in {len(parts)} month partition(s)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    save_store_manifest(store_dir, manifest)
+    print(f"Trip store: {len(plan)} ZIPs added, {removed} removed, "
+          f"{len(sources) - len(plan)} unchanged ({store_dir})")
+    return manifest
+
+
+def aggregate_part(task, exclude=None):
+    """Aggregate one (store dir, partition, stations, bike types, aggregators, sample rate, dedupe) task.
+
+    Returns (partial, error); ``exclude`` works as in ``process_member``.
+    """
+    store_dir, name, stations, bike_types, aggregators, sample_rate, dedupe = task
+    path = os.path.join(store_dir, name)
+    part = new_aggregates(aggregators, dedupe)
+    part['stations'], part['bike_types'] = stations, bike_types
+    if exclude is not None:
+        part['trip_keys'].parent = exclude
+    profile_source(path)
+    try:
+        with stage('open_part') as st:
+            trips = open_part(path)
+            if sample_rate < 1:
+                if dedupe is None:
+                    keep = sample_mask(np.arange(len(trips['start'])), sample_rate, sample_seed(name))
+                else:
+                    keep = key_sample_mask(trips['key'], sample_rate, sample_seed(name))
+                trips = {col: a[keep] for col, a in trips.items()}
+            st.rows = len(trips['start'])
+        n = aggregate_batch(trips, part)
+        part['members'].append((path, n))
+    except Exception as e:
+        return part, f"{e}\n{traceback.format_exc()}"
+    finally:
+        if exclude is not None:
+            part['trip_keys'].parent = None
+    return part, None
+
+
+def _rerun_part(task, seen):
+    """``aggregate_part`` again with the trips of ``seen`` excluded (the ``redo`` of ``merge_deduped``)."""
+    part, error = aggregate_part(task, seen)
+    if error is not None:
+        print(f"  ERROR with {task[1]}: {error}")
+    return part
+
+
+def aggregate_store(store_dir, workers=1, route_counters=0, validate_routes=False, aggregators=None,
+                    sample_rate=1.0, dedupe='auto'):
+    """Aggregate every partition of a trip store, month by month.
+
+    Partitions are memory-mapped and fed straight to ``aggregate_batch``; no
+    CSV is parsed. Partials are merged in partition order whatever the
+    worker count. ``sample_rate`` and ``dedupe`` work as in ``ingest``, with
+    the first copy of a trip in partition order kept.
+    """
+    dedupe = resolve_dedupe(dedupe, sample_rate)
+    manifest = load_store_manifest(store_dir)
+    stations, bike_types = store_dictionaries(manifest)
+    agg = new_totals(route_counters, validate_routes, aggregators, dedupe)
+    agg['stations'], agg['bike_types'] = stations, bike_types
+    parts = sorted(p for source in manifest['sources'].values() for p in source['parts'])
+    tasks = [(store_dir, p, stations, bike_types, agg['aggregators'], sample_rate, dedupe) for p in parts]
+
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        results = pool.map(aggregate_part, tasks)
+    else:
+        results = map(aggregate_part, tasks)
+
+    try:
+        for idx, (name, task, (part, error)) in enumerate(zip(parts, tasks, results)):
+            if error is not None:
+                print(f"  ERROR with {name}: {error}")
+            duplicates = agg['duplicates']
+            with stage('merge'):
+                part = merge_deduped(agg, part, functools.partial(_rerun_part, task))
+            n = sum(rows for _, rows in part['members'])
+            note = (f" [{agg['duplicates'] - duplicates:,} trips seen before]"
+                    if agg['duplicates'] > duplicates else '')
+            print(f"  [{idx+1}/{len(parts)}] {name}: {n:,} rows (total: {agg['total_trips']:,}){note}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if sample_rate < 1:
+        scale_aggregates(agg, sample_rate)
+    return agg
+
+
+# ============================================================
+# Activity cube
+# ============================================================
+# Dense trips / duration totals over every combination of
+# station x month x day of week x hour x user type, built from the trip
+# store and written as memory-mapped .npy files plus cube.json (dimension
+# labels). Trips without a start station are left out. Query it with
+# scripts/activity_cube.py.
+CUBE_VERSION = 1
+CUBE_DIMS = ('station', 'month', 'dow', 'hour', 'user_type')
+
+
+def build_cube(store_dir, cube_dir, dedupe='drop'):
+    """Write the activity cube for every trip in the store that has a start station.
+
+    With ``dedupe`` 'drop' repeated trips count once, as in ``aggregate_store``.
+    """
+    manifest = load_store_manifest(store_dir)
+    stations, _ = store_dictionaries(manifest)
+    parts = sorted(p for source in manifest['sources'].values() for p in source['parts'])
+    months = [month_index(os.path.dirname(p)) for p in parts]
+    first = min(months, default=0)
+    n_months = max(months, default=-1) - first + 1
+    shape = (len(stations), n_months, 7, 24, len(USER_TYPES))
+    cells = 7 * 24 * len(USER_TYPES)
+
+    os.makedirs(cube_dir, exist_ok=True)
+    arrays = {'trips': np.uint32, 'dur_sum': np.float32}
+    cube = {name: np.lib.format.open_memmap(os.path.join(cube_dir, f'{name}.npy.tmp'), mode='w+',
+                                            dtype=dtype, shape=shape)
+            for name, dtype in arrays.items()}
+    seen = TripKeySet()
+    for p, m in zip(parts, months):
+        trips = open_part(os.path.join(store_dir, p))
+        if dedupe == 'drop':
+            new = seen.add_new(trips['key'])
+            trips = {col: a[new] for col, a in trips.items()}
+        s = trips['start_station']
+        ok = s >= 0
+        _, how = calendar_codes(trips['start'].view('datetime64[s]'))
+        codes = (s[ok].astype(np.int64) * (7 * 24) + how[ok]) * len(USER_TYPES) + trips['user'][ok]
+        block = shape[:1] + shape[2:]
+        counts = np.bincount(codes, minlength=len(stations) * cells)
+        dur = np.bincount(codes, weights=trips['duration'][ok], minlength=len(stations) * cells)
+        cube['trips'][:, m - first] += counts.reshape(block).astype(np.uint32)
+        cube['dur_sum'][:, m - first] += dur.reshape(block).astype(np.float32)
+    for a in cube.values():
+        a.flush()
+    del cube, a
+    for name in arrays:
+        os.replace(os.path.join(cube_dir, f'{name}.npy.tmp'), os.path.join(cube_dir, f'{name}.npy'))
+
+    meta = {
+        'version': CUBE_VERSION,
+        'dims': CUBE_DIMS,
+        'shape': shape,
+        'arrays': {name: f'{name}.npy' for name in arrays},
+        'labels': {
+            'station': stations.names,
+            'month': [month_label(first + i) for i in range(n_months)],
+            'dow': DOW_NAMES,
+            'hour': list(range(24)),
+            'user_type': USER_TYPES,
+        },
+    }
+    with open(os.path.join(cube_dir, 'cube.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+# ============================================================
+# Origin-destination matrix
+# ============================================================
+# Every (start station, end station) pair with its trip count and summed
+# duration in seconds, as CSR over station ids: the destinations of station
+# i are indices[indptr[i]:indptr[i + 1]], with trips and dur_sum alongside,
+# and ``stations`` names the ids. Written with np.savez_compressed next to
+# the JSON; build_dashboard.py takes each station's top origins and
+# destinations from it.
+OD_VERSION = 1
+
+
+def od_matrix(agg):
+    """CSR arrays of the exact route totals in ``agg``; None when only a route sketch was kept."""
+    route = agg.get('route_exact', agg['route'])
+    if isinstance(route, SpaceSaving):
+        return None
+    names = agg['stations'].names
+    start, end = unpack_pair(route.keys)  # keys are sorted, so rows come out grouped by start id
+    indptr = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(start, minlength=len(names)), out=indptr[1:])
+    return {
+        'version': np.int32(OD_VERSION),
+        'stations': np.array(names, dtype=str),
+        'indptr': indptr,
+        'indices': end.astype(np.int32),
+        'trips': route.column('trips').astype(np.uint32),
+        'dur_sum': route.column('dur_sum'),
+    }
+
+
+def od_json_size(od):
+    """Bytes the OD pairs would take as ``top_routes``-style JSON rows."""
+    names = od['stations'].tolist()
+    start = np.repeat(np.arange(len(names)), np.diff(od['indptr']))
+    rows = [{'start_station_name': names[a], 'end_station_name': names[b],
+             'trip_count': int(n), 'avg_duration': _avg(d, n)}
+            for a, b, n, d in zip(start.tolist(), od['indices'].tolist(), od['trips'].tolist(),
+                                  od['dur_sum'].tolist())]
+    return len(json.dumps(rows))
+
+
+# ============================================================
+# Station heatmaps
+# ============================================================
+# Departures and arrivals of every station per SLOT_MINUTES slot of the
+# week: ``departures[i, dow, slot]`` for station ``stations[i]``, Monday
+# first. Written with np.savez_compressed next to the JSON, like the OD
+# matrix; build_dashboard.py shows the grid of the selected station.
+HEATMAP_VERSION = 1
+
+
+def station_heatmaps(agg):
+    """Arrays for station_heatmaps.npz from the ``heatmap`` aggregator's totals."""
+    names = agg['stations'].names
+    ns = len(names)
+    return {
+        'version': np.int32(HEATMAP_VERSION),
+        'slot_minutes': np.int32(SLOT_MINUTES),
+        'stations': np.array(names, dtype=str),
+        'departures': _fit(agg['slot_depart'], ns)[:ns].reshape(ns, 7, DAY_SLOTS),
+        'arrivals': _fit(agg['slot_arrive'], ns)[:ns].reshape(ns, 7, DAY_SLOTS),
+    }
 
-print(f"\nTotal trips processed: {total_trips:,}")
 
 # ============================================================
 # Build output dicts
 # ============================================================
-print("Building output...")
-
-# Monthly
-monthly_list = []
-for ym in sorted(monthly_agg.keys()):
-    a = monthly_agg[ym]
-    monthly_list.append({
-        'year_month': ym, 'total_trips': a['trips'],
-        'avg_duration': round(a['dur_sum'] / a['trips'], 1) if a['trips'] > 0 else 0,
-        'trips_Subscriber': a['sub'], 'trips_Customer': a['cust'],
-        'bike_classic': a['classic'], 'bike_electric': a['electric'], 'bike_docked': a['docked'],
-    })
-
-# Hourly
-hourly_list = []
-for h in range(24):
-    a = hourly_agg.get(h, {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0})
-    hourly_list.append({
-        'hour': h, 'total_trips': a['trips'],
-        'avg_duration': round(a['dur_sum'] / a['trips'], 1) if a['trips'] > 0 else 0,
-        'trips_Subscriber': a['sub'], 'trips_Customer': a['cust'],
-    })
-
-# Day of week
-dow_names = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-dow_list = []
-for d in range(7):
-    a = dow_agg.get(d, {'trips': 0, 'dur_sum': 0, 'sub': 0, 'cust': 0})
-    dow_list.append({
-        'day_of_week': d, 'day_name': dow_names[d], 'total_trips': a['trips'],
-        'avg_duration': round(a['dur_sum'] / a['trips'], 1) if a['trips'] > 0 else 0,
-        'trips_Subscriber': a['sub'], 'trips_Customer': a['cust'],
-    })
-
-# Stations
-station_list = []
-for sname, a in station_depart.items():
-    if a['trips'] < 10:
-        continue
-    lat = a['lat_sum'] / a['coord_count']
-    lng = a['lng_sum'] / a['coord_count']
-    arrivals = station_arrive.get(sname, 0)
-    station_list.append({
-        'station_name': sname, 'lat': round(lat, 6), 'lng': round(lng, 6),
-        'total_departures': a['trips'], 'total_arrivals': arrivals,
-        'total_activity': a['trips'] + arrivals,
-        'net_flow': arrivals - a['trips'],
-        'avg_duration_depart': round(a['dur_sum'] / a['trips'], 1),
-        'subscriber_departures': a['sub'], 'customer_departures': a['cust'],
-        'subscriber_pct': round(a['sub'] / a['trips'] * 100, 1) if a['trips'] > 0 else 0,
-    })
-
-station_list.sort(key=lambda x: x['total_activity'], reverse=True)
-
-# Top routes
-route_list = sorted(route_agg.items(), key=lambda x: x[1]['trips'], reverse=True)[:100]
-top_routes = []
-for (s, e), v in route_list:
-    top_routes.append({
-        'start_station_name': s, 'end_station_name': e,
-        'trip_count': v['trips'],
-        'avg_duration': round(v['dur_sum'] / v['trips'], 1) if v['trips'] > 0 else 0,
-    })
-
-# Station monthly (top 50 stations only)
-top50_names = set(s['station_name'] for s in station_list[:50])
-station_monthly_list = []
-for (sname, ym), cnt in station_monthly_agg.items():
-    if sname in top50_names:
-        station_monthly_list.append({'station_name': sname, 'year_month': ym, 'trips': cnt})
-
-# Yearly
-yearly_list = []
-for y in sorted(yearly_agg.keys()):
-    a = yearly_agg[y]
-    if pd.isna(y):
-        continue
-    yearly_list.append({
-        'year': int(y), 'total_trips': a['trips'],
-        'avg_duration': round(a['dur_sum'] / a['trips'], 1) if a['trips'] > 0 else 0,
-        'unique_stations': len(a['start_stations'] | a['end_stations']),
-    })
-
-# Bike type
-bike_type_list = []
-for bt, a in bike_type_agg.items():
-    bike_type_list.append({
-        'rideable_type': bt, 'total_trips': a['trips'],
-        'avg_duration': round(a['dur_sum'] / a['trips'], 1) if a['trips'] > 0 else 0,
-    })
-
-# Summary
-sub_trips = sum(a['sub'] for a in station_depart.values())
-summary = {
-    'total_trips': total_trips,
-    'date_range_start': str(min_date.date()) if min_date else 'N/A',
-    'date_range_end': str(max_date.date()) if max_date else 'N/A',
-    'total_stations': len(station_list),
-    'subscriber_pct': round(sub_trips / total_trips * 100, 1) if total_trips > 0 else 0,
-}
+def _avg(dur_sum, trips):
+    return round(dur_sum / trips, 1) if trips > 0 else 0
+
+
+def _quantile_fields(q):
+    """JSON fields for one row of ``duration_quantiles`` output (None = no trips)."""
+    if q is None:
+        return {'median_duration': 0, 'p90_duration': 0}
+    return {'median_duration': int(round(q[0])), 'p90_duration': int(round(q[1]))}
+
+
+def _packed_quantiles(table):
+    """{entity: quantiles} for a histogram ``PackedTable`` keyed by (entity, bin)."""
+    entity, bins = unpack_pair(table.keys)
+    entities, qs = duration_quantiles(entity, bins, table.column('trips'))
+    return dict(zip(entities.tolist(), qs))
+
+
+def _dense_quantiles(hist):
+    """{row: quantiles} for an entity x bin histogram array."""
+    entities, qs = duration_quantiles(*_dense_bins(hist))
+    return dict(zip(entities.tolist(), qs))
+
+
+def _route_quantiles(table):
+    """{packed route key: quantiles} for the route histogram table."""
+    start, b = unpack_pair(table.keys)
+    entities, qs = duration_quantiles(pack_pair(start, b // HIST_BINS), b % HIST_BINS, table.column('trips'))
+    return dict(zip(entities.tolist(), qs))
+
+
+def build_output(agg):
+    """Turn merged aggregates into the ``dashboard_data.json`` structure (the keys of its aggregators).
+
+    Output of a sampled run also has a ``sample`` key: {approximate, rate, sampled_trips}.
+    """
+    results = {}
+    for name in agg['aggregators']:
+        results.update(AGGREGATORS[name].finalize(agg))
+    if agg['sample'] is not None:
+        results['sample'] = {'approximate': True, **agg['sample']}
+    return ordered_output(results)
+
+
+def ordered_output(results):
+    """``results`` with the OUTPUT_KEYS first, in that order, then any other keys."""
+    output = {key: results[key] for key in OUTPUT_KEYS if key in results}
+    output.update(results)
+    return output
+
+
+def top_route_ids(route, n=TOP_ROUTES):
+    return np.argsort(-route.column('trips'), kind='stable')[:n]
+
+
+def route_sketch_bounds(route, n=TOP_ROUTES):
+    """Error bounds for the top ``n`` routes of a SpaceSaving summary."""
+    trips = route.column('trips')
+    seen = route.column('observed')
+    order = np.argsort(-trips, kind='stable')
+    top, rest = order[:n], order[n:]
+    # No route outside the reported top n can have more trips than this
+    outside = max(route.floor, trips[rest].max() if len(rest) else 0)
+    return {
+        'counters': route.capacity,
+        'untracked_max_trips': int(route.floor),
+        'max_overcount': int((trips[top] - seen[top]).max()) if len(top) else 0,
+        # Routes whose lower bound beats every other route's upper bound
+        'guaranteed_in_top': int((seen[top] >= outside).sum()),
+    }
+
+
+def validate_route_sketch(agg, n=TOP_ROUTES):
+    """Compare the SpaceSaving top ``n`` with exact counts. Returns True if every bound held."""
+    exact, sketch = agg['route_exact'], agg['route']
+    exact_top = exact.keys[top_route_ids(exact, n)]
+    idx = top_route_ids(sketch, n)
+    sketch_top = sketch.keys[idx]
+    true = exact.column('trips')[np.searchsorted(exact.keys, sketch_top)]
+    upper = sketch.column('trips')[idx]
+    lower = sketch.column('observed')[idx]
+    violations = int(((true < lower) | (true > upper)).sum())
+    recall = len(np.intersect1d(exact_top, sketch_top)) / max(len(exact_top), 1)
+    print(f"Route sketch vs exact ({len(sketch)} counters, {len(exact):,} exact routes):")
+    print(f"  top-{n} recall: {recall:.1%}")
+    print(f"  max |estimate - exact|: {int(np.abs(upper - true).max()) if len(idx) else 0}")
+    print(f"  bound violations: {violations}")
+    return violations == 0
 
-output = {
-    'summary': summary,
-    'monthly': monthly_list,
-    'stations': station_list,
-    'hourly': hourly_list,
-    'dow': dow_list,
-    'top_routes': top_routes,
-    'station_monthly': station_monthly_list,
-    'yearly': yearly_list,
-    'bike_type': bike_type_list,
-}
 
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -300,11 +2692,163 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return super().default(obj)
 
-out_path = args.output
-with open(out_path, 'w') as f:
-    json.dump(output, f, cls=NumpyEncoder)
 
-file_size = os.path.getsize(out_path)
-print(f"\nDone! JSON: {file_size / 1024 / 1024:.1f} MB")
-print(f"Summary: {json.dumps(summary, indent=2)}")
-print(f"Stations: {len(station_list)}, Monthly records: {len(monthly_list)}")
+def main():
+    parser = argparse.ArgumentParser(description='Preprocess Bay Wheels trip data')
+    parser.add_argument('--data-dir', default='./data/', help='Directory containing ZIP/CSV files')
+    parser.add_argument('--output', default='./dashboard_data.json', help='Output JSON path')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Per-ZIP aggregate cache directory (default: .preprocess_cache next to --output)')
+    parser.add_argument('--no-cache', action='store_true', help='Re-parse every ZIP and leave the cache untouched')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parallel worker processes for uncached CSVs (0 = one per CPU); '
+                             'each worker holds one CSV chunk in memory at a time')
+    parser.add_argument('--route-counters', type=int, default=0,
+                        help='Track routes in a fixed-size heavy-hitter summary of this many counters '
+                             'instead of exact counts (0 = exact)')
+    parser.add_argument('--validate-routes', action='store_true',
+                        help='With --route-counters, also count routes exactly and compare the top routes')
+    parser.add_argument('--store', default=None,
+                        help='Columnar trip store directory: add new ZIPs to it, then aggregate from the store '
+                             'instead of the CSVs (the per-ZIP cache is not used)')
+    parser.add_argument('--cube', default=None,
+                        help='With --store, also write the station x month x dow x hour x user type '
+                             'activity cube to this directory (see scripts/activity_cube.py)')
+    parser.add_argument('--od-output', default=None,
+                        help='Origin-destination matrix path (default: od_matrix.npz next to --output)')
+    parser.add_argument('--heatmap-output', default=None,
+                        help='Per-station heatmap path (default: station_heatmaps.npz next to --output)')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='REPORT',
+                        help='Time every stage (decompress, CSV parse, datetime parse, filter, each '
+                             'aggregator block, JSON write) per file; writes a JSON report (default: '
+                             'preprocess_profile.json next to --output) and prints a summary. Runs serially')
+    parser.add_argument('--only', default=None, metavar='NAMES',
+                        help=f"Comma-separated aggregators to run ({', '.join(AGGREGATORS)}), e.g. "
+                             "monthly,hourly for a quick refresh without routes; their keys replace those "
+                             "in an existing --output and the other keys are kept. New ZIPs are not cached")
+    parser.add_argument('--sample-rate', type=float, default=1.0, metavar='RATE',
+                        help='Read only this share of the rows (e.g. 0.02), picked by a deterministic hash of '
+                             'each row position and skipped before parsing, and scale every count up; the output '
+                             'is flagged approximate. For quick previews; the per-ZIP cache is not used')
+    parser.add_argument('--dedupe', choices=('auto', 'drop', 'report', 'off'), default='auto',
+                        help='Trips that appear more than once (a re-uploaded or overlapping month), matched by '
+                             'ride_id or, in legacy files, start time, duration, station and bike: drop all but '
+                             'the first, only report them, or skip the check. auto (default) drops them, except '
+                             'with --sample-rate; drop or report there samples by trip key, which parses every row')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help=f'CSV rows parsed per chunk; bounds peak memory per worker (default: {CHUNK_ROWS:,})')
+    args = parser.parse_args()
+    if args.cube and not args.store:
+        parser.error('--cube is built from the trip store; pass --store as well')
+    if not 0 < args.sample_rate <= 1:
+        parser.error('--sample-rate must be in (0, 1]')
+    aggregators = None
+    if args.only is not None:
+        try:
+            aggregators = resolve_aggregators([n.strip() for n in args.only.split(',') if n.strip()])
+        except ValueError as e:
+            parser.error(str(e))
+
+    data_dir = args.data_dir
+    work_dir = os.path.dirname(args.output) or '.'
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(work_dir, '.preprocess_cache'))
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    if args.profile is not None:
+        global PROFILE
+        PROFILE = StageProfile()
+        if workers > 1:
+            print("--profile: running serially so every stage is timed in this process")
+            workers = 1
+
+    zip_files = sorted(glob.glob(os.path.join(data_dir, "*.zip")))
+    print(f"Found {len(zip_files)} zip files")
+
+    if args.store:
+        sync_store(args.store, zip_files, workers=workers, chunk_rows=args.chunk_rows)
+        agg = aggregate_store(args.store, workers=workers, route_counters=args.route_counters,
+                              validate_routes=args.validate_routes, aggregators=aggregators,
+                              sample_rate=args.sample_rate, dedupe=args.dedupe)
+        if args.cube:
+            meta = build_cube(args.store, args.cube, resolve_dedupe(args.dedupe))
+            size = sum(os.path.getsize(os.path.join(args.cube, f)) for f in meta['arrays'].values())
+            print(f"Activity cube: {' x '.join(map(str, meta['shape']))} cells, "
+                  f"{size / 1024 / 1024:.1f} MB ({args.cube})")
+    else:
+        agg = ingest(zip_files, cache_dir=cache_dir, workers=workers, chunk_rows=args.chunk_rows,
+                     route_counters=args.route_counters, validate_routes=args.validate_routes,
+                     aggregators=aggregators, sample_rate=args.sample_rate, dedupe=args.dedupe)
+    if agg['duplicates']:
+        print(f"\nDuplicate trips: {agg['duplicates']:,} rows repeated an earlier trip "
+              f"({'dropped' if agg['dedupe'] == 'drop' else 'kept; --dedupe drop leaves them out'})")
+    if agg['snapped'].any():
+        print(f"\nDockless trips snapped to the nearest station within {SNAP_RADIUS_M} m: "
+              f"{agg['snapped'][0]:,} starts, {agg['snapped'][1]:,} ends")
+    if agg['sample'] is not None:
+        print(f"\nSampled {agg['sample']['sampled_trips']:,} trips at rate {args.sample_rate:g}; "
+              f"counts are scaled by {1 / args.sample_rate:g} and the output is flagged approximate")
+        if agg['dedupe'] is None and args.dedupe == 'auto':
+            print("Trips repeated across files are not checked in a sampled preview; --dedupe drop checks "
+                  "them too, at the cost of parsing every row")
+    print(f"\nTotal trips processed: {agg['total_trips']:,}")
+    routes_ok = True
+    if 'route_exact' in agg:
+        routes_ok = validate_route_sketch(agg)
+
+    print("Building output...")
+    profile_source('(output)')
+    with stage('build_output'):
+        output = build_output(agg)
+
+    out_path = args.output
+    if aggregators is not None and os.path.exists(out_path):
+        # Partial refresh: keep the keys of the aggregators that did not run
+        with open(out_path) as f:
+            previous = json.load(f)
+        refreshed = {key for name in aggregators for key in AGGREGATORS[name].outputs}
+        print(f"Updating {', '.join(output)} in {out_path}")
+        output = ordered_output({**{k: v for k, v in previous.items() if k not in refreshed}, **output})
+    with stage('json_write'):
+        with open(out_path, 'w') as f:
+            json.dump(output, f, cls=NumpyEncoder)
+
+    file_size = os.path.getsize(out_path)
+    print(f"\nDone! JSON: {file_size / 1024 / 1024:.1f} MB")
+
+    od = od_matrix(agg) if 'routes' in agg['aggregators'] else None
+    if 'routes' not in agg['aggregators']:
+        print("OD matrix not written: --only leaves out routes")
+    elif od is None:
+        print("OD matrix not written: --route-counters only keeps a route sketch "
+              "(add --validate-routes to also count routes exactly)")
+    else:
+        od_path = args.od_output or os.path.join(work_dir, 'od_matrix.npz')
+        with stage('od_write', len(od['indices'])):
+            np.savez_compressed(od_path, **od)
+        od_size = os.path.getsize(od_path)
+        print(f"OD matrix: {len(od['indices']):,} station pairs, {od_size / 1024 / 1024:.1f} MB ({od_path}); "
+              f"as JSON rows {od_json_size(od) / 1024 / 1024:.1f} MB, "
+              f"dashboard_data.json {file_size / 1024 / 1024:.1f} MB")
+    if 'heatmap' in agg['aggregators']:
+        heatmap_path = args.heatmap_output or os.path.join(work_dir, 'station_heatmaps.npz')
+        with stage('heatmap_write'):
+            np.savez_compressed(heatmap_path, **station_heatmaps(agg))
+        print(f"Station heatmaps: {len(agg['stations'])} stations x 7 days x {DAY_SLOTS} slots, "
+              f"{os.path.getsize(heatmap_path) / 1024 / 1024:.1f} MB ({heatmap_path})")
+    if 'summary' in output:
+        print(f"Summary: {json.dumps(output['summary'], indent=2)}")
+    print(f"Stations: {len(output.get('stations', ()))}, Monthly records: {len(output.get('monthly', ()))}")
+    if 'route_sketch' in output:
+        print(f"Route sketch: {json.dumps(output['route_sketch'])}")
+    if PROFILE is not None:
+        report = PROFILE.report()
+        profile_path = args.profile or os.path.join(work_dir, 'preprocess_profile.json')
+        with open(profile_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print_profile(report)
+        print(f"Profile report: {profile_path}")
+    if not routes_ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()